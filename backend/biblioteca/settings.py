@@ -50,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # El primero, para medir la petición completa
+    'biblioteca_app.instrumentacion.InstrumentacionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -58,7 +60,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'biblioteca_app.middleware.StaticFilesMiddleware',
 ]
 
 # CORS settings
@@ -112,6 +114,31 @@ DATABASES = {
 }
 
 
+# Cache
+# locmem para desarrollo; con varios workers usar FileBasedCache o RedisCache
+# (p. ej. CACHE_BACKEND=django.core.cache.backends.redis.RedisCache, CACHE_LOCATION=redis://127.0.0.1:6379).
+# Con locmem la versión del catálogo se guarda en la base de datos para que todos los
+# workers invaliden a la vez (una consulta por lectura de la versión)
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'biblioteca'),
+    }
+}
+
+# Alias de caché usado por el contexto del asistente y demás cachés del catálogo
+BIBLIOTECA_CACHE_ALIAS = os.environ.get('BIBLIOTECA_CACHE_ALIAS', 'default')
+BIBLIOTECA_CACHE_CONTEXTO_TTL = int(os.environ.get('BIBLIOTECA_CACHE_CONTEXTO_TTL', 3600))
+# Listados del catálogo ya renderizados para peticiones anónimas (la clave incluye la versión)
+BIBLIOTECA_CACHE_HTTP_TTL = int(os.environ.get('BIBLIOTECA_CACHE_HTTP_TTL', 300))
+
+# Caché en memoria de respuestas del modelo (TTL en segundos y número máximo de entradas)
+BIBLIOTECA_CACHE_RESPUESTAS_TTL = int(os.environ.get('BIBLIOTECA_CACHE_RESPUESTAS_TTL', 3600))
+BIBLIOTECA_CACHE_RESPUESTAS_MAX = int(os.environ.get('BIBLIOTECA_CACHE_RESPUESTAS_MAX', 1024))
+BIBLIOTECA_PRECARGAR_RESPUESTAS = os.environ.get('BIBLIOTECA_PRECARGAR_RESPUESTAS', 'True').lower() == 'true'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -159,10 +186,70 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Gemini API Configuration
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
 
+# Máximo de llamadas simultáneas al modelo por proceso: limita las vistas asíncronas y
+# los cupos de las síncronas (sin cupo libre se responde al momento con la alternativa local)
+BIBLIOTECA_MAX_LLAMADAS_MODELO = int(os.environ.get('BIBLIOTECA_MAX_LLAMADAS_MODELO', 8))
+
+# Modelo de Gemini que usa el asistente
+BIBLIOTECA_MODELO = os.environ.get('BIBLIOTECA_MODELO', 'models/gemini-2.5-flash')
+
+# Cliente del modelo: plazo por llamada (s), reintentos de errores transitorios y
+# circuit breaker (fallos seguidos para abrirlo y segundos que permanece abierto)
+BIBLIOTECA_MODELO_TIMEOUT = float(os.environ.get('BIBLIOTECA_MODELO_TIMEOUT', 20))
+BIBLIOTECA_MODELO_REINTENTOS = int(os.environ.get('BIBLIOTECA_MODELO_REINTENTOS', 2))
+BIBLIOTECA_MODELO_UMBRAL_FALLOS = int(os.environ.get('BIBLIOTECA_MODELO_UMBRAL_FALLOS', 5))
+BIBLIOTECA_MODELO_APERTURA = float(os.environ.get('BIBLIOTECA_MODELO_APERTURA', 30))
+# Segundos como máximo para una llamada con todos sus reintentos
+BIBLIOTECA_MODELO_PRESUPUESTO = float(os.environ.get('BIBLIOTECA_MODELO_PRESUPUESTO', 25))
+
+# Exportación incremental: la marca devuelta retrocede la duración máxima de una transacción
+# de escritura (segundos), para no perder filas fechadas antes que confirman más tarde
+BIBLIOTECA_EXPORTACION_MARGEN = float(os.environ.get('BIBLIOTECA_EXPORTACION_MARGEN', 60))
+
+# Búsqueda semántica: 'hashing' (sin dependencias), 'sentence-transformers' o ruta a una clase
+BIBLIOTECA_EMBEDDER = os.environ.get('BIBLIOTECA_EMBEDDER', 'hashing')
+BIBLIOTECA_EMBEDDER_OPCIONES = {}
+BIBLIOTECA_VECTORES_DIR = os.environ.get('BIBLIOTECA_VECTORES_DIR', str(BASE_DIR / 'vectores'))
+
+# Prompt del asistente: presupuesto de tokens, libros candidatos y recuperación ('texto' o 'hibrida')
+BIBLIOTECA_PROMPT_MAX_TOKENS = int(os.environ.get('BIBLIOTECA_PROMPT_MAX_TOKENS', 3000))
+BIBLIOTECA_PROMPT_MAX_LIBROS = int(os.environ.get('BIBLIOTECA_PROMPT_MAX_LIBROS', 60))
+BIBLIOTECA_PROMPT_RECUPERACION = os.environ.get('BIBLIOTECA_PROMPT_RECUPERACION', 'texto')
+
+# Instrumentación (biblioteca_app/instrumentacion.py): umbrales en segundos y fracción de
+# peticiones perfiladas con cProfile (0 = ninguna)
+BIBLIOTECA_PETICION_LENTA = float(os.environ.get('BIBLIOTECA_PETICION_LENTA', 1.0))
+BIBLIOTECA_UMBRAL_CONSULTAS_REPETIDAS = int(os.environ.get('BIBLIOTECA_UMBRAL_CONSULTAS_REPETIDAS', 10))
+BIBLIOTECA_PERFIL_MUESTREO = float(os.environ.get('BIBLIOTECA_PERFIL_MUESTREO', 0.0))
+BIBLIOTECA_PERFIL_UMBRAL = float(os.environ.get('BIBLIOTECA_PERFIL_UMBRAL', 1.0))
+# /metrics exige 'Authorization: Bearer <token>'; sin token solo se sirve con DEBUG
+BIBLIOTECA_METRICS_TOKEN = os.environ.get('BIBLIOTECA_METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'biblioteca_app.instrumentacion.FormatoJSON'},
+    },
+    'handlers': {
+        'consola_json': {'class': 'logging.StreamHandler', 'formatter': 'json'},
+    },
+    'loggers': {
+        'biblioteca': {
+            'handlers': ['consola_json'],
+            'level': os.environ.get('BIBLIOTECA_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# Tamaño máximo de página que puede pedir el cliente (?page_size=)
+PAGINACION_MAX_TAMANO = int(os.environ.get('PAGINACION_MAX_TAMANO', 100))
+
 
 # Rest Framework Settings
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'biblioteca_app.paginacion.PaginacionBiblioteca',
     'PAGE_SIZE': 10,
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
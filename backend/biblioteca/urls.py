@@ -17,7 +17,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from biblioteca_app.instrumentacion import vista_metricas
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', vista_metricas, name='metrics'),
     path('api/', include('biblioteca_app.urls')),
 ]
@@ -27,13 +27,11 @@ class ReservaAdmin(admin.ModelAdmin):
     actions = ['cancelar_reservas', 'completar_reservas']
     
     def cancelar_reservas(self, request, queryset):
-        for reserva in queryset:
-            reserva.cancelar()
-        self.message_user(request, f"{queryset.count()} reservas canceladas")
+        cantidad = queryset.bulk_cancelar()
+        self.message_user(request, f"{cantidad} reservas canceladas")
     cancelar_reservas.short_description = "Cancelar reservas seleccionadas"
     
     def completar_reservas(self, request, queryset):
-        for reserva in queryset:
-            reserva.completar()
-        self.message_user(request, f"{queryset.count()} reservas completadas")
+        cantidad = queryset.bulk_completar()
+        self.message_user(request, f"{cantidad} reservas completadas")
     completar_reservas.short_description = "Completar reservas seleccionadas"
@@ -1,117 +1,220 @@
-import google.generativeai as genai
+import asyncio
+import logging
+import weakref
+from functools import cached_property
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from .models import Libro, Categoria, Reserva
-import json
-import re
+from .models import Libro
+from .cache_respuestas import clave_respuesta, obtener_cache_respuestas
+from .cache_catalogo import contadores
+from .estadisticas import obtener_estadisticas
+from .cliente_modelo import ModeloNoDisponible, ModeloResiliente, errores_transitorios, obtener_modelo
+from .prompts import construir_prompt, recuperar_libros
+from .salida_modelo import CONFIGURACION_JSON, RESPUESTA_NO_INTERPRETADA, interpretar_respuesta
+from .streaming import CAMPOS_TEXTO, ExtractorIncremental
+from .titulos import resolver_libros
+from .similares import libros_vecinos
+from .vectores import libros_similares
 from django.utils import timezone
 
+logger = logging.getLogger("biblioteca.modelo")
+
+_semaforos = weakref.WeakKeyDictionary()
+
+
+def semaforo_modelo():
+    """Limita las llamadas concurrentes al modelo dentro del bucle de eventos actual"""
+    bucle = asyncio.get_running_loop()
+    semaforo = _semaforos.get(bucle)
+    if semaforo is None:
+        semaforo = _semaforos[bucle] = asyncio.Semaphore(
+            getattr(settings, 'BIBLIOTECA_MAX_LLAMADAS_MODELO', 8)
+        )
+    return semaforo
+
+
+# Libros que devuelve la respuesta local cuando el modelo no está disponible
+LIBROS_RESPUESTA_LOCAL = 10
+
+
 class BibliotecarioIA:
-    def __init__(self):
-        # Configurar Gemini API
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel('models/gemini-2.5-flash')
+    def __init__(self, model=None):
+        if model is not None:
+            self.model = ModeloResiliente(model)
+
+    @cached_property
+    def model(self):
+        """
+        Cliente compartido del proceso (ver cliente_modelo.obtener_modelo). Se
+        resuelve al primer uso: las acciones que no llaman al modelo no importan
+        genai ni necesitan GEMINI_API_KEY.
+        """
+        return obtener_modelo()
     
     def procesar_consulta(self, consulta):
         try:
-            libros = Libro.objects.all()
-            categorias = Categoria.objects.all()
-            reservas_activas = Reserva.objects.filter(estado='activa').select_related('libro')
-            
-            # Crear contexto con información de la biblioteca
-            contexto_libros = "\n".join([
-                f"Libro: {libro.titulo}, Autor: {libro.autor}, Categoría: {libro.categoria.nombre if libro.categoria else 'Sin categoría'}, " +
-                f"Disponible: {'Sí' if libro.disponible else 'No'}, " +
-                f"Estado de reserva: {'Reservado' if libro.reservas.filter(estado='activa').exists() else 'Libre'}, " +
-                f"Fecha de ingreso: {libro.fecha_creacion.strftime('%Y-%m-%d')}"
-                for libro in libros[:20]  # Limitar a los primeros 20 libros para no exceder el límite de tokens
-            ])
-            
-            contexto_categorias = ", ".join([cat.nombre for cat in categorias])
-            
-            # Estadísticas de reservas
-            total_reservas = reservas_activas.count()
-            libros_reservados = reservas_activas.values_list('libro__titulo', flat=True)[:8]
-            
-            prompt = f"""
-            Eres el asistente de una biblioteca digital. Tu objetivo es ayudar a los usuarios a encontrar libros y recursos, así como gestionar consultas sobre reservas.
-            
-            Información de la biblioteca:
-            Categorías disponibles: {contexto_categorias}
-            Total de reservas activas: {total_reservas}
-            Libros más reservados recientemente: {', '.join(libros_reservados) if libros_reservados else 'Ninguno'}
-            
-            Algunos libros disponibles:
-            {contexto_libros}
-            
-            La consulta del usuario es: "{consulta}"
-            
-            Puedes responder sobre:
-            - Búsqueda de libros por título, autor, categoría o tema
-            - Estado de disponibilidad de libros
-            - Información sobre reservas (cuántos libros están reservados, cuáles están disponibles)
-            - Recomendaciones de libros
-            - Preguntas generales sobre el funcionamiento de la biblioteca
-            
-            Si la consulta parece ser una búsqueda de libros, responde con formato JSON que contenga:
-            1. Una lista de libros recomendados basados en la consulta
-            2. Una explicación amigable de tu respuesta
-            3. Sugerencias relacionadas
-            
-            Formato del JSON para búsqueda:
-            {{"tipo": "busqueda", "recomendaciones": ["título1", "título2"], "explicacion": "texto explicativo", "sugerencias": ["sugerencia1", "sugerencia2"]}}
-            
-            Si la consulta es sobre reservas o disponibilidad, responde con este formato:
-            {{"tipo": "reservas", "respuesta": "información sobre reservas", "libros_disponibles": ["título1", "título2"], "libros_no_disponibles": ["título3", "título4"]}}
-            
-            IMPORTANTE para consultas de reservas:
-            - Si el usuario pregunta por libros DISPONIBLES, incluye solo la lista "libros_disponibles"
-            - Si el usuario pregunta por libros NO DISPONIBLES, RESERVADOS o PRESTADOS, incluye solo la lista "libros_no_disponibles"
-            - Si el usuario pregunta por TODOS los libros o no especifica, incluye ambas listas
-            - Incluye el título exacto de los libros tal como aparecen en la información proporcionada
-            
-            Si la consulta es una pregunta general sobre la biblioteca o cómo usarla, responde con formato JSON:
-            {{"tipo": "informacion", "respuesta": "tu respuesta detallada aquí"}}
-            
-            Responde basándote únicamente en la información proporcionada arriba a menos que la consulta explícitamente pida otra cosa.
-            
-            IMPORTANTE: Responde únicamente con el JSON, sin formato markdown, sin backticks, y sin texto adicional.
-            """
-            
-            response = self.model.generate_content(prompt)
-
-            print("Respuesta de Gemini:", response.text)  # Para depuración
-            
-            # Extraer el JSON de la respuesta
-            json_response = response.text
+            clave = clave_respuesta(consulta)
+            return obtener_cache_respuestas().obtener_o_calcular(
+                clave, lambda: self._generar_respuesta(consulta)
+            )
+        except Exception as e:
+            return {
+                "tipo": "error",
+                "respuesta": f"Ocurrió un error: {str(e)}"
+            }
 
-            try:
-                respuesta_json = json.loads(json_response)
-                return respuesta_json
-            except json.JSONDecodeError:
-                return {
-                    "tipo": "informacion",
-                    "respuesta": "No pude procesar tu consulta. Por favor, intenta reformularla."
-                }
-                
+    async def procesar_consulta_async(self, consulta):
+        """Versión asíncrona de procesar_consulta para las vistas ASGI"""
+        try:
+            clave = await sync_to_async(clave_respuesta)(consulta)
+            cache_respuestas = await sync_to_async(obtener_cache_respuestas)()
+            return await cache_respuestas.obtener_o_calcular_async(
+                clave, lambda: self._generar_respuesta_async(consulta)
+            )
         except Exception as e:
             return {
                 "tipo": "error",
                 "respuesta": f"Ocurrió un error: {str(e)}"
             }
+
+    def procesar_consulta_stream(self, consulta):
+        """
+        Genera eventos ('texto', {campo, delta}) a medida que el modelo responde
+        y termina con ('resultado', resultado) o ('error', resultado).
+        """
+        try:
+            clave = clave_respuesta(consulta)
+            cache_respuestas = obtener_cache_respuestas()
+            resultado = cache_respuestas.obtener(clave)
+            if resultado is not None:
+                yield from self._eventos_cacheados(resultado)
+                return
+
+            prompt = self._construir_prompt(consulta)
+            extractor = ExtractorIncremental()
+            try:
+                for fragmento in self.model.generate_content(prompt, stream=True, generation_config=CONFIGURACION_JSON):
+                    for campo, delta in extractor.alimentar(fragmento.text):
+                        yield 'texto', {"campo": campo, "delta": delta}
+            except (ModeloNoDisponible, *errores_transitorios()):
+                # Si ya se envió texto no se puede sustituir la respuesta
+                if extractor.texto:
+                    raise
+                yield from self._eventos_cacheados(self._respuesta_local(consulta))
+                return
+
+            resultado, cacheable = self._interpretar_respuesta(extractor.texto)
+            if cacheable:
+                cache_respuestas.guardar(clave, resultado)
+            yield 'resultado', resultado
+        except Exception as e:
+            yield 'error', {"tipo": "error", "respuesta": f"Ocurrió un error: {str(e)}"}
+
+    async def procesar_consulta_stream_async(self, consulta):
+        """Versión asíncrona de procesar_consulta_stream"""
+        try:
+            clave = await sync_to_async(clave_respuesta)(consulta)
+            cache_respuestas = await sync_to_async(obtener_cache_respuestas)()
+            resultado = cache_respuestas.obtener(clave)
+            if resultado is not None:
+                for evento in self._eventos_cacheados(resultado):
+                    yield evento
+                return
+
+            prompt = await sync_to_async(self._construir_prompt)(consulta)
+            extractor = ExtractorIncremental()
+            try:
+                async with semaforo_modelo():
+                    respuesta = await self.model.generate_content_async(prompt, stream=True, generation_config=CONFIGURACION_JSON)
+                    async for fragmento in respuesta:
+                        for campo, delta in extractor.alimentar(fragmento.text):
+                            yield 'texto', {"campo": campo, "delta": delta}
+            except (ModeloNoDisponible, *errores_transitorios()):
+                if extractor.texto:
+                    raise
+                for evento in self._eventos_cacheados(await sync_to_async(self._respuesta_local)(consulta)):
+                    yield evento
+                return
+
+            resultado, cacheable = self._interpretar_respuesta(extractor.texto)
+            if cacheable:
+                cache_respuestas.guardar(clave, resultado)
+            yield 'resultado', resultado
+        except Exception as e:
+            yield 'error', {"tipo": "error", "respuesta": f"Ocurrió un error: {str(e)}"}
+
+    def _eventos_cacheados(self, resultado):
+        for campo in CAMPOS_TEXTO:
+            if isinstance(resultado, dict) and resultado.get(campo):
+                yield 'texto', {"campo": campo, "delta": resultado[campo]}
+        yield 'resultado', resultado
+
+    def _generar_respuesta(self, consulta):
+        """Consulta al modelo; devuelve (resultado, cacheable)"""
+        prompt = self._construir_prompt(consulta)
+        try:
+            response = self.model.generate_content(prompt, generation_config=CONFIGURACION_JSON)
+        except ModeloNoDisponible:
+            # No se cachea: en cuanto el modelo vuelva se le consulta de nuevo
+            return self._respuesta_local(consulta), False
+        return self._interpretar_respuesta(response.text)
+
+    async def _generar_respuesta_async(self, consulta):
+        prompt = await sync_to_async(self._construir_prompt)(consulta)
+        try:
+            async with semaforo_modelo():
+                response = await self.model.generate_content_async(prompt, generation_config=CONFIGURACION_JSON)
+        except ModeloNoDisponible:
+            return await sync_to_async(self._respuesta_local)(consulta), False
+        return self._interpretar_respuesta(response.text)
+
+    def _respuesta_local(self, consulta):
+        """Respuesta sin modelo: los libros del catálogo que mejor coinciden con la consulta"""
+        contadores.incrementar('modelo_respuestas_locales')
+        ids = recuperar_libros(consulta, LIBROS_RESPUESTA_LOCAL)
+        libros = Libro.objects.in_bulk(ids)
+        titulos = [libros[i].titulo for i in ids if i in libros]
+        if titulos:
+            explicacion = "El asistente no está disponible en este momento; estos son los libros del catálogo que coinciden con tu consulta."
+        else:
+            explicacion = "El asistente no está disponible en este momento y no encontré libros que coincidan con tu consulta. Inténtalo de nuevo en unos minutos."
+        return {
+            "tipo": "busqueda",
+            "recomendaciones": titulos,
+            "explicacion": explicacion,
+            "sugerencias": [],
+            "degradada": True,
+        }
+
+    def _construir_prompt(self, consulta):
+        prompt, _ = construir_prompt(consulta)
+        return prompt
+
+    def _interpretar_respuesta(self, texto):
+        logger.debug(
+            "Respuesta del modelo", extra={'datos': {'caracteres': len(texto or ''), 'texto': (texto or '')[:2000]}}
+        )
+        resultado, cacheable = interpretar_respuesta(texto)
+        if resultado is None:
+            # No se cachea para que un reintento vuelva a consultar al modelo
+            return dict(RESPUESTA_NO_INTERPRETADA), False
+        return resultado, cacheable
     
     def buscar_libros(self, consulta):
         """Busca libros basados en la consulta en lenguaje natural"""
         resultado = self.procesar_consulta(f"Buscar libros sobre: {consulta}")
-        
+        return self._resolver_libros(consulta, resultado)
+
+    async def buscar_libros_async(self, consulta):
+        resultado = await self.procesar_consulta_async(f"Buscar libros sobre: {consulta}")
+        return await sync_to_async(self._resolver_libros)(consulta, resultado)
+
+    def _resolver_libros(self, consulta, resultado):
+        """Convierte los títulos devueltos por el modelo en libros del catálogo"""
         # Manejar respuesta de tipo búsqueda
         if resultado.get("tipo") == "busqueda":
-            recomendaciones = resultado.get("recomendaciones", [])
-            libros_encontrados = []
-            
-            for titulo in recomendaciones:
-                # Búsqueda aproximada por título
-                libros = Libro.objects.filter(titulo__icontains=titulo)
-                libros_encontrados.extend(libros)
+            libros_encontrados = resolver_libros(resultado.get("recomendaciones", []))
             
             return {
                 "libros": libros_encontrados,
@@ -123,21 +226,12 @@ class BibliotecarioIA:
         elif resultado.get("tipo") == "reservas":
             libros_disponibles = resultado.get("libros_disponibles", [])
             libros_no_disponibles = resultado.get("libros_no_disponibles", [])
-            libros_encontrados = []
             
-            # Buscar libros disponibles
-            for titulo in libros_disponibles:
-                libros = Libro.objects.filter(titulo__iexact=titulo, disponible=True)
-                if not libros.exists():
-                    libros = Libro.objects.filter(titulo__icontains=titulo, disponible=True)
-                libros_encontrados.extend(libros)
-            
-            # Buscar libros no disponibles
-            for titulo in libros_no_disponibles:
-                libros = Libro.objects.filter(titulo__iexact=titulo, disponible=False)
-                if not libros.exists():
-                    libros = Libro.objects.filter(titulo__icontains=titulo, disponible=False)
-                libros_encontrados.extend(libros)
+            # Un índice en memoria resuelve todos los títulos; una consulta por lista
+            libros_encontrados = (
+                resolver_libros(libros_disponibles, disponible=True) +
+                resolver_libros(libros_no_disponibles, disponible=False)
+            )
             
             # Si no se especificaron listas, buscar según el contexto de la consulta
             if not libros_disponibles and not libros_no_disponibles:
@@ -166,22 +260,55 @@ class BibliotecarioIA:
             "sugerencias": []
         }
     
-    def obtener_sugerencias(self, libro_id):
-        """Genera sugerencias de libros relacionados"""
+    def obtener_sugerencias(self, libro_id, k=5, explicar=False):
+        """
+        Sugiere libros relacionados desde la tabla de similares precalculada (o
+        el índice semántico si el libro aún no tiene vecinos). Solo con
+        `explicar` se llama al modelo, para redactar la explicación.
+        """
         try:
             libro = Libro.objects.get(id=libro_id)
-            resultado = self.procesar_consulta(
-                f"Recomienda libros similares a '{libro.titulo}' de {libro.autor}"
-            )
-            return resultado
         except Libro.DoesNotExist:
             return {"tipo": "error", "respuesta": "Libro no encontrado"}
+        similares = libros_vecinos(libro.id, k) or libros_similares(libro.id, k)
+        explicacion = f"Libros del catálogo con temática parecida a '{libro.titulo}' de {libro.autor}."
+        if explicar and similares:
+            explicacion = self._explicar_sugerencias(libro, similares) or explicacion
+        return {
+            "tipo": "busqueda",
+            "recomendaciones": [similar.titulo for similar in similares],
+            "explicacion": explicacion,
+            "sugerencias": [],
+            "libros": [
+                {"id": similar.id, "titulo": similar.titulo, "autor": similar.autor, "similitud": similar.puntuacion}
+                for similar in similares
+            ]
+        }
+
+    async def obtener_sugerencias_async(self, libro_id, k=5, explicar=False):
+        return await sync_to_async(self.obtener_sugerencias)(libro_id, k, explicar)
+
+    def _explicar_sugerencias(self, libro, similares):
+        """Explicación redactada por el modelo (cacheada); None si el modelo falla"""
+        titulos = ', '.join(f"'{similar.titulo}' de {similar.autor}" for similar in similares)
+        prompt = (
+            f"En una o dos frases, explica a un lector de la biblioteca por qué si le gustó "
+            f"'{libro.titulo}' de {libro.autor} podrían interesarle: {titulos}. "
+            f"Responde solo con la explicación, sin formato."
+        )
+        try:
+            return obtener_cache_respuestas().obtener_o_calcular(
+                clave_respuesta(f"explicar sugerencias {libro.id} {[s.id for s in similares]}"),
+                lambda: (self.model.generate_content(prompt).text.strip(), True)
+            )
+        except Exception:
+            return None
     
     def consultar_disponibilidad(self, libro_id):
         """Consulta si un libro está disponible para reservar"""
         try:
-            libro = Libro.objects.get(id=libro_id)
-            reserva_activa = libro.reservas.filter(estado='activa').first()
+            libro = Libro.objects.select_related('reserva_activa').get(id=libro_id)
+            reserva_activa = libro.reserva_activa
             
             if libro.puede_reservarse():
                 return {
@@ -212,35 +339,8 @@ class BibliotecarioIA:
     def obtener_estadisticas_reservas(self):
         """Genera estadísticas sobre las reservas"""
         try:
-            total_libros = Libro.objects.count()
-            libros_disponibles = Libro.objects.filter(disponible=True).count()
-            reservas_activas = Reserva.objects.filter(estado='activa').count()
-            reservas_vencidas = Reserva.objects.filter(estado='vencida').count()
-            
-            # Libros más reservados
-            from django.db.models import Count
-            libros_populares = Libro.objects.annotate(
-                num_reservas=Count('reservas')
-            ).filter(num_reservas__gt=0).order_by('-num_reservas')[:5]
-            
-            return {
-                "tipo": "estadisticas",
-                "datos": {
-                    "total_libros": total_libros,
-                    "libros_disponibles": libros_disponibles,
-                    "libros_reservados": total_libros - libros_disponibles,
-                    "reservas_activas": reservas_activas,
-                    "reservas_vencidas": reservas_vencidas,
-                    "libros_populares": [
-                        {
-                            "titulo": libro.titulo,
-                            "autor": libro.autor,
-                            "num_reservas": libro.num_reservas
-                        }
-                        for libro in libros_populares
-                    ]
-                }
-            }
+            # Contadores mantenidos al escribir (estadisticas.py): no recorre las tablas
+            return {"tipo": "estadisticas", "datos": obtener_estadisticas()}
         except Exception as e:
             return {"tipo": "error", "respuesta": f"Error al obtener estadísticas: {str(e)}"}
 
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class BibliotecaAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'biblioteca_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        # Conecta el execute_wrapper a cada conexión nueva
+        from . import instrumentacion  # noqa: F401
@@ -0,0 +1,103 @@
+"""
+Variantes asíncronas de los endpoints del asistente de IA.
+
+Se sirven por ASGI (biblioteca/asgi.py): mientras esperan a Gemini no ocupan
+un hilo del servidor, así las peticiones al catálogo no quedan bloqueadas.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from .ai_bibliotecario import BibliotecarioIA
+from .cache_catalogo import version_catalogo
+from .models import Consulta
+from .serializers import serializar_libros_encontrados
+from .streaming import eventos_sse_async
+
+
+def obtener_bibliotecario():
+    return BibliotecarioIA()
+
+
+def _leer_consulta(request):
+    try:
+        datos = json.loads(request.body or b'{}')
+    except json.JSONDecodeError:
+        datos = request.POST
+    return datos.get('consulta', '') if hasattr(datos, 'get') else ''
+
+
+def _consulta_vacia():
+    return JsonResponse({"error": "La consulta no puede estar vacía"}, status=400)
+
+
+@csrf_exempt
+@require_POST
+async def consulta(request):
+    texto_consulta = _leer_consulta(request)
+    if not texto_consulta:
+        return _consulta_vacia()
+
+    bibliotecario = obtener_bibliotecario()
+    version = await sync_to_async(version_catalogo)()
+    resultado = await bibliotecario.procesar_consulta_async(texto_consulta)
+
+    await Consulta.objects.acreate(texto=texto_consulta, respuesta=str(resultado), version_catalogo=version)
+    return JsonResponse(resultado, safe=False)
+
+
+@csrf_exempt
+@require_POST
+async def buscar_libros(request):
+    texto_consulta = _leer_consulta(request)
+    if not texto_consulta:
+        return _consulta_vacia()
+
+    bibliotecario = obtener_bibliotecario()
+    resultado = await bibliotecario.buscar_libros_async(texto_consulta)
+
+    libros_serializados = await sync_to_async(serializar_libros_encontrados)(resultado["libros"], request)
+
+    return JsonResponse({
+        "libros": libros_serializados,
+        "explicacion": resultado["explicacion"],
+        "sugerencias": resultado["sugerencias"]
+    })
+
+
+async def _respuesta_stream(request, buscar):
+    texto_consulta = _leer_consulta(request)
+    if not texto_consulta:
+        return _consulta_vacia()
+
+    bibliotecario = obtener_bibliotecario()
+    response = StreamingHttpResponse(
+        eventos_sse_async(bibliotecario, texto_consulta, request, buscar=buscar),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@csrf_exempt
+@require_POST
+async def consulta_stream(request):
+    return await _respuesta_stream(request, buscar=False)
+
+
+@csrf_exempt
+@require_POST
+async def buscar_libros_stream(request):
+    return await _respuesta_stream(request, buscar=True)
+
+
+@require_GET
+async def sugerencias(request, pk):
+    bibliotecario = obtener_bibliotecario()
+    explicar = request.GET.get('explicar') in ('1', 'true')
+    resultado = await bibliotecario.obtener_sugerencias_async(pk, explicar=explicar)
+    return JsonResponse(resultado, safe=False)
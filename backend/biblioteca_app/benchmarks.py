@@ -0,0 +1,208 @@
+"""
+Escenarios de benchmark de los puntos calientes de la API.
+
+Cada escenario es una petición (con el cliente de pruebas de Django, pasando
+por todo el middleware) o una llamada directa a una pieza interna (serializers,
+construcción del prompt). Se mide en tres pasadas independientes para que
+ninguna medida contamine a otra: latencia, consultas SQL y pico de memoria
+(tracemalloc). El modelo de lenguaje es un ModeloFalso determinista.
+
+ejecutar_escenarios() devuelve un diccionario serializable a JSON; el comando
+benchmark_suite lo escribe en un fichero para comparar ejecuciones entre commits.
+"""
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .ai_bibliotecario import BibliotecarioIA
+from .cache_catalogo import obtener_cache
+from .cache_respuestas import obtener_cache_respuestas
+from .datos_sinteticos import PALABRAS
+from .models import Libro, Reserva
+from .modelo_falso import ModeloFalso
+from .prompts import construir_prompt
+from .serializers import LibroDetalleSerializer, ReservaSerializer
+
+PERCENTILES = (50, 95, 99)
+
+# Repeticiones de las pasadas de consultas y de memoria (no necesitan tantas como la latencia)
+REPETICIONES_PERFIL = 5
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+class ErrorEscenario(Exception):
+    pass
+
+
+class Escenario:
+    """
+    `ejecutar(i)` hace la iteración i-ésima; `preparar(i)`, si existe, se
+    ejecuta antes y fuera de la medida. `estado` es el código HTTP esperado
+    (None si el escenario no es una petición).
+    """
+
+    def __init__(self, nombre, ejecutar, preparar=None, estado=200):
+        self.nombre = nombre
+        self.ejecutar = ejecutar
+        self.preparar = preparar
+        self.estado = estado
+
+    def iteracion(self, i):
+        if self.preparar is not None:
+            self.preparar(i)
+        inicio = time.perf_counter()
+        resultado = self.ejecutar(i)
+        segundos = time.perf_counter() - inicio
+        if self.estado is not None and resultado.status_code != self.estado:
+            raise ErrorEscenario(f"{self.nombre}: respuesta {resultado.status_code}, se esperaba {self.estado}")
+        return segundos
+
+
+def medir(escenario, repeticiones, calentamiento=3):
+    """Latencias (ms), consultas por iteración y pico de memoria (KiB) de un escenario"""
+    for i in range(calentamiento):
+        escenario.iteracion(i)
+    siguiente = calentamiento
+
+    tiempos = []
+    for i in range(siguiente, siguiente + repeticiones):
+        tiempos.append(escenario.iteracion(i) * 1000)
+    siguiente += repeticiones
+
+    consultas = []
+    for i in range(siguiente, siguiente + REPETICIONES_PERFIL):
+        reset_queries()
+        with CaptureQueriesContext(connection) as capturadas:
+            escenario.iteracion(i)
+        consultas.append(len(capturadas.captured_queries))
+    siguiente += REPETICIONES_PERFIL
+
+    picos = []
+    tracemalloc.start()
+    try:
+        for i in range(siguiente, siguiente + REPETICIONES_PERFIL):
+            tracemalloc.reset_peak()
+            antes = tracemalloc.get_traced_memory()[0]
+            escenario.iteracion(i)
+            picos.append(tracemalloc.get_traced_memory()[1] - antes)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'repeticiones': repeticiones,
+        **{f'p{p}_ms': round(percentil(tiempos, p), 3) for p in PERCENTILES},
+        'media_ms': round(statistics.fmean(tiempos), 3),
+        'consultas': statistics.median(consultas),
+        'memoria_pico_kib': round(max(picos) / 1024, 1),
+    }
+
+
+def construir_escenarios(libro_ids):
+    """Los escenarios sobre un catálogo ya generado (`libro_ids`: los libros sintéticos)"""
+    client = Client()
+    cache = obtener_cache()
+    titulos = list(Libro.objects.filter(id__in=libro_ids[:5]).values_list('titulo', flat=True))
+    modelo = ModeloFalso(respuesta={
+        "tipo": "busqueda",
+        "recomendaciones": titulos,
+        "explicacion": "Libros del catálogo relacionados con la consulta.",
+        "sugerencias": ["Más del mismo autor"],
+    })
+    bibliotecario = BibliotecarioIA(model=modelo)
+    libres = iter(Libro.objects.filter(id__in=libro_ids, disponible=True).values_list('id', flat=True))
+    activas = Reserva.objects.filter(estado='activa', libro_id__in=libro_ids)
+    # Se recorren las primeras 50 páginas, o las que haya con los filtros en catálogos pequeños
+    paginas_libros = max(1, min(50, len(libro_ids) // 20))
+    paginas_reservas = max(1, min(50, Reserva.objects.count() // 20))
+
+    def sin_cache(i):
+        # Mide el camino completo (queryset, serializer, render), no la caché HTTP.
+        # benchmark_suite usa una LocMemCache propia: vaciarla no afecta a otros procesos
+        cache.clear()
+
+    def palabra(i):
+        return PALABRAS[i % len(PALABRAS)]
+
+    def atrasar(i):
+        # Veinte reservas activas pasan su vencimiento antes de cada barrido
+        ids = list(activas.filter(fecha_vencimiento__gte=timezone.now()).values_list('id', flat=True)[:20])
+        Reserva.objects.filter(id__in=ids).update(fecha_vencimiento=timezone.now() - timedelta(hours=1))
+
+    def consulta(i):
+        obtener_cache_respuestas().vaciar()
+        with mock.patch('biblioteca_app.views.BibliotecarioIA', return_value=bibliotecario):
+            return client.post(
+                '/api/bibliotecario/consulta/', {'consulta': f'Recomiéndame libros de {palabra(i)}'},
+                content_type='application/json',
+            )
+
+    def reservar(i):
+        return client.post(
+            f'/api/libros/{next(libres)}/reservar/',
+            {'usuario_nombre': 'Benchmark', 'usuario_email': 'benchmark@example.com'},
+            content_type='application/json',
+        )
+
+    def serializar_libros(i):
+        libros = Libro.objects.select_related('categoria', 'reserva_activa').filter(id__in=libro_ids[i:i + 20])
+        return LibroDetalleSerializer(libros, many=True).data
+
+    def serializar_reservas(i):
+        reservas = Reserva.objects.select_related('libro').order_by('-fecha_reserva')[i * 50:(i + 1) * 50]
+        return ReservaSerializer(reservas, many=True).data
+
+    return [
+        Escenario('libros_lista', lambda i: client.get('/api/libros/', {'page': i % paginas_libros + 1}), sin_cache),
+        Escenario('libros_lista_cache', lambda i: client.get('/api/libros/', {'page': 1})),
+        Escenario('libros_filtros', lambda i: client.get(
+            '/api/libros/', {'categoria': 'sintética', 'disponible': 'true', 'page': i % paginas_libros + 1}
+        ), sin_cache),
+        Escenario('libros_busqueda', lambda i: client.get('/api/libros/', {'q': palabra(i)}), sin_cache),
+        Escenario('libro_detalle', lambda i: client.get(f'/api/libros/{libro_ids[i % len(libro_ids)]}/'), sin_cache),
+        Escenario('reservas_lista', lambda i: client.get('/api/reservas/', {'page': i % paginas_reservas + 1})),
+        Escenario('reservar', reservar, estado=201),
+        Escenario('verificar_vencidas', lambda i: client.post('/api/reservas/verificar_vencidas/'), atrasar),
+        Escenario('estadisticas', lambda i: client.get('/api/bibliotecario/estadisticas/')),
+        Escenario('bibliotecario_consulta', consulta),
+        Escenario('serializar_libros', serializar_libros, estado=None),
+        Escenario('serializar_reservas', serializar_reservas, estado=None),
+        Escenario('construir_prompt', lambda i: construir_prompt(f'Libros sobre {palabra(i)} y {palabra(i + 7)}'),
+                  estado=None),
+    ]
+
+
+def ejecutar_escenarios(escenarios, repeticiones, calentamiento=3, seleccion=None, progreso=None):
+    resultados = {}
+    for escenario in escenarios:
+        if seleccion and escenario.nombre not in seleccion:
+            continue
+        resultados[escenario.nombre] = medir(escenario, repeticiones, calentamiento)
+        if progreso is not None:
+            progreso(escenario.nombre, resultados[escenario.nombre])
+    return resultados
+
+
+def comparar(anteriores, actuales):
+    """Cociente actual/anterior de p50, p95 y consultas por escenario común"""
+    cambios = {}
+    for nombre, actual in actuales.items():
+        anterior = anteriores.get(nombre)
+        if anterior is None:
+            continue
+        cambios[nombre] = {
+            campo: round(actual[campo] / anterior[campo], 3) if anterior[campo] else None
+            for campo in ('p50_ms', 'p95_ms', 'consultas')
+        }
+    return cambios
@@ -0,0 +1,211 @@
+"""
+Índice de texto completo para el catálogo de libros.
+
+Usa una tabla virtual FTS5 en SQLite y una tabla con columna tsvector e índice
+GIN en PostgreSQL. El texto se normaliza en Python (minúsculas y sin acentos)
+antes de indexarse, así ambos motores tokenizan igual las consultas en español.
+"""
+import re
+import unicodedata
+
+from django.db import connection
+
+from .cache_catalogo import invalidar_catalogo
+
+TABLA_FTS = 'biblioteca_app_libro_fts'
+
+# Peso relativo de cada columna al ordenar resultados (título > autor > sinopsis)
+PESOS = {'titulo': 10.0, 'autor': 5.0, 'sinopsis': 1.0}
+
+
+def normalizar_texto(texto):
+    """Pasa a minúsculas y elimina acentos/diacríticos"""
+    if not texto:
+        return ''
+    descompuesto = unicodedata.normalize('NFKD', str(texto).lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def tokenizar(texto):
+    """Devuelve los términos normalizados de una consulta"""
+    return re.findall(r'\w+', normalizar_texto(texto))
+
+
+def _documento(libro):
+    return (
+        normalizar_texto(libro.titulo),
+        normalizar_texto(libro.autor),
+        normalizar_texto(libro.sinopsis),
+    )
+
+
+class IndiceSQLite:
+    """Índice basado en una tabla virtual FTS5 (rowid = id del libro)"""
+
+    SQL_CREAR = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} "
+        "USING fts5(titulo, autor, sinopsis, tokenize='unicode61 remove_diacritics 2')",
+    ]
+    SQL_BORRAR = f"DROP TABLE IF EXISTS {TABLA_FTS}"
+
+    def indexar(self, libros):
+        filas = [(libro.id, *_documento(libro)) for libro in libros]
+        if not filas:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {TABLA_FTS} WHERE rowid = %s", [(f[0],) for f in filas])
+            cursor.executemany(
+                f"INSERT INTO {TABLA_FTS} (rowid, titulo, autor, sinopsis) VALUES (%s, %s, %s, %s)",
+                filas
+            )
+
+    def eliminar(self, libro_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {TABLA_FTS} WHERE rowid = %s", [(i,) for i in libro_ids])
+
+    def vaciar(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABLA_FTS}")
+
+    @staticmethod
+    def _expresion(terminos, cualquiera=False):
+        # Cada término como prefijo para que funcione mientras el usuario escribe
+        return (' OR ' if cualquiera else ' ').join(f'"{t}"*' for t in terminos)
+
+    def buscar(self, texto, limite, cualquiera=False):
+        """Ids de los libros que contienen todos los términos (o alguno, con `cualquiera`)"""
+        terminos = tokenizar(texto)
+        if not terminos:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH %s "
+                f"ORDER BY bm25({TABLA_FTS}, %s, %s, %s) LIMIT %s",
+                [self._expresion(terminos, cualquiera), PESOS['titulo'], PESOS['autor'], PESOS['sinopsis'], limite]
+            )
+            return [fila[0] for fila in cursor.fetchall()]
+
+    def filtrar(self, queryset, texto):
+        """
+        Une el queryset con la tabla FTS: los demás filtros, el orden por
+        relevancia (bm25, menor es mejor) y el COUNT se resuelven en el mismo SQL.
+        """
+        terminos = tokenizar(texto)
+        if not terminos:
+            return queryset.none()
+        tabla = queryset.model._meta.db_table
+        return queryset.extra(
+            tables=[TABLA_FTS],
+            where=[f"{TABLA_FTS}.rowid = {tabla}.id", f"{TABLA_FTS} MATCH %s"],
+            params=[self._expresion(terminos)],
+            select={'relevancia': f"bm25({TABLA_FTS}, %s, %s, %s)"},
+            select_params=[PESOS['titulo'], PESOS['autor'], PESOS['sinopsis']],
+        ).order_by('relevancia', 'id')
+
+
+class IndicePostgres:
+    """Índice basado en una columna tsvector con índice GIN"""
+
+    SQL_CREAR = [
+        f"CREATE TABLE IF NOT EXISTS {TABLA_FTS} ("
+        "libro_id bigint PRIMARY KEY REFERENCES biblioteca_app_libro(id) ON DELETE CASCADE, "
+        "documento tsvector NOT NULL)",
+        f"CREATE INDEX IF NOT EXISTS {TABLA_FTS}_gin ON {TABLA_FTS} USING GIN (documento)",
+    ]
+    SQL_BORRAR = f"DROP TABLE IF EXISTS {TABLA_FTS}"
+
+    SQL_DOCUMENTO = (
+        "setweight(to_tsvector('spanish', %s), 'A') || "
+        "setweight(to_tsvector('spanish', %s), 'B') || "
+        "setweight(to_tsvector('spanish', %s), 'D')"
+    )
+
+    def indexar(self, libros):
+        filas = [(libro.id, *_documento(libro)) for libro in libros]
+        if not filas:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {TABLA_FTS} (libro_id, documento) VALUES (%s, {self.SQL_DOCUMENTO}) "
+                "ON CONFLICT (libro_id) DO UPDATE SET documento = EXCLUDED.documento",
+                filas
+            )
+
+    def eliminar(self, libro_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABLA_FTS} WHERE libro_id = ANY(%s)", [list(libro_ids)])
+
+    def vaciar(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {TABLA_FTS}")
+
+    @staticmethod
+    def _expresion(terminos, cualquiera=False):
+        return (' | ' if cualquiera else ' & ').join(f'{t}:*' for t in terminos)
+
+    def buscar(self, texto, limite, cualquiera=False):
+        terminos = tokenizar(texto)
+        if not terminos:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT libro_id FROM {TABLA_FTS}, to_tsquery('spanish', %s) consulta "
+                "WHERE documento @@ consulta ORDER BY ts_rank(documento, consulta) DESC LIMIT %s",
+                [self._expresion(terminos, cualquiera), limite]
+            )
+            return [fila[0] for fila in cursor.fetchall()]
+
+    def filtrar(self, queryset, texto):
+        """Une el queryset con la tabla tsvector (filtro, orden por ts_rank y COUNT en el mismo SQL)"""
+        terminos = tokenizar(texto)
+        if not terminos:
+            return queryset.none()
+        tabla = queryset.model._meta.db_table
+        expresion = self._expresion(terminos)
+        return queryset.extra(
+            tables=[TABLA_FTS],
+            where=[
+                f"{TABLA_FTS}.libro_id = {tabla}.id",
+                f"{TABLA_FTS}.documento @@ to_tsquery('spanish', %s)",
+            ],
+            params=[expresion],
+            select={'relevancia': f"ts_rank({TABLA_FTS}.documento, to_tsquery('spanish', %s))"},
+            select_params=[expresion],
+        ).order_by('-relevancia', 'id')
+
+
+BACKENDS = {
+    'sqlite': IndiceSQLite,
+    'postgresql': IndicePostgres,
+}
+
+
+def obtener_indice(vendor=None):
+    """Devuelve el índice para el motor de base de datos actual, o None si no hay soporte"""
+    clase = BACKENDS.get(vendor or connection.vendor)
+    return clase() if clase else None
+
+
+def reconstruir_indice(tamano_lote=2000):
+    """Vacía y vuelve a llenar el índice con todo el catálogo"""
+    from .models import Libro
+
+    indice = obtener_indice()
+    if indice is None:
+        return 0
+
+    indice.vaciar()
+    total = 0
+    lote = []
+    for libro in Libro.objects.only('id', 'titulo', 'autor', 'sinopsis').iterator(chunk_size=tamano_lote):
+        lote.append(libro)
+        if len(lote) >= tamano_lote:
+            indice.indexar(lote)
+            total += len(lote)
+            lote = []
+    if lote:
+        indice.indexar(lote)
+        total += len(lote)
+    # Las búsquedas cacheadas (p. ej. las páginas de /libros/?q=) ya no son válidas
+    invalidar_catalogo()
+    return total
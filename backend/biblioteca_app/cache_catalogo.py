@@ -0,0 +1,179 @@
+"""
+Caché versionada del contexto del catálogo para el asistente de IA.
+
+El resumen de la biblioteca para el prompt (categorías y reservas) se guarda en
+la caché de Django bajo la versión actual del catálogo. Las señales de escritura
+sobre Libro, Categoria y Reserva incrementan la versión, de modo que las entradas
+antiguas dejan de usarse sin tener que borrarlas una a una.
+
+La versión tiene que ser la misma para todos los workers. Con una caché
+compartida (Redis, Memcached, fichero, base de datos) vive en la caché; con
+una local del proceso (LocMemCache, DummyCache) vive en la tabla
+VersionCompartida, y leerla cuesta una consulta por la clave primaria.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+
+CLAVE_VERSION = 'biblioteca:{nombre}:version'
+CLAVE_MODIFICADO = 'biblioteca:{nombre}:modificado'
+CLAVE_CONTEXTO = 'biblioteca:contexto:{version}'
+
+# Backends de caché que no comparten datos entre procesos
+CACHES_DEL_PROCESO = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+class Contadores:
+    """Contadores de aciertos/fallos en memoria del proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def incrementar(self, nombre, cantidad=1):
+        with self._lock:
+            self._valores[nombre] = self._valores.get(nombre, 0) + cantidad
+
+    def obtener(self):
+        with self._lock:
+            return dict(self._valores)
+
+    def reiniciar(self):
+        with self._lock:
+            self._valores.clear()
+
+
+contadores = Contadores()
+
+
+def obtener_cache():
+    return caches[getattr(settings, 'BIBLIOTECA_CACHE_ALIAS', 'default')]
+
+
+def _version_inicial():
+    # Basada en el reloj para que, si la caché se vacía, no se repitan versiones ya usadas
+    return int(time.time() * 1000)
+
+
+def version_en_bd():
+    """Si las versiones viven en la base de datos porque la caché no se comparte entre procesos"""
+    clase = type(obtener_cache())
+    return f'{clase.__module__}.{clase.__qualname__}' in CACHES_DEL_PROCESO
+
+
+def _fila_version(nombre):
+    from .models import VersionCompartida
+
+    fila = VersionCompartida.objects.filter(nombre=nombre).values_list('valor', 'modificado').first()
+    if fila is None:
+        fila, _ = VersionCompartida.objects.get_or_create(
+            nombre=nombre, defaults={'valor': _version_inicial(), 'modificado': int(time.time())}
+        )
+        fila = (fila.valor, fila.modificado)
+    return fila
+
+
+def estado_version(nombre='catalogo'):
+    """(versión, instante del último cambio en segundos desde la época); se crea si no existe"""
+    if version_en_bd():
+        return _fila_version(nombre)
+    cache = obtener_cache()
+    claves = CLAVE_VERSION.format(nombre=nombre), CLAVE_MODIFICADO.format(nombre=nombre)
+    valores = cache.get_many(claves)
+    if len(valores) < 2:
+        cache.add(claves[0], _version_inicial(), timeout=None)
+        cache.add(claves[1], int(time.time()), timeout=None)
+        valores = cache.get_many(claves)
+    return valores.get(claves[0]), valores.get(claves[1])
+
+
+def version_catalogo():
+    """Versión actual del catálogo (se crea si no existe)"""
+    return estado_version()[0]
+
+
+def catalogo_modificado():
+    """Instante (segundos desde la época) del último cambio de versión, para Last-Modified"""
+    return estado_version()[1]
+
+
+def _incrementar_version(nombre='catalogo'):
+    ahora = int(time.time())
+    if version_en_bd():
+        from .models import VersionCompartida
+
+        filas = VersionCompartida.objects.filter(nombre=nombre)
+        if not filas.update(valor=F('valor') + 1, modificado=ahora):
+            _fila_version(nombre)
+            filas.update(valor=F('valor') + 1, modificado=ahora)
+    else:
+        cache = obtener_cache()
+        clave = CLAVE_VERSION.format(nombre=nombre)
+        if not cache.add(clave, _version_inicial(), timeout=None):
+            try:
+                cache.incr(clave)
+            except ValueError:
+                # La clave expiró entre add e incr
+                cache.set(clave, _version_inicial(), timeout=None)
+        cache.set(CLAVE_MODIFICADO.format(nombre=nombre), ahora, timeout=None)
+    if nombre == 'catalogo':
+        contadores.incrementar('invalidaciones')
+
+
+def invalidar_catalogo():
+    """Invalida todo lo cacheado del catálogo cuando la transacción actual se confirme"""
+    transaction.on_commit(_incrementar_version)
+
+
+def version_titulos():
+    """Versión de los títulos: solo cambia al crear, renombrar o borrar libros"""
+    return estado_version('titulos')[0]
+
+
+def invalidar_titulos():
+    transaction.on_commit(lambda: _incrementar_version('titulos'))
+
+
+def version_textos():
+    """Versión del texto vectorizado (título, autor, sinopsis): no cambia con reservas ni disponibilidad"""
+    return estado_version('textos')[0]
+
+
+def invalidar_textos():
+    transaction.on_commit(lambda: _incrementar_version('textos'))
+
+
+def construir_contexto():
+    """Genera el resumen de la biblioteca con un número fijo de consultas (los libros los elige prompts.py)"""
+    from .models import Categoria, Reserva
+
+    contexto_categorias = ", ".join(Categoria.objects.values_list('nombre', flat=True))
+
+    reservas_activas = Reserva.objects.filter(estado='activa')
+    return {
+        'contexto_categorias': contexto_categorias,
+        'total_reservas': reservas_activas.count(),
+        'libros_reservados': list(reservas_activas.values_list('libro__titulo', flat=True)[:8]),
+    }
+
+
+def obtener_contexto():
+    """Devuelve el contexto del prompt desde la caché, generándolo si hace falta"""
+    cache = obtener_cache()
+    clave = CLAVE_CONTEXTO.format(version=version_catalogo())
+    contexto = cache.get(clave)
+    if contexto is not None:
+        contadores.incrementar('contexto_aciertos')
+        return contexto
+
+    contadores.incrementar('contexto_fallos')
+    contexto = construir_contexto()
+    cache.set(clave, contexto, timeout=getattr(settings, 'BIBLIOTECA_CACHE_CONTEXTO_TTL', 3600))
+    return contexto
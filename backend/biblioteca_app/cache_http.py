@@ -0,0 +1,150 @@
+"""
+Caché HTTP de los endpoints de lectura del catálogo.
+
+Las respuestas llevan un ETag fuerte y Last-Modified derivados de la versión
+del catálogo (cache_catalogo), que las señales incrementan con cada escritura
+en Libro, Categoria o Reserva y que comparten todos los workers. Un GET
+condicional que coincide se responde con 304 antes de construir ningún
+queryset (con una caché local del proceso, tras leer la versión de la base de
+datos). Los listados pedidos sin credenciales
+se guardan además ya renderizados, bajo la versión y los parámetros de la URL.
+"""
+import hashlib
+from datetime import date, datetime, time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils import timezone
+from django.utils.http import http_date
+
+from .cache_catalogo import contadores, estado_version, obtener_cache, version_catalogo
+
+CLAVE_RESPUESTA = 'biblioteca:http:{version}:{huella}'
+
+# Cabeceras que se guardan con el cuerpo renderizado
+CABECERAS_GUARDADAS = ('Content-Type', 'Allow', 'Vary')
+
+
+def _huella(request, version, extra):
+    parametros = urlencode(sorted(request.GET.lists()), doseq=True)
+    partes = [str(version), request.path, parametros, request.META.get('HTTP_ACCEPT', ''), *map(str, extra)]
+    return hashlib.sha256('\n'.join(partes).encode()).hexdigest()[:32]
+
+
+def _es_anonima(request):
+    usuario = getattr(request, 'user', None)
+    return 'HTTP_AUTHORIZATION' not in request.META and not (usuario and usuario.is_authenticated)
+
+
+def _validadores(response, etag, modificado):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modificado)
+    # Sin esto el navegador puede reutilizar la respuesta por heurística sin revalidarla
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def servir_con_cache(request, vista, extra=(), renderizada=False):
+    """
+    Sirve `vista()` con validadores del catálogo. `extra` entra en el ETag
+    (lo que cambie la respuesta sin cambiar el catálogo, p. ej. la fecha); con
+    `renderizada` la respuesta de una petición anónima se guarda renderizada.
+    Si `extra` incluye una fecha, Last-Modified no es anterior al comienzo de
+    ese día, para que If-Modified-Since tampoco dé por buena la del día anterior.
+    """
+    # La versión se lee antes que los datos: una escritura concurrente cambia la clave, no la contamina
+    version, modificado = estado_version()
+    for valor in extra:
+        if isinstance(valor, date):
+            comienzo = timezone.make_aware(datetime.combine(valor, time.min))
+            modificado = max(modificado, int(comienzo.timestamp()))
+    huella = _huella(request, version, extra)
+    etag = f'"{huella}"'
+
+    no_modificada = get_conditional_response(request, etag=etag, last_modified=modificado)
+    if no_modificada is not None:
+        contadores.incrementar('http_no_modificadas')
+        return _validadores(no_modificada, etag, modificado)
+
+    cache = obtener_cache()
+    clave = CLAVE_RESPUESTA.format(version=version, huella=huella) if renderizada and _es_anonima(request) else None
+    if clave is not None:
+        guardada = cache.get(clave)
+        if guardada is not None:
+            contadores.incrementar('http_cache_aciertos')
+            contenido, cabeceras = guardada
+            response = HttpResponse(contenido)
+            for nombre, valor in cabeceras.items():
+                response[nombre] = valor
+            return _validadores(response, etag, modificado)
+        contadores.incrementar('http_cache_fallos')
+
+    response = vista()
+    if response.status_code != 200:
+        return response
+    _validadores(response, etag, modificado)
+    if clave is not None and hasattr(response, 'add_post_render_callback'):
+        ttl = getattr(settings, 'BIBLIOTECA_CACHE_HTTP_TTL', 300)
+
+        def guardar(renderizada):
+            cabeceras = {nombre: renderizada[nombre] for nombre in CABECERAS_GUARDADAS if renderizada.has_header(nombre)}
+            cache.set(clave, (renderizada.content, cabeceras), timeout=ttl)
+
+        response.add_post_render_callback(guardar)
+    return response
+
+
+class CacheHTTPMixin:
+    """
+    Para ViewSets: las acciones de `acciones_condicionales` responden con
+    ETag/Last-Modified y 304; las de `acciones_renderizadas` además se guardan.
+    """
+    acciones_condicionales = ('list', 'retrieve')
+    acciones_renderizadas = ('list',)
+
+    def validadores_extra(self, accion):
+        return ()
+
+    def dispatch(self, request, *args, **kwargs):
+        accion = None
+        if request.method in ('GET', 'HEAD'):
+            accion = getattr(self, 'action_map', {}).get(request.method.lower())
+        if accion not in self.acciones_condicionales:
+            return super().dispatch(request, *args, **kwargs)
+        return servir_con_cache(
+            request,
+            lambda: super(CacheHTTPMixin, self).dispatch(request, *args, **kwargs),
+            extra=(accion, *self.validadores_extra(accion)),
+            renderizada=accion in self.acciones_renderizadas,
+        )
+
+
+def resumen_cache():
+    """Aciertos y fallos de las cachés del catálogo, con su tasa de aciertos"""
+    valores = contadores.obtener()
+
+    def tasa(aciertos, fallos):
+        total = valores.get(aciertos, 0) + valores.get(fallos, 0)
+        return round(valores.get(aciertos, 0) / total, 4) if total else None
+
+    return {
+        'http': {
+            'aciertos': valores.get('http_cache_aciertos', 0),
+            'fallos': valores.get('http_cache_fallos', 0),
+            'no_modificadas': valores.get('http_no_modificadas', 0),
+            'tasa_aciertos': tasa('http_cache_aciertos', 'http_cache_fallos'),
+        },
+        'contexto': {
+            'aciertos': valores.get('contexto_aciertos', 0),
+            'fallos': valores.get('contexto_fallos', 0),
+            'tasa_aciertos': tasa('contexto_aciertos', 'contexto_fallos'),
+        },
+        'respuestas': {
+            'aciertos': valores.get('respuestas_aciertos', 0),
+            'fallos': valores.get('respuestas_fallos', 0),
+            'tasa_aciertos': tasa('respuestas_aciertos', 'respuestas_fallos'),
+        },
+        'version_catalogo': version_catalogo(),
+    }
@@ -0,0 +1,210 @@
+"""
+Caché de respuestas del modelo con coalescencia de peticiones.
+
+Las respuestas se guardan en memoria del proceso (TTL + LRU) con una clave
+formada por la consulta normalizada y la versión del catálogo. Si llegan varias
+peticiones idénticas mientras la primera sigue esperando a Gemini, todas
+comparten esa misma llamada (single-flight).
+"""
+import ast
+import asyncio
+import copy
+import hashlib
+import re
+import threading
+from datetime import timedelta
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.utils import timezone
+
+from .busqueda import normalizar_texto
+from .cache_catalogo import contadores, version_catalogo
+from .salida_modelo import RESPUESTA_NO_INTERPRETADA
+
+
+def normalizar_consulta(texto):
+    """Normaliza una consulta para que variantes triviales compartan entrada"""
+    texto = re.sub(r'[^\w\s]', ' ', normalizar_texto(texto))
+    return ' '.join(texto.split())
+
+
+def clave_respuesta(consulta, version=None):
+    version = version_catalogo() if version is None else version
+    resumen = hashlib.sha1(normalizar_consulta(consulta).encode('utf-8')).hexdigest()
+    return f'{version}:{resumen}'
+
+
+class _LlamadaEnVuelo:
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class CacheRespuestas:
+    def __init__(self, max_entradas=1024, ttl=3600):
+        self._cache = TTLCache(maxsize=max_entradas, ttl=ttl)
+        self._lock = threading.Lock()
+        self._en_vuelo = {}
+        self._en_vuelo_async = {}
+
+    def obtener_o_calcular(self, clave, funcion):
+        """
+        Devuelve la respuesta cacheada para `clave` o la calcula con `funcion`.
+
+        `funcion` devuelve una tupla (resultado, cacheable); solo se guardan los
+        resultados marcados como cacheables. Las peticiones concurrentes con la
+        misma clave esperan a la primera y reciben su resultado.
+        """
+        with self._lock:
+            if clave in self._cache:
+                contadores.incrementar('respuestas_aciertos')
+                return copy.deepcopy(self._cache[clave])
+            llamada = self._en_vuelo.get(clave)
+            es_lider = llamada is None
+            if es_lider:
+                llamada = self._en_vuelo[clave] = _LlamadaEnVuelo()
+
+        if not es_lider:
+            contadores.incrementar('respuestas_coalescidas')
+            llamada.evento.wait()
+            if llamada.error is not None:
+                raise llamada.error
+            return copy.deepcopy(llamada.resultado)
+
+        contadores.incrementar('respuestas_fallos')
+        cacheable = False
+        try:
+            llamada.resultado, cacheable = funcion()
+            return copy.deepcopy(llamada.resultado)
+        except Exception as e:
+            llamada.error = e
+            raise
+        finally:
+            with self._lock:
+                if cacheable:
+                    self._cache[clave] = llamada.resultado
+                del self._en_vuelo[clave]
+            llamada.evento.set()
+
+    async def obtener_o_calcular_async(self, clave, corrutina):
+        """
+        Igual que obtener_o_calcular, pero `corrutina` es una función que devuelve
+        un awaitable. Las peticiones en espera comparten un Future del bucle actual.
+
+        Si se cancela la petición que calcula, su cancelación no se propaga: las
+        que esperaban vuelven a intentarlo y una de ellas pasa a calcular.
+        """
+        llave_vuelo = (asyncio.get_running_loop(), clave)
+        while True:
+            with self._lock:
+                if clave in self._cache:
+                    contadores.incrementar('respuestas_aciertos')
+                    return copy.deepcopy(self._cache[clave])
+                futuro = self._en_vuelo_async.get(llave_vuelo)
+                es_lider = futuro is None
+                if es_lider:
+                    futuro = self._en_vuelo_async[llave_vuelo] = asyncio.get_running_loop().create_future()
+            if es_lider:
+                break
+
+            contadores.incrementar('respuestas_coalescidas')
+            # wait() no cancela el Future si se cancela esta petición, ni lanza si lo cancela el líder
+            await asyncio.wait([futuro])
+            if not futuro.cancelled():
+                return copy.deepcopy(futuro.result())
+
+        contadores.incrementar('respuestas_fallos')
+        try:
+            resultado, cacheable = await corrutina()
+        except asyncio.CancelledError:
+            with self._lock:
+                del self._en_vuelo_async[llave_vuelo]
+            futuro.cancel()
+            raise
+        except BaseException as e:
+            with self._lock:
+                del self._en_vuelo_async[llave_vuelo]
+            futuro.set_exception(e)
+            # Evita el aviso de excepción no recuperada si nadie estaba esperando
+            futuro.exception()
+            raise
+        with self._lock:
+            if cacheable:
+                self._cache[clave] = resultado
+            del self._en_vuelo_async[llave_vuelo]
+        futuro.set_result(resultado)
+        return copy.deepcopy(resultado)
+
+    def obtener(self, clave):
+        """Devuelve la respuesta cacheada o None, sin calcularla"""
+        with self._lock:
+            resultado = self._cache.get(clave)
+        contadores.incrementar('respuestas_aciertos' if resultado is not None else 'respuestas_fallos')
+        return copy.deepcopy(resultado)
+
+    def guardar(self, clave, resultado):
+        with self._lock:
+            self._cache[clave] = resultado
+
+    def vaciar(self):
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+
+def precargar_desde_consultas(cache_respuestas, limite=200):
+    """
+    Carga en la caché las consultas recientes guardadas en la tabla Consulta.
+
+    Solo se usan las más nuevas que el TTL, ya que con la caché en marcha
+    seguirían vigentes, y respondidas con la versión actual del catálogo. Las
+    respuestas que no se habrían cacheado (sin modelo o no interpretables) se
+    descartan. Devuelve el número de entradas cargadas.
+    """
+    from .models import Consulta
+
+    desde = timezone.now() - timedelta(seconds=ttl_respuestas())
+    version = version_catalogo()
+    consultas = Consulta.objects.filter(fecha__gte=desde, version_catalogo=version).order_by('-fecha')[:limite]
+    cargadas = 0
+    # De la más antigua a la más reciente para que gane la última respuesta
+    for consulta in reversed(list(consultas)):
+        try:
+            resultado = ast.literal_eval(consulta.respuesta)
+        except (ValueError, SyntaxError):
+            continue
+        if not isinstance(resultado, dict) or resultado.get('tipo') == 'error':
+            continue
+        if resultado.get('degradada') or resultado == RESPUESTA_NO_INTERPRETADA:
+            continue
+        cache_respuestas.guardar(clave_respuesta(consulta.texto, version), resultado)
+        cargadas += 1
+    return cargadas
+
+
+def ttl_respuestas():
+    return getattr(settings, 'BIBLIOTECA_CACHE_RESPUESTAS_TTL', 3600)
+
+
+_cache_respuestas = None
+_cache_lock = threading.Lock()
+
+
+def obtener_cache_respuestas():
+    """Caché de respuestas compartida por todo el proceso"""
+    global _cache_respuestas
+    if _cache_respuestas is None:
+        with _cache_lock:
+            if _cache_respuestas is None:
+                cache_respuestas = CacheRespuestas(
+                    max_entradas=getattr(settings, 'BIBLIOTECA_CACHE_RESPUESTAS_MAX', 1024),
+                    ttl=ttl_respuestas(),
+                )
+                if getattr(settings, 'BIBLIOTECA_PRECARGAR_RESPUESTAS', True):
+                    precargar_desde_consultas(cache_respuestas)
+                _cache_respuestas = cache_respuestas
+    return _cache_respuestas
@@ -0,0 +1,430 @@
+"""
+Cliente resiliente para el modelo de lenguaje.
+
+Envuelve un modelo con la interfaz de genai.GenerativeModel (generate_content y
+generate_content_async) y añade un plazo por llamada, reintentos con espera
+exponencial aleatoria para los errores transitorios, un presupuesto de tiempo
+total para la llamada con sus reintentos y un interruptor (circuit breaker)
+que, tras varios fallos seguidos, rechaza las llamadas al instante durante un
+tiempo. Las llamadas síncronas ocupan uno de BIBLIOTECA_MAX_LLAMADAS_MODELO
+cupos del proceso (un flujo ocupa el suyo hasta que termina de leerse); sin
+cupo libre se rechazan al momento, sin contar como fallo del modelo. Quien llama recibe ModeloNoDisponible y puede responder con
+una alternativa local en lugar de quedarse esperando.
+
+Los modelos se obtienen con obtener_modelo(): uno por nombre y por proceso,
+creado la primera vez que se usa. google.generativeai se importa en ese momento,
+así el arranque de Django y los comandos de gestión no lo cargan.
+"""
+import asyncio
+import functools
+import importlib
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as TimeoutFuturo
+
+from django.conf import settings
+
+from .cache_catalogo import contadores
+from .instrumentacion import registrar_modelo
+
+
+@functools.cache
+def errores_transitorios():
+    """Errores que merecen reintento (se resuelven al primer uso para no importar google al arrancar)"""
+    from google.api_core import exceptions as errores_google
+
+    return (
+        TimeoutError,
+        ConnectionError,
+        errores_google.ServiceUnavailable,
+        errores_google.DeadlineExceeded,
+        errores_google.ResourceExhausted,
+        errores_google.InternalServerError,
+    )
+
+# Espera base antes del primer reintento; se duplica en cada uno
+ESPERA_BASE = 0.5
+
+# No se reintenta si del presupuesto quedan menos segundos que esto
+PLAZO_MINIMO = 0.5
+
+
+class ModeloNoDisponible(Exception):
+    """El interruptor está abierto o la llamada agotó plazos y reintentos"""
+
+
+class ModeloSaturado(ModeloNoDisponible):
+    """Todos los cupos de llamadas del proceso están ocupados (no es un fallo del modelo)"""
+
+
+class Interruptor:
+    """
+    Circuit breaker: 'cerrado' deja pasar todo; tras `umbral` fallos seguidos
+    pasa a 'abierto' y rechaza durante `apertura` segundos; después queda
+    'semiabierto' y deja pasar una sola llamada de prueba.
+    """
+
+    def __init__(self, umbral=5, apertura=30.0):
+        self.umbral = umbral
+        self.apertura = apertura
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self.fallos_seguidos = 0
+            self.abierto_desde = None
+            self._prueba_desde = None
+
+    @property
+    def estado(self):
+        if self.abierto_desde is None:
+            return 'cerrado'
+        if time.monotonic() - self.abierto_desde < self.apertura:
+            return 'abierto'
+        return 'semiabierto'
+
+    def permitir(self):
+        with self._lock:
+            estado = self.estado
+            if estado == 'cerrado':
+                return True
+            # Una prueba abandonada (p. ej. un flujo que nadie terminó de leer) no bloquea para siempre
+            ahora = time.monotonic()
+            if estado == 'semiabierto' and (self._prueba_desde is None or ahora - self._prueba_desde > self.apertura):
+                self._prueba_desde = ahora
+                return True
+            return False
+
+    def exito(self):
+        with self._lock:
+            self.fallos_seguidos = 0
+            self.abierto_desde = None
+            self._prueba_desde = None
+
+    def fallo(self):
+        with self._lock:
+            self.fallos_seguidos += 1
+            self._prueba_desde = None
+            if self.abierto_desde is not None or self.fallos_seguidos >= self.umbral:
+                if self.abierto_desde is None:
+                    contadores.incrementar('modelo_interruptor_aperturas')
+                self.abierto_desde = time.monotonic()
+
+    def resumen(self):
+        return {'estado': self.estado, 'fallos_seguidos': self.fallos_seguidos}
+
+
+_interruptores = {}
+_interruptores_lock = threading.Lock()
+
+
+def obtener_interruptor(nombre):
+    """Interruptor del proceso para un modelo: lo comparten todas las peticiones"""
+    with _interruptores_lock:
+        interruptor = _interruptores.get(nombre)
+        if interruptor is None:
+            interruptor = _interruptores[nombre] = Interruptor(
+                umbral=getattr(settings, 'BIBLIOTECA_MODELO_UMBRAL_FALLOS', 5),
+                apertura=getattr(settings, 'BIBLIOTECA_MODELO_APERTURA', 30.0),
+            )
+        return interruptor
+
+
+def estado_interruptores():
+    with _interruptores_lock:
+        return {nombre: interruptor.resumen() for nombre, interruptor in _interruptores.items()}
+
+
+_ejecutor = None
+_cupos = None
+_ejecutor_lock = threading.Lock()
+
+
+def _obtener_ejecutor():
+    """
+    Hilos para aplicar el plazo a las llamadas síncronas, y un cupo por hilo:
+    con cupo, la llamada nunca espera en la cola del ejecutor.
+    """
+    global _ejecutor, _cupos
+    with _ejecutor_lock:
+        if _ejecutor is None:
+            maximo = getattr(settings, 'BIBLIOTECA_MAX_LLAMADAS_MODELO', 8)
+            _ejecutor = ThreadPoolExecutor(max_workers=maximo, thread_name_prefix='modelo')
+            _cupos = threading.BoundedSemaphore(maximo)
+        return _ejecutor, _cupos
+
+
+class _Cupo:
+    """
+    Un cupo tomado del semáforo. Vuelve a él cuando lo sueltan su dueño y los
+    hilos que lo retienen: una llamada que agotó el plazo sigue ocupando su hilo.
+    """
+
+    def __init__(self, semaforo):
+        self._semaforo = semaforo
+        self._lock = threading.Lock()
+        self._usos = 1
+
+    def retener(self):
+        with self._lock:
+            self._usos += 1
+
+    def soltar(self):
+        with self._lock:
+            self._usos -= 1
+            libre = self._usos == 0
+        if libre:
+            self._semaforo.release()
+
+
+class _Flujo:
+    """
+    Iterador de fragmentos que aplica el plazo a cada uno y avisa al interruptor
+    al terminar. En los flujos síncronos conserva el cupo de la llamada que lo
+    abrió hasta agotarse o cerrarse, así no se rechaza a mitad de respuesta.
+    """
+
+    def __init__(self, cliente, iterador, cupo=None):
+        self.cliente = cliente
+        self.iterador = iterador
+        self.cupo = cupo
+
+    def _soltar_cupo(self):
+        cupo, self.cupo = self.cupo, None
+        if cupo is not None:
+            cupo.soltar()
+
+    def __del__(self):
+        # Un flujo que nadie llegó a leer también devuelve su cupo
+        self._soltar_cupo()
+
+    def __iter__(self):
+        try:
+            while True:
+                try:
+                    fragmento = self.cliente._en_hilo(self.cupo, self.cliente.plazo, next, self.iterador)
+                except StopIteration:
+                    break
+                yield fragmento
+        except errores_transitorios():
+            self.cliente._fallo()
+            raise
+        finally:
+            self._soltar_cupo()
+        self.cliente.interruptor.exito()
+
+    async def __aiter__(self):
+        iterador = self.iterador.__aiter__()
+        try:
+            while True:
+                try:
+                    fragmento = await self.cliente._con_plazo_async(iterador.__anext__())
+                except StopAsyncIteration:
+                    break
+                yield fragmento
+        except errores_transitorios():
+            self.cliente._fallo()
+            raise
+        self.cliente.interruptor.exito()
+
+
+class ModeloResiliente:
+    """
+    Misma interfaz que el modelo envuelto. `opciones_llamada` se pasan en cada
+    llamada (p. ej. request_options={'timeout': ...} para Gemini, así el hilo
+    tampoco queda esperando más allá del plazo).
+    """
+
+    def __init__(self, modelo, nombre=None, plazo=None, reintentos=None, interruptor=None, opciones_llamada=None):
+        self.modelo = modelo
+        self.nombre = nombre or getattr(modelo, 'model_name', type(modelo).__name__)
+        self.plazo = plazo if plazo is not None else getattr(settings, 'BIBLIOTECA_MODELO_TIMEOUT', 20.0)
+        self.reintentos = reintentos if reintentos is not None else getattr(settings, 'BIBLIOTECA_MODELO_REINTENTOS', 2)
+        self.interruptor = interruptor or obtener_interruptor(self.nombre)
+        self.opciones_llamada = opciones_llamada or {}
+
+    def _espera(self, intento):
+        # Full jitter: reparte los reintentos de muchos clientes en lugar de sincronizarlos
+        return random.uniform(0, ESPERA_BASE * 2 ** intento)
+
+    def _fallo(self):
+        contadores.incrementar('modelo_fallos')
+        self.interruptor.fallo()
+
+    def _permitir(self):
+        if not self.interruptor.permitir():
+            contadores.incrementar('modelo_rechazadas')
+            raise ModeloNoDisponible(f"El modelo {self.nombre} no está disponible (interruptor abierto)")
+
+    def _presupuesto(self):
+        """Segundos para la llamada con todos sus reintentos"""
+        return getattr(settings, 'BIBLIOTECA_MODELO_PRESUPUESTO', self.plazo * (self.reintentos + 1))
+
+    def _tomar_cupo(self):
+        """Toma un cupo de llamadas del proceso; sin cupo libre lanza ModeloSaturado"""
+        _, cupos = _obtener_ejecutor()
+        if not cupos.acquire(blocking=False):
+            contadores.incrementar('modelo_saturado')
+            raise ModeloSaturado(f"Demasiadas llamadas simultáneas al modelo {self.nombre}")
+        return _Cupo(cupos)
+
+    def _en_hilo(self, cupo, plazo, funcion, *args, **kwargs):
+        """
+        Ejecuta `funcion` en un hilo del ejecutor con `plazo` segundos contados
+        desde que empieza a ejecutarse, reteniendo `cupo` mientras el hilo trabaja.
+        """
+        ejecutor, _ = _obtener_ejecutor()
+        empezada = threading.Event()
+        cupo.retener()
+
+        def ejecutar():
+            empezada.set()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                # El cupo se libera cuando el hilo termina, no cuando quien llama deja de esperar
+                cupo.soltar()
+
+        futuro = ejecutor.submit(ejecutar)
+        empezada.wait()
+        inicio = time.perf_counter()
+        try:
+            return futuro.result(timeout=plazo)
+        except TimeoutFuturo:
+            contadores.incrementar('modelo_timeouts')
+            raise TimeoutError(f"El modelo no respondió en {plazo:.1f}s")
+        finally:
+            registrar_modelo(time.perf_counter() - inicio)
+
+    async def _con_plazo_async(self, espera, plazo=None):
+        inicio = time.perf_counter()
+        try:
+            return await asyncio.wait_for(espera, self.plazo if plazo is None else plazo)
+        finally:
+            registrar_modelo(time.perf_counter() - inicio)
+
+    def _siguiente_intento(self, intento, limite):
+        """Espera antes del reintento; None si no queda presupuesto para otro"""
+        if intento == self.reintentos:
+            return None
+        espera = self._espera(intento)
+        if limite - time.monotonic() - espera < PLAZO_MINIMO:
+            return None
+        contadores.incrementar('modelo_reintentos')
+        return espera
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        kwargs = {**self.opciones_llamada, **kwargs}
+        limite = time.monotonic() + self._presupuesto()
+        for intento in range(self.reintentos + 1):
+            self._permitir()
+            contadores.incrementar('modelo_llamadas')
+            plazo = min(self.plazo, limite - time.monotonic())
+            cupo = self._tomar_cupo()
+            try:
+                respuesta = self._en_hilo(cupo, plazo, self.modelo.generate_content, prompt, stream=stream, **kwargs)
+            except errores_transitorios() as e:
+                cupo.soltar()
+                self._fallo()
+                espera = self._siguiente_intento(intento, limite)
+                if espera is None:
+                    raise ModeloNoDisponible(str(e)) from e
+                time.sleep(espera)
+                continue
+            except BaseException:
+                cupo.soltar()
+                raise
+            if stream:
+                return _Flujo(self, respuesta, cupo)
+            cupo.soltar()
+            self.interruptor.exito()
+            return respuesta
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        kwargs = {**self.opciones_llamada, **kwargs}
+        limite = time.monotonic() + self._presupuesto()
+        for intento in range(self.reintentos + 1):
+            self._permitir()
+            contadores.incrementar('modelo_llamadas')
+            try:
+                respuesta = await self._con_plazo_async(
+                    self.modelo.generate_content_async(prompt, stream=stream, **kwargs),
+                    min(self.plazo, limite - time.monotonic()),
+                )
+            except asyncio.TimeoutError as e:
+                contadores.incrementar('modelo_timeouts')
+                error = e
+            except errores_transitorios() as e:
+                error = e
+            else:
+                if stream:
+                    return _Flujo(self, respuesta)
+                self.interruptor.exito()
+                return respuesta
+            self._fallo()
+            espera = self._siguiente_intento(intento, limite)
+            if espera is None:
+                raise ModeloNoDisponible(str(error) or "El modelo no respondió a tiempo") from error
+            await asyncio.sleep(espera)
+
+
+_modelos = {}
+_modelos_lock = threading.Lock()
+_genai_configurado = False
+
+
+def modelo_por_defecto():
+    return getattr(settings, 'BIBLIOTECA_MODELO', 'models/gemini-2.5-flash')
+
+
+def obtener_modelo(nombre=None):
+    """
+    Modelo resiliente del proceso para `nombre` (por defecto BIBLIOTECA_MODELO).
+
+    genai.configure se llama una sola vez: volver a llamarlo descarta los
+    clientes ya creados y con ellos las conexiones abiertas.
+    """
+    global _genai_configurado
+    nombre = nombre or modelo_por_defecto()
+    modelo = _modelos.get(nombre)
+    if modelo is not None:
+        return modelo
+
+    with _modelos_lock:
+        modelo = _modelos.get(nombre)
+        if modelo is None:
+            genai = importlib.import_module('google.generativeai')
+            if not _genai_configurado:
+                genai.configure(api_key=settings.GEMINI_API_KEY)
+                _genai_configurado = True
+            modelo = _modelos[nombre] = ModeloResiliente(
+                genai.GenerativeModel(nombre),
+                nombre=nombre,
+                # El cliente de Gemini también corta la petición al vencer el plazo
+                opciones_llamada={'request_options': {'timeout': getattr(settings, 'BIBLIOTECA_MODELO_TIMEOUT', 20.0)}},
+            )
+            contadores.incrementar('modelo_clientes_creados')
+        return modelo
+
+
+def _reiniciar_tras_fork():
+    """
+    En el hijo (p. ej. workers de gunicorn con --preload) no se reutiliza nada
+    creado por el padre: los canales gRPC, los hilos y los locks no sobreviven a fork.
+    """
+    global _modelos_lock, _interruptores_lock, _ejecutor_lock, _ejecutor, _cupos, _genai_configurado
+    _modelos.clear()
+    _interruptores.clear()
+    _modelos_lock = threading.Lock()
+    _interruptores_lock = threading.Lock()
+    _ejecutor_lock = threading.Lock()
+    _ejecutor = None
+    _cupos = None
+    _genai_configurado = False
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_tras_fork)
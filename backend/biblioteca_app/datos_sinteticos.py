@@ -0,0 +1,105 @@
+"""
+Generador determinista de catálogos sintéticos para benchmarks.
+
+Inserta con bulk_create, por lo que no dispara señales: quien lo use debe
+reconstruir los índices derivados (p. ej. reconstruir_indice) si los necesita,
+y tras generar_reservas reparar Libro.reserva_activa y los contadores
+(reconciliar_reservas_activas(reparar=True) y recalcular_estadisticas()).
+"""
+import random
+from datetime import date, timedelta
+
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .models import Libro, Categoria, Reserva
+
+PALABRAS = [
+    'sombra', 'camino', 'árbol', 'corazón', 'océano', 'ciudad', 'memoria', 'jardín',
+    'tiempo', 'fuego', 'silencio', 'río', 'montaña', 'estrella', 'guerra', 'canción',
+    'invierno', 'verano', 'niño', 'reina', 'ladrón', 'espejo', 'pájaro', 'lluvia',
+    'historia', 'ciencia', 'máquina', 'universo', 'física', 'química', 'educación', 'música',
+]
+LECTOR = 'Lector sintético'
+NOMBRES = ['Gabriel', 'Isabel', 'Jorge', 'Julio', 'Laura', 'Mario', 'Elena', 'Andrés', 'Lucía', 'Óscar']
+APELLIDOS = ['García', 'Márquez', 'Allende', 'Borges', 'Cortázar', 'Vargas', 'Fuentes', 'Mistral', 'Neruda', 'Bolaño']
+
+
+def _frase(rnd, n):
+    return ' '.join(rnd.choice(PALABRAS) for _ in range(n))
+
+
+def generar_catalogo(num_libros, num_categorias=20, semilla=42, tamano_lote=5000):
+    """Crea categorías y libros sintéticos; devuelve el número de libros creados"""
+    rnd = random.Random(semilla)
+
+    categorias = Categoria.objects.bulk_create(
+        [Categoria(nombre=f'Categoría sintética {semilla}-{i}') for i in range(num_categorias)]
+    )
+
+    creados = 0
+    while creados < num_libros:
+        lote = []
+        for i in range(creados, min(creados + tamano_lote, num_libros)):
+            lote.append(Libro(
+                titulo=_frase(rnd, rnd.randint(2, 5)).capitalize(),
+                autor=f'{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)}',
+                fecha_publicacion=date(rnd.randint(1900, 2024), rnd.randint(1, 12), 1),
+                isbn=f'{semilla % 1000:03d}{i:010d}',
+                sinopsis=_frase(rnd, rnd.randint(20, 60)),
+                categoria=rnd.choice(categorias) if categorias else None,
+                paginas=rnd.randint(50, 900),
+            ))
+        Libro.objects.bulk_create(lote)
+        creados += len(lote)
+    return creados
+
+
+def generar_reservas(libro_ids, num_reservas, semilla=42, fraccion_activas=0.1, fraccion_atrasadas=0.1,
+                     dias_historia=365, dias_prestamo=14, tamano_lote=20000):
+    """
+    Crea una historia de reservas sesgada (unos pocos libros concentran muchas)
+    repartida en los últimos `dias_historia` días, más una reserva activa en
+    `fraccion_activas` de los libros, de las que `fraccion_atrasadas` ya pasaron
+    su vencimiento. Marca esos libros como no disponibles. Devuelve el número
+    de reservas creadas.
+    """
+    rnd = random.Random(semilla)
+    ahora = timezone.now()
+    plazo = timedelta(days=dias_prestamo)
+    ultima = Reserva.objects.aggregate(ultima=Max('id'))['ultima'] or 0
+    activos = rnd.sample(libro_ids, int(len(libro_ids) * fraccion_activas))
+
+    def cerrada():
+        # Un 30% de las reservas va a los primeros libros, con cola larga (Pareto)
+        if rnd.random() < 0.3:
+            libro_id = libro_ids[min(int(rnd.paretovariate(1.2)) - 1, len(libro_ids) - 1)]
+        else:
+            libro_id = rnd.choice(libro_ids)
+        fecha = ahora - timedelta(days=dias_historia * rnd.random() + dias_prestamo)
+        estado = rnd.choices(['completada', 'cancelada', 'vencida'], weights=[80, 12, 8])[0]
+        devolucion = fecha + timedelta(days=rnd.uniform(1, dias_prestamo * 1.5)) if estado == 'completada' else None
+        return Reserva(
+            libro_id=libro_id, usuario_nombre=LECTOR, usuario_email=f'lector{rnd.randrange(50000)}@example.com',
+            fecha_vencimiento=fecha + plazo, fecha_devolucion=devolucion, estado=estado,
+        )
+
+    def activa(libro_id):
+        atrasada = rnd.random() < fraccion_atrasadas
+        fecha = ahora - (plazo + timedelta(days=rnd.uniform(0, 7)) if atrasada else plazo * rnd.random())
+        return Reserva(
+            libro_id=libro_id, usuario_nombre=LECTOR, usuario_email=f'lector{rnd.randrange(50000)}@example.com',
+            fecha_vencimiento=fecha + plazo,
+        )
+
+    creadas = 0
+    while creadas < num_reservas:
+        lote = [cerrada() for _ in range(min(tamano_lote, num_reservas - creadas))]
+        Reserva.objects.bulk_create(lote)
+        creadas += len(lote)
+    Reserva.objects.bulk_create([activa(libro_id) for libro_id in activos], batch_size=tamano_lote)
+    # auto_now_add pone la fecha de inserción: la de la historia se deduce del vencimiento
+    Reserva.objects.filter(id__gt=ultima, usuario_nombre=LECTOR).update(fecha_reserva=F('fecha_vencimiento') - plazo)
+    for i in range(0, len(activos), tamano_lote):
+        Libro.objects.filter(id__in=activos[i:i + tamano_lote]).update(disponible=False)
+    return creadas + len(activos)
@@ -0,0 +1,149 @@
+"""
+Estadísticas del catálogo mantenidas de forma incremental.
+
+Los totales (libros, disponibles, reservas por estado) viven en la tabla
+Estadistica y el número de reservas de cada libro en Libro.num_reservas. Cada
+escritura que los cambia aplica su delta en la misma transacción: las señales
+de Libro y Reserva para save/delete y llamadas explícitas a ajustar() en los
+UPDATE en bloque (reservar, cerrar, expirar, importar). Leer las estadísticas
+son dos consultas, sin importar el tamaño de las tablas.
+
+Lo que escribe sin pasar por aquí (bulk_create de datos sintéticos, SQL a
+mano) deja deriva; recalcular_estadisticas() la corrige y conviene ejecutarlo
+periódicamente (comando recalcular_estadisticas).
+"""
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Estadistica, Libro, Reserva
+
+ESTADOS = [estado for estado, _ in Reserva.ESTADO_CHOICES]
+
+NOMBRES = ['libros', 'libros_disponibles'] + [f'reservas_{estado}' for estado in ESTADOS]
+
+TOP_POPULARES = 5
+
+
+def ajustar(**deltas):
+    """
+    Suma los deltas a los contadores en un único UPDATE. Bloquea esas filas
+    hasta el final de la transacción, así que debe llamarse lo más tarde posible.
+    """
+    deltas = {nombre: delta for nombre, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    Estadistica.objects.filter(nombre__in=deltas).update(valor=F('valor') + Case(
+        *[When(nombre=nombre, then=Value(delta)) for nombre, delta in deltas.items()],
+        default=Value(0), output_field=BigIntegerField(),
+    ))
+
+
+def ajustar_reservas(anterior, nuevo, cantidad=1, **otros):
+    """Mueve `cantidad` reservas del estado `anterior` al `nuevo` (None para altas y bajas)"""
+    deltas = dict(otros)
+    if anterior is not None:
+        deltas[f'reservas_{anterior}'] = deltas.get(f'reservas_{anterior}', 0) - cantidad
+    if nuevo is not None:
+        deltas[f'reservas_{nuevo}'] = deltas.get(f'reservas_{nuevo}', 0) + cantidad
+    ajustar(**deltas)
+
+
+def _sumar_reservas(libro_id, delta):
+    # Sin tocar fecha_actualizacion: el contador no cambia el libro exportado ni indexado
+    Libro.objects.filter(pk=libro_id).update(
+        num_reservas=F('num_reservas') + delta, fecha_actualizacion=F('fecha_actualizacion')
+    )
+
+
+def libro_guardado(libro, creado, update_fields=None):
+    if creado:
+        ajustar(libros=1, libros_disponibles=int(libro.disponible))
+    elif update_fields is None or 'disponible' in update_fields:
+        anterior = getattr(libro, '_disponible_original', None)
+        if anterior is not None and anterior != libro.disponible:
+            ajustar(libros_disponibles=1 if libro.disponible else -1)
+    libro._disponible_original = libro.disponible
+
+
+def libro_eliminado(libro):
+    disponible = getattr(libro, '_disponible_original', None)
+    ajustar(libros=-1, libros_disponibles=-int(libro.disponible if disponible is None else disponible))
+
+
+def reserva_guardada(reserva, creada, update_fields=None):
+    if creada:
+        # reservar_libro() aplica el delta él mismo, junto con el de libros_disponibles
+        if not getattr(reserva, '_estadisticas_diferidas', False):
+            ajustar_reservas(None, reserva.estado)
+        _sumar_reservas(reserva.libro_id, 1)
+    elif update_fields is None or 'estado' in update_fields:
+        anterior = getattr(reserva, '_estado_original', None)
+        if anterior is not None and anterior != reserva.estado:
+            ajustar_reservas(anterior, reserva.estado)
+    reserva._estado_original = reserva.estado
+
+
+def reserva_eliminada(reserva):
+    ajustar_reservas(getattr(reserva, '_estado_original', None) or reserva.estado, None)
+    _sumar_reservas(reserva.libro_id, -1)
+
+
+def valores_exactos():
+    """Los contadores calculados desde las tablas (recorre libros y reservas)"""
+    libros = Libro.objects.aggregate(libros=Count('id'), libros_disponibles=Count('id', filter=Q(disponible=True)))
+    por_estado = dict(Reserva.objects.order_by().values_list('estado').annotate(n=Count('id')))
+    return {**libros, **{f'reservas_{estado}': por_estado.get(estado, 0) for estado in ESTADOS}}
+
+
+def recalcular_estadisticas():
+    """
+    Recalcula contadores y Libro.num_reservas desde las tablas. Devuelve
+    {'deriva': {nombre: corrección}, 'libros_corregidos': n}.
+    """
+    with transaction.atomic():
+        # Primero se bloquean los contadores: las escrituras concurrentes esperan y
+        # aplican su delta sobre el valor recalculado, sin perderse ni contarse dos veces
+        anteriores = dict(Estadistica.objects.select_for_update().values_list('nombre', 'valor'))
+        exactos = valores_exactos()
+        Estadistica.objects.bulk_create(
+            [Estadistica(nombre=nombre, valor=valor) for nombre, valor in exactos.items()],
+            update_conflicts=True, unique_fields=['nombre'], update_fields=['valor'],
+        )
+
+        reservas = Reserva.objects.filter(libro=OuterRef('pk')).order_by().values('libro').annotate(n=Count('id')).values('n')
+        exacto = Coalesce(Subquery(reservas), 0)
+        libros_corregidos = Libro.objects.annotate(exacto=exacto).exclude(num_reservas=F('exacto')).update(
+            num_reservas=exacto, fecha_actualizacion=F('fecha_actualizacion')
+        )
+
+    deriva = {
+        nombre: valor - anteriores.get(nombre, 0)
+        for nombre, valor in exactos.items() if valor != anteriores.get(nombre)
+    }
+    return {'deriva': deriva, 'libros_corregidos': libros_corregidos}
+
+
+def obtener_estadisticas(limite=TOP_POPULARES):
+    """Totales y los `limite` libros más reservados, leídos de los contadores"""
+    valores = dict(Estadistica.objects.values_list('nombre', 'valor'))
+    if len(valores) < len(NOMBRES):
+        # Tabla vacía (p. ej. tras un flush): se rellena una vez desde las tablas
+        recalcular_estadisticas()
+        valores = dict(Estadistica.objects.values_list('nombre', 'valor'))
+
+    populares = (
+        Libro.objects.filter(num_reservas__gt=0)
+        .order_by('-num_reservas', '-id')
+        .values('titulo', 'autor', 'num_reservas')[:limite]
+    )
+    return {
+        'total_libros': valores['libros'],
+        'libros_disponibles': valores['libros_disponibles'],
+        'libros_reservados': valores['libros'] - valores['libros_disponibles'],
+        'reservas_activas': valores['reservas_activa'],
+        'reservas_vencidas': valores['reservas_vencida'],
+        'reservas_completadas': valores['reservas_completada'],
+        'reservas_canceladas': valores['reservas_cancelada'],
+        'libros_populares': list(populares),
+    }
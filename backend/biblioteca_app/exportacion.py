@@ -0,0 +1,114 @@
+"""
+Exportación en streaming del catálogo y del historial de reservas.
+
+Las filas se leen con iterator(chunk_size=...) (cursor del lado del servidor
+en PostgreSQL) y se escriben una a una en NDJSON o CSV, así la memoria no
+depende del tamaño de la tabla. Con `desde` solo se exportan las filas
+modificadas después de esa marca; la exportación declara su propia marca
+(marca_exportacion) para usarla como `desde` en la siguiente.
+
+fecha_actualizacion se fija al escribir, no al confirmar: una transacción
+larga puede confirmar una fila fechada antes de la marca cuando la exportación
+ya la dejó atrás. Por eso la marca retrocede BIBLIOTECA_EXPORTACION_MARGEN
+segundos y las filas de ese margen se repiten en la exportación siguiente: los
+consumidores tienen que aplicarlas de forma idempotente (por id, la última gana).
+"""
+import csv
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Libro, Reserva
+
+TAMANO_LOTE = 2000
+
+
+def marca_exportacion(hasta):
+    """Marca que se devuelve para la exportación que llega hasta `hasta`"""
+    return hasta - timedelta(seconds=getattr(settings, 'BIBLIOTECA_EXPORTACION_MARGEN', 60))
+
+
+def _fila_libro(libro):
+    return {
+        'id': libro.id,
+        'titulo': libro.titulo,
+        'autor': libro.autor,
+        'isbn': libro.isbn,
+        'fecha_publicacion': libro.fecha_publicacion,
+        'sinopsis': libro.sinopsis,
+        'categoria_id': libro.categoria_id,
+        'nombre_categoria': libro.categoria.nombre if libro.categoria else None,
+        'portada_url': libro.portada_url,
+        'paginas': libro.paginas,
+        'idioma': libro.idioma,
+        'disponible': libro.disponible,
+        'fecha_creacion': libro.fecha_creacion,
+        'fecha_actualizacion': libro.fecha_actualizacion,
+    }
+
+
+def _fila_reserva(reserva):
+    return {
+        'id': reserva.id,
+        'libro_id': reserva.libro_id,
+        'libro_titulo': reserva.libro.titulo,
+        'libro_isbn': reserva.libro.isbn,
+        'usuario_nombre': reserva.usuario_nombre,
+        'usuario_email': reserva.usuario_email,
+        'fecha_reserva': reserva.fecha_reserva,
+        'fecha_vencimiento': reserva.fecha_vencimiento,
+        'fecha_devolucion': reserva.fecha_devolucion,
+        'estado': reserva.estado,
+        'notas': reserva.notas,
+        'fecha_actualizacion': reserva.fecha_actualizacion,
+    }
+
+
+EXPORTACIONES = {
+    'libros': (lambda: Libro.objects.select_related('categoria'), _fila_libro),
+    'reservas': (lambda: Reserva.objects.select_related('libro'), _fila_reserva),
+}
+
+
+def filas_exportacion(nombre, desde=None, hasta=None, tamano_lote=TAMANO_LOTE):
+    """Genera los dicts de la exportación `nombre` ordenados por fecha de modificación"""
+    queryset, fila = EXPORTACIONES[nombre]
+    queryset = queryset()
+    if desde is not None:
+        queryset = queryset.filter(fecha_actualizacion__gt=desde)
+    if hasta is not None:
+        queryset = queryset.filter(fecha_actualizacion__lte=hasta)
+    for objeto in queryset.order_by('fecha_actualizacion', 'id').iterator(chunk_size=tamano_lote):
+        yield fila(objeto)
+
+
+def como_ndjson(filas):
+    for fila in filas:
+        yield json.dumps(fila, ensure_ascii=False, cls=DjangoJSONEncoder) + '\n'
+
+
+class _Eco:
+    """Objeto tipo archivo que devuelve lo escrito, para usar csv.writer en un generador"""
+
+    def write(self, valor):
+        return valor
+
+
+def como_csv(filas):
+    escritor = None
+    for fila in filas:
+        if escritor is None:
+            escritor = csv.DictWriter(_Eco(), fieldnames=list(fila))
+            yield escritor.writeheader()
+        yield escritor.writerow({
+            clave: valor.isoformat() if hasattr(valor, 'isoformat') else valor
+            for clave, valor in fila.items()
+        })
+
+
+FORMATOS = {
+    'ndjson': ('application/x-ndjson', como_ndjson),
+    'csv': ('text/csv; charset=utf-8', como_csv),
+}
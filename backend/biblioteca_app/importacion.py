@@ -0,0 +1,291 @@
+"""
+Importación masiva del catálogo desde NDJSON o CSV.
+
+La entrada se lee como un flujo de líneas y se procesa por lotes, así la
+memoria no depende del tamaño del archivo. En cada lote se precargan las
+categorías y los ISBN ya existentes, se validan las filas y se escriben con un
+único bulk_create con upsert por ISBN. Las filas inválidas no detienen la
+importación: se anotan en el informe del lote.
+"""
+import csv
+import json
+from datetime import date
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import DatabaseError, transaction
+
+from .busqueda import obtener_indice
+from .cache_catalogo import contadores, invalidar_catalogo, invalidar_textos, invalidar_titulos
+from .estadisticas import ajustar
+from .models import Categoria, Libro
+
+CAMPOS_OBLIGATORIOS = ('titulo', 'autor', 'fecha_publicacion', 'isbn', 'sinopsis')
+
+# Campos que un upsert puede sobrescribir; disponible y reserva_activa dependen de las reservas
+CAMPOS_ACTUALIZABLES = [
+    'titulo', 'autor', 'fecha_publicacion', 'sinopsis', 'categoria', 'portada_url', 'paginas', 'idioma',
+    'fecha_actualizacion',
+]
+
+LONGITUDES = {
+    campo: Libro._meta.get_field(campo).max_length
+    for campo in ('titulo', 'autor', 'isbn', 'idioma')
+}
+
+# Filas por lote: por defecto y como máximo desde la API (cada lote se lee entero en memoria)
+TAMANO_LOTE = 2000
+MAX_TAMANO_LOTE = 10000
+
+# Errores detallados que se guardan por lote (el total siempre se cuenta)
+MAX_ERRORES_POR_LOTE = 100
+
+_validar_url = URLValidator()
+
+
+def _decodificar(linea):
+    """Devuelve (texto, error): las líneas que no son UTF-8 válido no detienen la importación"""
+    if not isinstance(linea, bytes):
+        return linea, None
+    try:
+        return linea.decode('utf-8', errors='strict'), None
+    except UnicodeDecodeError as e:
+        return None, f"Codificación inválida, se espera UTF-8: {e.reason}"
+
+
+def leer_ndjson(lineas):
+    """Genera un dict por línea; las líneas que no son un objeto JSON generan un str con el error"""
+    for linea in lineas:
+        linea, error = _decodificar(linea)
+        if error:
+            yield error
+            continue
+        linea = linea.strip()
+        if not linea:
+            continue
+        try:
+            fila = json.loads(linea)
+        except json.JSONDecodeError as e:
+            yield f"JSON inválido: {e.msg}"
+            continue
+        yield fila if isinstance(fila, dict) else "Cada línea debe ser un objeto JSON"
+
+
+def leer_csv(lineas):
+    """
+    Genera un dict por fila usando la primera línea como cabecera; las líneas
+    que no se pueden decodificar o leer como CSV generan un str con el error.
+    """
+    pendientes = []
+
+    def texto():
+        for linea in lineas:
+            linea, error = _decodificar(linea)
+            if error:
+                # Una línea en blanco: el lector la salta y el error se informa en su lugar
+                pendientes.append(error)
+                linea = '\n'
+            yield linea
+
+    lector = csv.DictReader(texto())
+    while True:
+        try:
+            fila = next(lector)
+        except StopIteration:
+            break
+        except csv.Error as e:
+            fila = f"CSV inválido: {e}"
+        yield from pendientes
+        pendientes.clear()
+        yield fila
+    yield from pendientes
+
+
+LECTORES = {
+    'ndjson': leer_ndjson,
+    'csv': leer_csv,
+}
+
+
+def _texto(valor):
+    return '' if valor is None else str(valor).strip()
+
+
+def _clave_categoria(valor):
+    """Una categoría puede indicarse por id (número) o por nombre"""
+    valor = _texto(valor)
+    if not valor:
+        return None
+    if valor.isdecimal():
+        try:
+            return int(valor)
+        except ValueError:
+            pass
+    return valor
+
+
+def _validar(fila):
+    """Convierte una fila en kwargs para Libro; devuelve (datos, errores)"""
+    errores = {}
+    datos = {}
+    for campo in CAMPOS_OBLIGATORIOS:
+        datos[campo] = _texto(fila.get(campo))
+        if not datos[campo]:
+            errores[campo] = "Este campo es obligatorio"
+
+    idioma = _texto(fila.get('idioma'))
+    if idioma:
+        datos['idioma'] = idioma
+
+    for campo, maximo in LONGITUDES.items():
+        if len(datos.get(campo, '')) > maximo:
+            errores[campo] = f"Máximo {maximo} caracteres"
+
+    if datos['fecha_publicacion'] and 'fecha_publicacion' not in errores:
+        try:
+            datos['fecha_publicacion'] = date.fromisoformat(datos['fecha_publicacion'])
+        except ValueError:
+            errores['fecha_publicacion'] = "Fecha inválida, se espera AAAA-MM-DD"
+
+    paginas = _texto(fila.get('paginas'))
+    if paginas:
+        try:
+            datos['paginas'] = int(paginas)
+        except ValueError:
+            errores['paginas'] = "Debe ser un número entero"
+
+    portada_url = _texto(fila.get('portada_url'))
+    if portada_url:
+        try:
+            _validar_url(portada_url)
+            datos['portada_url'] = portada_url
+        except ValidationError:
+            errores['portada_url'] = "URL inválida"
+
+    return datos, errores
+
+
+class _Categorias:
+    """Resuelve categorías por id o nombre, con una caché que se llena lote a lote"""
+
+    def __init__(self, crear):
+        self.crear = crear
+        self.por_id = {}
+        self.por_nombre = {}
+
+    def precargar(self, claves):
+        ids = {c for c in claves if isinstance(c, int) and c not in self.por_id}
+        nombres = {c for c in claves if isinstance(c, str) and c not in self.por_nombre}
+        if not ids and not nombres:
+            return
+        for categoria in Categoria.objects.filter(id__in=ids) | Categoria.objects.filter(nombre__in=nombres):
+            self.por_id[categoria.id] = categoria.id
+            self.por_nombre[categoria.nombre] = categoria.id
+
+        faltan = nombres - self.por_nombre.keys()
+        if faltan and self.crear:
+            Categoria.objects.bulk_create([Categoria(nombre=n) for n in faltan], ignore_conflicts=True)
+            for categoria_id, nombre in Categoria.objects.filter(nombre__in=faltan).values_list('id', 'nombre'):
+                self.por_id[categoria_id] = categoria_id
+                self.por_nombre[nombre] = categoria_id
+
+    def resolver(self, clave):
+        if isinstance(clave, int):
+            return self.por_id.get(clave)
+        return self.por_nombre.get(clave)
+
+
+def _importar_lote(filas, primera, categorias, indice):
+    """Valida y escribe un lote; devuelve su informe"""
+    informe = {'fila_inicial': primera, 'filas': len(filas), 'creados': 0, 'actualizados': 0, 'errores': 0, 'detalle': []}
+
+    def anotar_error(numero, isbn, errores):
+        informe['errores'] += 1
+        if len(informe['detalle']) < MAX_ERRORES_POR_LOTE:
+            informe['detalle'].append({'fila': numero, 'isbn': isbn, 'errores': errores})
+
+    claves = {}
+    for numero, fila in enumerate(filas, primera):
+        if isinstance(fila, dict):
+            claves[numero] = _clave_categoria(fila.get('categoria') or fila.get('nombre_categoria'))
+    categorias.precargar(set(claves.values()) - {None})
+
+    libros = {}
+    for numero, fila in enumerate(filas, primera):
+        if not isinstance(fila, dict):
+            anotar_error(numero, None, {'fila': fila})
+            continue
+        datos, errores = _validar(fila)
+        clave = claves[numero]
+        if clave is not None:
+            datos['categoria_id'] = categorias.resolver(clave)
+            if datos['categoria_id'] is None:
+                errores['categoria'] = f"No existe la categoría {clave!r}"
+        if not errores and datos['isbn'] in libros:
+            errores['isbn'] = "ISBN repetido dentro del lote"
+        if errores:
+            anotar_error(numero, datos.get('isbn'), errores)
+            continue
+        libros[datos['isbn']] = Libro(**datos)
+
+    if not libros:
+        return informe
+
+    try:
+        with transaction.atomic():
+            existentes = set(Libro.objects.filter(isbn__in=libros.keys()).values_list('isbn', flat=True))
+            Libro.objects.bulk_create(
+                libros.values(),
+                update_conflicts=True,
+                unique_fields=['isbn'],
+                update_fields=CAMPOS_ACTUALIZABLES,
+            )
+            # Los libros nuevos entran disponibles; el upsert no toca disponible en los existentes
+            creados = len(libros) - len(existentes)
+            ajustar(libros=creados, libros_disponibles=creados)
+            if indice is not None:
+                indice.indexar(Libro.objects.filter(isbn__in=libros.keys()).only('id', 'titulo', 'autor', 'sinopsis'))
+    except DatabaseError as e:
+        for libro in libros.values():
+            anotar_error(None, libro.isbn, {'lote': str(e)})
+        return informe
+
+    informe['actualizados'] = len(existentes)
+    informe['creados'] = creados
+    return informe
+
+
+def importar_libros(filas, tamano_lote=TAMANO_LOTE, crear_categorias=True, al_terminar_lote=None):
+    """
+    Importa libros desde un iterable de filas (dicts, o str con un error de lectura).
+
+    Cada lote se escribe en su propia transacción. `al_terminar_lote`, si se
+    indica, recibe el informe de cada lote a medida que termina. Devuelve el
+    resumen de la importación con los informes de los lotes.
+    """
+    categorias = _Categorias(crear_categorias)
+    indice = obtener_indice()
+    resumen = {'filas': 0, 'creados': 0, 'actualizados': 0, 'errores': 0, 'lotes': []}
+
+    filas = iter(filas)
+    while True:
+        lote = list(islice(filas, tamano_lote))
+        if not lote:
+            break
+        informe = _importar_lote(lote, resumen['filas'] + 1, categorias, indice)
+        resumen['filas'] += informe['filas']
+        for clave in ('creados', 'actualizados', 'errores'):
+            resumen[clave] += informe[clave]
+        resumen['lotes'].append(informe)
+        escritos = informe['creados'] + informe['actualizados']
+        if escritos:
+            # bulk_create no dispara señales. Se invalida por lote: los lotes ya
+            # confirmados se ven aunque uno posterior falle
+            invalidar_catalogo()
+            invalidar_titulos()
+            invalidar_textos()
+            contadores.incrementar('libros_importados', escritos)
+        if al_terminar_lote is not None:
+            al_terminar_lote(informe)
+    return resumen
@@ -0,0 +1,323 @@
+"""
+Instrumentación de peticiones: latencia, consultas SQL, tiempo en el modelo y perfiles.
+
+InstrumentacionMiddleware abre una Medicion por petición en una ContextVar (la
+heredan los hilos de sync_to_async, así cubre también las vistas asíncronas).
+Cada conexión a la base de datos lleva un execute_wrapper que anota en ella
+cuántas consultas se hacen, cuánto tardan y cuántas veces se repite la misma
+sentencia (patrón N+1). ModeloResiliente anota el tiempo de espera al modelo.
+
+Al terminar, la petición se suma a las métricas del proceso (formato de texto
+de Prometheus en /metrics) y se registra una línea JSON en el logger
+'biblioteca.peticiones'. Una fracción de las peticiones síncronas se ejecuta
+bajo cProfile; si superan el umbral, el perfil va al logger 'biblioteca.perfil'.
+Solo se perfila una petición a la vez por proceso: desde Python 3.12 cProfile
+no admite dos perfiles activos y mide todos los hilos, así que el perfil
+incluye también lo que hicieron a la vez otras peticiones del mismo worker.
+
+Las métricas son del proceso: con varios workers cada uno expone las suyas.
+/metrics exige BIBLIOTECA_METRICS_TOKEN; sin token solo responde con DEBUG.
+"""
+import cProfile
+import hmac
+import io
+import json
+import logging
+import pstats
+import random
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+from .cache_catalogo import contadores
+
+logger = logging.getLogger('biblioteca.peticiones')
+logger_perfil = logging.getLogger('biblioteca.perfil')
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Funciones que se muestran de cada perfil
+LINEAS_PERFIL = 25
+
+_medicion_actual = ContextVar('medicion_biblioteca', default=None)
+
+# Un solo perfil a la vez en el proceso
+_perfil_lock = threading.Lock()
+
+
+class Medicion:
+    """Lo que se mide durante una petición"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.segundos_bd = 0.0
+        self.sentencias = Counter()
+        self.llamadas_modelo = 0
+        self.segundos_modelo = 0.0
+
+    def consulta(self, sql, segundos):
+        with self._lock:
+            self.consultas += 1
+            self.segundos_bd += segundos
+            self.sentencias[sql] += 1
+
+    def modelo(self, segundos):
+        with self._lock:
+            self.llamadas_modelo += 1
+            self.segundos_modelo += segundos
+
+    @property
+    def repetidas(self):
+        """Consultas que repiten una sentencia ya ejecutada en la petición"""
+        return sum(veces - 1 for veces in self.sentencias.values())
+
+
+def registrar_modelo(segundos):
+    """Anota en la petición en curso el tiempo de una llamada (o un fragmento) del modelo"""
+    medicion = _medicion_actual.get()
+    if medicion is not None:
+        medicion.modelo(segundos)
+
+
+def _registrar_consulta(execute, sql, params, many, context):
+    medicion = _medicion_actual.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        # El SQL llega sin los parámetros: la misma sentencia repetida es candidata a N+1
+        medicion.consulta(sql, time.perf_counter() - inicio)
+
+
+@receiver(connection_created)
+def instrumentar_conexion(sender, connection, **kwargs):
+    if _registrar_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_registrar_consulta)
+
+
+class _Histograma:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {}
+
+    def observar(self, etiquetas, valor):
+        serie = self.series.setdefault(etiquetas, [[0] * len(self.buckets), 0, 0.0])
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                serie[0][i] += 1
+        serie[1] += 1
+        serie[2] += valor
+
+
+class Metricas:
+    """Contadores e histogramas del proceso con etiquetas, exportables en formato Prometheus"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self.contadores = {}
+            self.latencia = _Histograma(BUCKETS_SEGUNDOS)
+
+    def registrar_peticion(self, metodo, ruta, estado, segundos, medicion):
+        with self._lock:
+            self.latencia.observar((('ruta', ruta),), segundos)
+            for nombre, etiquetas, valor in (
+                ('biblioteca_peticiones_total', (('metodo', metodo), ('ruta', ruta), ('estado', str(estado))), 1),
+                ('biblioteca_consultas_bd_total', (('ruta', ruta),), medicion.consultas),
+                ('biblioteca_bd_segundos_total', (('ruta', ruta),), medicion.segundos_bd),
+                ('biblioteca_consultas_repetidas_total', (('ruta', ruta),), medicion.repetidas),
+                ('biblioteca_modelo_segundos_total', (('ruta', ruta),), medicion.segundos_modelo),
+            ):
+                serie = self.contadores.setdefault(nombre, {})
+                serie[etiquetas] = serie.get(etiquetas, 0) + valor
+
+    def exportar(self):
+        """Texto en el formato de exposición de Prometheus (0.0.4)"""
+        lineas = []
+        with self._lock:
+            lineas += ['# TYPE biblioteca_peticion_segundos histogram']
+            for etiquetas, (acumulados, total, suma) in sorted(self.latencia.series.items()):
+                for limite, valor in zip(self.latencia.buckets, acumulados):
+                    lineas.append(f'biblioteca_peticion_segundos_bucket{_etiquetas(etiquetas + (("le", str(limite)),))} {valor}')
+                lineas.append(f'biblioteca_peticion_segundos_bucket{_etiquetas(etiquetas + (("le", "+Inf"),))} {total}')
+                lineas.append(f'biblioteca_peticion_segundos_sum{_etiquetas(etiquetas)} {suma:.6f}')
+                lineas.append(f'biblioteca_peticion_segundos_count{_etiquetas(etiquetas)} {total}')
+            for nombre, serie in sorted(self.contadores.items()):
+                lineas.append(f'# TYPE {nombre} counter')
+                for etiquetas, valor in sorted(serie.items()):
+                    lineas.append(f'{nombre}{_etiquetas(etiquetas)} {_numero(valor)}')
+
+        # Contadores de las cachés, el modelo, las reservas... (cache_catalogo.contadores)
+        lineas.append('# TYPE biblioteca_eventos_total counter')
+        for nombre, valor in sorted(contadores.obtener().items()):
+            lineas.append(f'biblioteca_eventos_total{_etiquetas((("evento", nombre),))} {_numero(valor)}')
+
+        from .cliente_modelo import estado_interruptores
+
+        lineas.append('# TYPE biblioteca_modelo_interruptor gauge')
+        for modelo, resumen in sorted(estado_interruptores().items()):
+            for estado in ('cerrado', 'abierto', 'semiabierto'):
+                valor = int(resumen['estado'] == estado)
+                lineas.append(f'biblioteca_modelo_interruptor{_etiquetas((("modelo", modelo), ("estado", estado)))} {valor}')
+        return '\n'.join(lineas) + '\n'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas(etiquetas):
+    if not etiquetas:
+        return ''
+    return '{' + ','.join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in etiquetas) + '}'
+
+
+def _numero(valor):
+    return f'{valor:.6f}' if isinstance(valor, float) else str(valor)
+
+
+metricas = Metricas()
+
+
+def _ruta(request):
+    # El patrón de la URL (no la URL) para que las etiquetas no crezcan sin límite
+    coincidencia = getattr(request, 'resolver_match', None)
+    return coincidencia.route if coincidencia is not None else 'sin_ruta'
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro, con los campos de `extra={'datos': {...}}`"""
+
+    def format(self, record):
+        datos = {
+            'fecha': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'mensaje': record.getMessage(),
+        }
+        datos.update(getattr(record, 'datos', None) or {})
+        if record.exc_info:
+            datos['excepcion'] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+class InstrumentacionMiddleware:
+    """Mide cada petición (síncrona o asíncrona); debe ir el primero en MIDDLEWARE"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        medicion = Medicion()
+        token = _medicion_actual.set(medicion)
+        perfil = None
+        if random.random() < getattr(settings, 'BIBLIOTECA_PERFIL_MUESTREO', 0.0):
+            perfil = self._empezar_perfil()
+        try:
+            response = self.get_response(request)
+        finally:
+            _medicion_actual.reset(token)
+            if perfil is not None:
+                perfil.disable()
+                _perfil_lock.release()
+        self._terminar(request, response, medicion, perfil)
+        return response
+
+    def _empezar_perfil(self):
+        # Si ya hay otro perfil en curso (de otra petición o de otra herramienta) esta no se perfila
+        if not _perfil_lock.acquire(blocking=False):
+            return None
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+        except ValueError:
+            _perfil_lock.release()
+            return None
+        return perfil
+
+    async def __acall__(self, request):
+        # cProfile es por hilo y mezclaría las corrutinas que comparten el bucle: no se perfila
+        medicion = Medicion()
+        token = _medicion_actual.set(medicion)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _medicion_actual.reset(token)
+        self._terminar(request, response, medicion, None)
+        return response
+
+    def _terminar(self, request, response, medicion, perfil):
+        # En respuestas en streaming se mide hasta las cabeceras, no hasta el último fragmento
+        segundos = time.perf_counter() - medicion.inicio
+        ruta = _ruta(request)
+        metricas.registrar_peticion(request.method, ruta, response.status_code, segundos, medicion)
+
+        datos = {
+            'metodo': request.method,
+            'ruta': ruta,
+            'path': request.path,
+            'estado': response.status_code,
+            'duracion_ms': round(segundos * 1000, 2),
+            'consultas': medicion.consultas,
+            'bd_ms': round(medicion.segundos_bd * 1000, 2),
+            'consultas_repetidas': medicion.repetidas,
+            'llamadas_modelo': medicion.llamadas_modelo,
+            'modelo_ms': round(medicion.segundos_modelo * 1000, 2),
+        }
+        nivel, mensaje = logging.INFO, "Petición"
+        if medicion.sentencias:
+            sentencia, veces = medicion.sentencias.most_common(1)[0]
+            if veces >= getattr(settings, 'BIBLIOTECA_UMBRAL_CONSULTAS_REPETIDAS', 10):
+                datos['sentencia_repetida'] = {'sql': sentencia[:300], 'veces': veces}
+                nivel, mensaje = logging.WARNING, "Posible N+1: la misma consulta se repite"
+                contadores.incrementar('peticiones_n_mas_1')
+        if segundos >= getattr(settings, 'BIBLIOTECA_PETICION_LENTA', 1.0):
+            nivel, mensaje = logging.WARNING, mensaje if nivel == logging.WARNING else "Petición lenta"
+            contadores.incrementar('peticiones_lentas')
+        logger.log(nivel, mensaje, extra={'datos': datos})
+        self._perfilar(datos, segundos, perfil)
+
+    def _perfilar(self, datos, segundos, perfil):
+        if perfil is None or segundos < getattr(settings, 'BIBLIOTECA_PERFIL_UMBRAL', 1.0):
+            return
+        salida = io.StringIO()
+        pstats.Stats(perfil, stream=salida).sort_stats('cumulative').print_stats(LINEAS_PERFIL)
+        logger_perfil.warning(
+            "Perfil de petición lenta", extra={'datos': {**datos, 'perfil': salida.getvalue()}}
+        )
+        contadores.incrementar('peticiones_perfiladas')
+
+
+def vista_metricas(request):
+    """
+    /metrics en formato Prometheus con 'Authorization: Bearer <BIBLIOTECA_METRICS_TOKEN>'.
+    Sin token configurado solo responde en desarrollo (DEBUG); si no, 404.
+    """
+    token = getattr(settings, 'BIBLIOTECA_METRICS_TOKEN', '')
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponse(status=404)
+    elif not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    return HttpResponse(metricas.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
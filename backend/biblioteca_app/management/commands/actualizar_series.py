@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from biblioteca_app.series import DIAS_POR_TRAMO, actualizar_series
+
+
+class Command(BaseCommand):
+    help = "Cierra los días pendientes de las series de reservas y rehace el día en curso"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reconstruir', action='store_true', help="Vuelve a agregar todo el historial")
+        parser.add_argument('--tramo', type=int, default=DIAS_POR_TRAMO, help="Días agregados por tramo")
+        parser.add_argument(
+            '--intervalo', type=float, default=0,
+            help="Segundos entre pasadas; con 0 se ejecuta una sola vez"
+        )
+
+    def handle(self, *args, **options):
+        reconstruir = options['reconstruir']
+        while True:
+            inicio = time.perf_counter()
+            resultado = actualizar_series(reconstruir=reconstruir, dias_por_tramo=options['tramo'])
+            self.stdout.write(
+                f"{resultado['dias_cerrados']} días cerrados, {resultado['filas']} filas escritas "
+                f"({time.perf_counter() - inicio:.3f}s)"
+            )
+            if not options['intervalo']:
+                break
+            reconstruir = False
+            connection.close()
+            time.sleep(options['intervalo'])
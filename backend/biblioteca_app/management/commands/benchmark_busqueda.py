@@ -0,0 +1,66 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from biblioteca_app.busqueda import obtener_indice, reconstruir_indice
+from biblioteca_app.datos_sinteticos import generar_catalogo
+from biblioteca_app.models import Libro
+
+CONSULTAS = ['sombra', 'corazon', 'océano ciudad', 'garcia', 'mus', 'estrella del rio']
+
+
+class Command(BaseCommand):
+    help = "Compara el índice de texto completo contra icontains sobre un catálogo sintético"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--libros', type=int, default=100000)
+        parser.add_argument('--repeticiones', type=int, default=5)
+        parser.add_argument('--limite', type=int, default=20, help="Resultados por página")
+
+    def handle(self, *args, **options):
+        indice = obtener_indice()
+        if indice is None:
+            raise CommandError("El motor de base de datos actual no tiene índice de texto completo")
+
+        # Todo se hace dentro de una transacción que se revierte al terminar
+        with transaction.atomic():
+            inicio = time.perf_counter()
+            generar_catalogo(options['libros'])
+            reconstruir_indice()
+            self.stdout.write(f"Catálogo de {options['libros']} libros generado en {time.perf_counter() - inicio:.1f}s")
+
+            # Se mide lo que hace el endpoint paginado: contar coincidencias y leer una página
+            for consulta in CONSULTAS:
+                def con_icontains():
+                    queryset = Libro.objects.filter(
+                        Q(titulo__icontains=consulta) |
+                        Q(autor__icontains=consulta) |
+                        Q(sinopsis__icontains=consulta)
+                    )
+                    queryset.count()
+                    list(queryset.values_list('id', flat=True)[:options['limite']])
+
+                def con_indice():
+                    queryset = indice.filtrar(Libro.objects.all(), consulta)
+                    queryset.count()
+                    list(queryset.values_list('id', flat=True)[:options['limite']])
+
+                t_icontains = self.medir(con_icontains, options['repeticiones'])
+                t_indice = self.medir(con_indice, options['repeticiones'])
+                self.stdout.write(
+                    f"{consulta!r:22} icontains {t_icontains * 1000:9.2f} ms | "
+                    f"índice {t_indice * 1000:8.2f} ms | x{t_icontains / t_indice:.1f}"
+                )
+
+            transaction.set_rollback(True)
+
+    def medir(self, funcion, repeticiones):
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            funcion()
+            tiempos.append(time.perf_counter() - inicio)
+        return statistics.median(tiempos)
@@ -0,0 +1,58 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from biblioteca_app.datos_sinteticos import generar_catalogo
+from biblioteca_app.models import Categoria, Libro, Reserva
+from biblioteca_app.reservas import reconciliar_reservas_activas
+
+SEMILLA = 910
+
+
+class Command(BaseCommand):
+    help = "Compara cancelar reservas una a una contra Reserva.objects.bulk_cancelar()"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reservas', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        n = options['reservas']
+        # Todo se hace dentro de una transacción que se revierte al terminar
+        with transaction.atomic():
+            generar_catalogo(2 * n, num_categorias=1, semilla=SEMILLA)
+            categoria = Categoria.objects.get(nombre=f'Categoría sintética {SEMILLA}-0')
+            libros = Libro.objects.filter(categoria=categoria)
+            vencimiento = timezone.now() + timedelta(days=14)
+            Reserva.objects.bulk_create([
+                Reserva(libro_id=libro_id, usuario_nombre='Benchmark', usuario_email='bench@example.com',
+                        fecha_vencimiento=vencimiento)
+                for libro_id in libros.values_list('id', flat=True)
+            ])
+            libros.update(disponible=False)
+            reconciliar_reservas_activas(reparar=True)
+
+            ids = list(Reserva.objects.filter(libro__categoria=categoria).order_by('id').values_list('id', flat=True))
+            por_objeto = Reserva.objects.filter(id__in=ids[:n])
+            en_bloque = Reserva.objects.filter(id__in=ids[n:])
+
+            def uno_a_uno():
+                for reserva in por_objeto:
+                    reserva.cancelar()
+
+            for nombre, funcion in (('uno a uno', uno_a_uno), ('bulk_cancelar', en_bloque.bulk_cancelar)):
+                with CaptureQueriesContext(connection) as consultas:
+                    inicio = time.perf_counter()
+                    funcion()
+                    duracion = time.perf_counter() - inicio
+                self.stdout.write(
+                    f"{nombre:14} {n} reservas: {duracion * 1000:9.1f} ms, "
+                    f"{len(consultas.captured_queries)} consultas"
+                )
+
+            libres = libros.filter(disponible=True, reserva_activa__isnull=True).count()
+            self.stdout.write(f"Libros liberados: {libres} de {2 * n}")
+            transaction.set_rollback(True)
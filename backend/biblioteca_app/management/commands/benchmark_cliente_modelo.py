@@ -0,0 +1,51 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from biblioteca_app.ai_bibliotecario import BibliotecarioIA
+from biblioteca_app.cliente_modelo import modelo_por_defecto
+
+
+class Command(BaseCommand):
+    help = "Mide el coste por petición de preparar el cliente del modelo: por petición contra compartido (sin red)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--peticiones', type=int, default=200)
+
+    def handle(self, *args, **options):
+        # No se hace ninguna llamada: basta con una clave cualquiera para crear los clientes
+        with override_settings(GEMINI_API_KEY=settings.GEMINI_API_KEY or 'sin-clave'):
+            self.medir(options['peticiones'])
+
+    def medir(self, peticiones):
+        inicio = time.perf_counter()
+        import google.generativeai as genai
+        from google.generativeai import client
+        self.stdout.write(f"import google.generativeai: {(time.perf_counter() - inicio) * 1000:.1f} ms (una vez por proceso)")
+
+        def por_peticion():
+            # Lo que hacía cada petición: configurar, crear el modelo y su cliente (que se crea en la primera llamada)
+            genai.configure(api_key=settings.GEMINI_API_KEY)
+            modelo = genai.GenerativeModel(modelo_por_defecto())
+            BibliotecarioIA(model=modelo)
+            client.get_default_generative_client()
+
+        def compartido():
+            BibliotecarioIA()
+            client.get_default_generative_client()
+
+        compartido()  # La primera petición del proceso crea el cliente compartido
+        for nombre, funcion in (('por petición', por_peticion), ('compartido', compartido)):
+            tiempos = []
+            for _ in range(peticiones):
+                inicio = time.perf_counter()
+                funcion()
+                tiempos.append(time.perf_counter() - inicio)
+            tiempos.sort()
+            self.stdout.write(
+                f"{nombre:12}: mediana {statistics.median(tiempos) * 1000:7.3f} ms | "
+                f"p99 {tiempos[int(len(tiempos) * 0.99) - 1] * 1000:7.3f} ms"
+            )
@@ -0,0 +1,93 @@
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from biblioteca_app.datos_sinteticos import generar_catalogo, generar_reservas
+from biblioteca_app.estadisticas import obtener_estadisticas, recalcular_estadisticas
+from biblioteca_app.models import Categoria, Libro, Reserva
+from biblioteca_app.reservas import reconciliar_reservas_activas, reservar_libro
+
+SEMILLA = 1021
+
+
+def estadisticas_recorriendo_tablas():
+    """Lo que hacía obtener_estadisticas_reservas antes de los contadores"""
+    total_libros = Libro.objects.count()
+    libros_disponibles = Libro.objects.filter(disponible=True).count()
+    Reserva.objects.filter(estado='activa').count()
+    Reserva.objects.filter(estado='vencida').count()
+    list(
+        Libro.objects.annotate(total=Count('reservas')).filter(total__gt=0)
+        .order_by('-total').values('titulo', 'autor', 'total')[:5]
+    )
+    return total_libros - libros_disponibles
+
+
+class Command(BaseCommand):
+    help = "Compara las estadísticas calculadas recorriendo las tablas contra los contadores mantenidos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--libros', type=int, default=100_000)
+        parser.add_argument('--reservas', type=int, default=1_000_000)
+        parser.add_argument('--repeticiones', type=int, default=5)
+        parser.add_argument('--lote', type=int, default=20_000, help="Reservas por bulk_create")
+
+    def handle(self, *args, **options):
+        # Todo se hace dentro de una transacción que se revierte al terminar
+        with transaction.atomic():
+            inicio = time.perf_counter()
+            generar_catalogo(options['libros'], num_categorias=5, semilla=SEMILLA)
+            categorias = Categoria.objects.filter(nombre__startswith=f'Categoría sintética {SEMILLA}-')
+            libro_ids = list(Libro.objects.filter(categoria__in=categorias).values_list('id', flat=True))
+
+            # Una reserva activa en el 10% de los libros; el resto, cerradas y repartidas con sesgo
+            creadas = generar_reservas(libro_ids, options['reservas'], semilla=SEMILLA, tamano_lote=options['lote'])
+            reconciliar_reservas_activas(reparar=True)
+            self.stdout.write(
+                f"{len(libro_ids)} libros y {creadas} reservas "
+                f"generados en {time.perf_counter() - inicio:.1f}s"
+            )
+
+            # bulk_create no pasa por las señales: el recálculo completo pone los contadores al día
+            inicio = time.perf_counter()
+            resultado = recalcular_estadisticas()
+            self.stdout.write(
+                f"Recálculo completo: {time.perf_counter() - inicio:.2f}s "
+                f"({resultado['libros_corregidos']} libros con num_reservas corregido)"
+            )
+
+            for nombre, funcion in (
+                ('recorriendo tablas', estadisticas_recorriendo_tablas),
+                ('contadores', obtener_estadisticas),
+            ):
+                funcion()
+                tiempos = []
+                for _ in range(options['repeticiones']):
+                    # El registro de consultas se llenó al generar los datos
+                    reset_queries()
+                    with CaptureQueriesContext(connection) as consultas:
+                        inicio = time.perf_counter()
+                        funcion()
+                        tiempos.append(time.perf_counter() - inicio)
+                self.stdout.write(
+                    f"{nombre:19} mediana {statistics.median(tiempos) * 1000:10.2f} ms, "
+                    f"{len(consultas.captured_queries)} consultas"
+                )
+
+            # Lo que cuesta mantener los contadores en cada escritura
+            libres = list(Libro.objects.filter(id__in=libro_ids, disponible=True).values_list('id', flat=True)[:200])
+            inicio = time.perf_counter()
+            for libro_id in libres:
+                reservar_libro(libro_id, 'Benchmark', 'bench@example.com', timezone.now() + timedelta(days=14)).cancelar()
+            duracion = time.perf_counter() - inicio
+            self.stdout.write(f"Reservar y cancelar con contadores: {duracion / len(libres) * 1000:.2f} ms por reserva")
+
+            deriva = recalcular_estadisticas()['deriva']
+            self.stdout.write(f"Deriva tras las escrituras: {deriva or 'ninguna'}")
+            transaction.set_rollback(True)
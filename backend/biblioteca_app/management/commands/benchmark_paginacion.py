@@ -0,0 +1,61 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+
+from biblioteca_app.datos_sinteticos import generar_catalogo
+from biblioteca_app.models import Libro
+from biblioteca_app.paginacion import codificar_cursor
+from biblioteca_app.views import LibroViewSet
+
+
+class Command(BaseCommand):
+    help = "Compara la latencia por página de la paginación por número contra la paginación por clave"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--libros', type=int, default=110000)
+        parser.add_argument('--tamano', type=int, default=10, help="Libros por página")
+        parser.add_argument('--paginas', type=int, nargs='+', default=[1, 100, 1000, 10000])
+        parser.add_argument('--repeticiones', type=int, default=5)
+
+    def handle(self, *args, **options):
+        fabrica = APIRequestFactory()
+        vista = LibroViewSet.as_view({'get': 'list'})
+        tamano = options['tamano']
+
+        # Todo se hace dentro de una transacción que se revierte al terminar
+        with override_settings(ALLOWED_HOSTS=['testserver']), transaction.atomic():
+            generar_catalogo(options['libros'])
+            orden = Libro.objects.order_by(*LibroViewSet.orden_keyset)
+
+            for pagina in options['paginas']:
+                if (pagina - 1) * tamano >= options['libros']:
+                    continue
+                parametros = {'page': pagina, 'page_size': tamano}
+                t_numero = self.medir(lambda: vista(fabrica.get('/api/libros/', parametros)), options['repeticiones'])
+
+                # Cursor de la última fila de la página anterior, como si se llegara por `next`
+                parametros = {'paginacion': 'keyset', 'page_size': tamano}
+                if pagina > 1:
+                    anterior = orden.values_list(*LibroViewSet.orden_keyset)[(pagina - 1) * tamano - 1]
+                    parametros['cursor'] = codificar_cursor(anterior)
+                t_keyset = self.medir(lambda: vista(fabrica.get('/api/libros/', parametros)), options['repeticiones'])
+
+                self.stdout.write(
+                    f"página {pagina:6}: número {t_numero * 1000:8.2f} ms | "
+                    f"clave {t_keyset * 1000:7.2f} ms | x{t_numero / t_keyset:.1f}"
+                )
+
+            transaction.set_rollback(True)
+
+    def medir(self, funcion, repeticiones):
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            respuesta = funcion()
+            respuesta.render()
+            tiempos.append(time.perf_counter() - inicio)
+        return statistics.median(tiempos)
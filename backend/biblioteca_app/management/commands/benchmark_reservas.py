@@ -0,0 +1,73 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from biblioteca_app.datos_sinteticos import generar_catalogo
+from biblioteca_app.models import Categoria, Libro, Reserva
+from biblioteca_app.reservas import ReservaNoDisponible, reservar_libro
+
+SEMILLA = 808
+
+
+class Command(BaseCommand):
+    help = "Lanza reservas concurrentes sobre pocos libros y comprueba que cada uno tenga una sola reserva activa"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--libros', type=int, default=20)
+        parser.add_argument('--peticiones', type=int, default=500)
+        parser.add_argument('--hilos', type=int, default=32)
+
+    def handle(self, *args, **options):
+        # Los hilos usan sus propias conexiones, así que los datos deben estar confirmados
+        generar_catalogo(options['libros'], num_categorias=1, semilla=SEMILLA)
+        categorias = Categoria.objects.filter(nombre__startswith=f'Categoría sintética {SEMILLA}-')
+        libro_ids = list(Libro.objects.filter(categoria__in=categorias).values_list('id', flat=True))
+        vencimiento = timezone.now() + timedelta(days=14)
+
+        def reservar(n):
+            try:
+                reservar_libro(
+                    libro_ids[n % len(libro_ids)],
+                    usuario_nombre=f'Usuario {n}',
+                    usuario_email=f'usuario{n}@example.com',
+                    fecha_vencimiento=vencimiento
+                )
+                return 'reservada'
+            except ReservaNoDisponible:
+                return 'rechazada'
+            except Exception as e:
+                return type(e).__name__
+            finally:
+                connection.close()
+
+        try:
+            inicio = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['hilos']) as ejecutor:
+                resultados = Counter(ejecutor.map(reservar, range(options['peticiones'])))
+            duracion = time.perf_counter() - inicio
+
+            activas = Counter(
+                Reserva.objects.filter(libro_id__in=libro_ids, estado='activa').values_list('libro_id', flat=True)
+            )
+            dobles = [libro_id for libro_id, total in activas.items() if total > 1]
+
+            self.stdout.write(
+                f"{options['peticiones']} peticiones en {duracion:.2f}s "
+                f"({options['peticiones'] / duracion:.0f} req/s)"
+            )
+            for resultado, total in sorted(resultados.items()):
+                self.stdout.write(f"  {resultado}: {total}")
+            self.stdout.write(f"Libros reservados: {len(activas)} de {len(libro_ids)}")
+            if dobles:
+                self.stdout.write(self.style.ERROR(f"Libros con más de una reserva activa: {dobles}"))
+            else:
+                self.stdout.write(self.style.SUCCESS("Ningún libro con reservas duplicadas"))
+        finally:
+            Reserva.objects.filter(libro_id__in=libro_ids).delete()
+            Libro.objects.filter(id__in=libro_ids).delete()
+            categorias.delete()
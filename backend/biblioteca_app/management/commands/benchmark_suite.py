@@ -0,0 +1,163 @@
+import json
+import logging
+import platform
+import subprocess
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from biblioteca_app.benchmarks import ErrorEscenario, comparar, construir_escenarios, ejecutar_escenarios
+from biblioteca_app.busqueda import reconstruir_indice
+from biblioteca_app.datos_sinteticos import generar_catalogo, generar_reservas
+from biblioteca_app.estadisticas import recalcular_estadisticas
+from biblioteca_app.models import Categoria, Libro
+from biblioteca_app.reservas import reconciliar_reservas_activas
+
+SEMILLA = 2025
+
+# Caché propia del benchmark: los escenarios la vacían entre iteraciones
+CACHE_BENCHMARK = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+    }
+}
+
+
+def commit_actual():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextmanager
+def base_datos_temporal():
+    """
+    Base de datos de pruebas de Django (la de manage.py test: TEST.NAME, o en
+    memoria con SQLite) que se crea vacía y se borra al terminar.
+    """
+    nombre = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(nombre, verbosity=0)
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera un catálogo sintético determinista en una base de datos temporal, mide los "
+        "escenarios de la API (p50/p95/p99, consultas y memoria) y escribe los resultados en JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--libros', type=int, default=10_000)
+        parser.add_argument('--reservas', type=int, default=None, help="Por defecto, 5 por libro")
+        parser.add_argument('--categorias', type=int, default=20)
+        parser.add_argument('--semilla', type=int, default=SEMILLA)
+        parser.add_argument('--repeticiones', type=int, default=50, help="Iteraciones medidas por escenario")
+        parser.add_argument('--calentamiento', type=int, default=3)
+        parser.add_argument('--escenarios', nargs='+', help="Solo estos escenarios")
+        parser.add_argument('--salida', default='benchmark.json', help="Fichero JSON de resultados ('-' para stdout)")
+        parser.add_argument('--comparar', help="JSON de una ejecución anterior con el que comparar")
+        parser.add_argument(
+            '--en-transaccion', action='store_true',
+            help="Usa la base de datos actual dentro de una transacción que se revierte (para las pruebas: "
+                 "bloquea las escrituras mientras dura y las invalidaciones on_commit no llegan a ejecutarse)"
+        )
+
+    def handle(self, *args, **options):
+        anteriores = None
+        if options['comparar']:
+            anteriores = json.loads(Path(options['comparar']).read_text())['escenarios']
+        reservas = options['libros'] * 5 if options['reservas'] is None else options['reservas']
+        # Con la salida JSON en stdout, el progreso va a stderr
+        self.progreso = self.stderr if options['salida'] == '-' else self.stdout
+
+        # Una línea de log por petición falsearía las latencias; solo se dejan los avisos
+        logger = logging.getLogger('biblioteca.peticiones')
+        nivel = logger.level
+        logger.setLevel(logging.WARNING)
+        # Ni la base de datos ni la caché configuradas se tocan: pueden estar en uso
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=['testserver'], CACHES=CACHE_BENCHMARK, BIBLIOTECA_CACHE_ALIAS='default'
+            ):
+                if options['en_transaccion']:
+                    with transaction.atomic():
+                        generacion, escenarios = self.medir(options, reservas)
+                        transaction.set_rollback(True)
+                else:
+                    with base_datos_temporal():
+                        generacion, escenarios = self.medir(options, reservas)
+        finally:
+            logger.setLevel(nivel)
+
+        resultado = {
+            'fecha': timezone.now().isoformat(),
+            'commit': commit_actual(),
+            'entorno': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'base_datos': connection.vendor,
+            },
+            'parametros': {
+                'libros': options['libros'], 'reservas': reservas, 'categorias': options['categorias'],
+                'semilla': options['semilla'], 'repeticiones': options['repeticiones'],
+            },
+            'generacion_s': round(generacion, 2),
+            'escenarios': escenarios,
+        }
+        if anteriores is not None:
+            resultado['comparacion'] = comparar(anteriores, escenarios)
+            for nombre, cambios in resultado['comparacion'].items():
+                self.progreso.write(
+                    f"{nombre:24} p50 x{cambios['p50_ms']} | p95 x{cambios['p95_ms']} | consultas x{cambios['consultas']}"
+                )
+
+        texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+        if options['salida'] == '-':
+            self.stdout.write(texto)
+        else:
+            Path(options['salida']).write_text(texto + '\n')
+            self.stdout.write(f"Resultados en {options['salida']}")
+
+    def medir(self, options, reservas):
+        inicio = time.perf_counter()
+        generar_catalogo(options['libros'], options['categorias'], semilla=options['semilla'])
+        categorias = Categoria.objects.filter(nombre__startswith=f"Categoría sintética {options['semilla']}-")
+        libro_ids = list(Libro.objects.filter(categoria__in=categorias).order_by('id').values_list('id', flat=True))
+        generar_reservas(libro_ids, reservas, semilla=options['semilla'])
+        # bulk_create no pasa por las señales: se rehacen los derivados
+        reconciliar_reservas_activas(reparar=True)
+        recalcular_estadisticas()
+        reconstruir_indice()
+        generacion = time.perf_counter() - inicio
+        self.progreso.write(f"{len(libro_ids)} libros y {reservas} reservas generados en {generacion:.1f}s")
+
+        try:
+            escenarios = ejecutar_escenarios(
+                construir_escenarios(libro_ids), options['repeticiones'], options['calentamiento'],
+                seleccion=options['escenarios'], progreso=self.mostrar,
+            )
+        except ErrorEscenario as e:
+            raise CommandError(str(e))
+        return generacion, escenarios
+
+    def mostrar(self, nombre, medida):
+        self.progreso.write(
+            f"{nombre:24} p50 {medida['p50_ms']:8.2f} ms | p95 {medida['p95_ms']:8.2f} ms | "
+            f"p99 {medida['p99_ms']:8.2f} ms | {medida['consultas']:4g} consultas | "
+            f"{medida['memoria_pico_kib']:9.1f} KiB"
+        )
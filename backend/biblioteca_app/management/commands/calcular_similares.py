@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from biblioteca_app.similares import K_VECINOS, TAMANO_BLOQUE, actualizar_similares, calcular_similares
+from biblioteca_app.vectores import IndiceNoConstruido
+
+
+class Command(BaseCommand):
+    help = "Calcula la tabla de libros similares (completa, o solo lo que cambió con --incremental)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=K_VECINOS, help="Vecinos por libro")
+        parser.add_argument('--bloque', type=int, default=TAMANO_BLOQUE, help="Libros por bloque de cálculo")
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help="Recalcula solo los libros modificados desde el último cálculo y los que los tenían de vecino"
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        calcular = actualizar_similares if options['incremental'] else calcular_similares
+        try:
+            total = calcular(k=options['k'], tamano_bloque=options['bloque'])
+        except IndiceNoConstruido as e:
+            raise CommandError(str(e))
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(f"Vecinos calculados para {total} libros en {duracion:.2f}s"))
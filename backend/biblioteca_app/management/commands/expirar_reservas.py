@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from biblioteca_app.reservas import expirar_reservas_vencidas
+
+
+class Command(BaseCommand):
+    help = "Marca como vencidas las reservas fuera de plazo y libera sus libros"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help="Reservas por UPDATE")
+        parser.add_argument(
+            '--intervalo', type=float, default=0,
+            help="Segundos entre barridos; con 0 se ejecuta una sola vez"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            metricas = expirar_reservas_vencidas(tamano_lote=options['lote'])
+            self.stdout.write(
+                f"{metricas['reservas_vencidas']} reservas vencidas en {metricas['lotes']} lotes "
+                f"({metricas['duracion']:.3f}s, {metricas['filas_por_segundo']} filas/s)"
+            )
+            if not options['intervalo']:
+                break
+            # Evita mantener abierta la conexión entre barridos
+            connection.close()
+            time.sleep(options['intervalo'])
@@ -0,0 +1,47 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from biblioteca_app.importacion import LECTORES, importar_libros
+
+
+class Command(BaseCommand):
+    help = "Importa libros en bloque desde un archivo NDJSON o CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo')
+        parser.add_argument('--formato', choices=sorted(LECTORES), help="Por defecto se deduce de la extensión")
+        parser.add_argument('--lote', type=int, default=2000, help="Filas por lote")
+        parser.add_argument('--no-crear-categorias', action='store_true', help="Rechaza categorías inexistentes")
+
+    def handle(self, *args, **options):
+        formato = options['formato'] or os.path.splitext(options['archivo'])[1].lstrip('.').lower()
+        if formato == 'jsonl':
+            formato = 'ndjson'
+        if formato not in LECTORES:
+            raise CommandError(f"Formato no soportado: {formato!r}; usa --formato")
+
+        inicio = time.perf_counter()
+
+        def mostrar_lote(informe):
+            self.stdout.write(
+                f"Filas {informe['fila_inicial']}-{informe['fila_inicial'] + informe['filas'] - 1}: "
+                f"{informe['creados']} creados, {informe['actualizados']} actualizados, {informe['errores']} errores"
+            )
+            for error in informe['detalle']:
+                self.stderr.write(f"  fila {error['fila']} (ISBN {error['isbn']}): {error['errores']}")
+
+        with open(options['archivo'], encoding='utf-8', newline='') as archivo:
+            resumen = importar_libros(
+                LECTORES[formato](archivo),
+                tamano_lote=options['lote'],
+                crear_categorias=not options['no_crear_categorias'],
+                al_terminar_lote=mostrar_lote,
+            )
+
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"{resumen['filas']} filas en {duracion:.1f}s ({resumen['filas'] / duracion if duracion else 0:.0f} filas/s): "
+            f"{resumen['creados']} creados, {resumen['actualizados']} actualizados, {resumen['errores']} errores"
+        ))
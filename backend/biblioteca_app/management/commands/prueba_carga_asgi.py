@@ -0,0 +1,76 @@
+import asyncio
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import AsyncClient, override_settings
+
+from biblioteca_app import async_views
+from biblioteca_app.ai_bibliotecario import BibliotecarioIA
+from biblioteca_app.benchmarks import percentil
+from biblioteca_app.cache_respuestas import obtener_cache_respuestas
+from biblioteca_app.datos_sinteticos import generar_catalogo
+from biblioteca_app.modelo_falso import ModeloFalso
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga en proceso: mide la latencia de /api/libros/ mientras hay "
+        "muchas consultas al asistente asíncrono esperando a un modelo lento simulado"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--libros', type=int, default=1000, help="Libros sintéticos a generar")
+        parser.add_argument('--consultas', type=int, default=100, help="Consultas de chat simultáneas")
+        parser.add_argument('--demora', type=float, default=2.0, help="Segundos que tarda el modelo simulado")
+        parser.add_argument('--muestras', type=int, default=20, help="Peticiones al catálogo por fase")
+
+    def handle(self, *args, **options):
+        modelo = ModeloFalso(demora=options['demora'])
+        obtener_cache_respuestas().vaciar()
+
+        # El cliente de pruebas usa el host "testserver"
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+            generar_catalogo(options['libros'])
+            with mock.patch.object(async_views, 'obtener_bibliotecario', lambda: BibliotecarioIA(model=modelo)):
+                base, carga, duracion_chat = async_to_sync(self.ejecutar)(options)
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"Catálogo sin carga:   p50 {percentil(base, 50):7.1f} ms | p95 {percentil(base, 95):7.1f} ms")
+        self.stdout.write(f"Catálogo con carga:   p50 {percentil(carga, 50):7.1f} ms | p95 {percentil(carga, 95):7.1f} ms")
+        self.stdout.write(
+            f"{options['consultas']} consultas de chat completadas en {duracion_chat:.1f}s "
+            f"(máx. {modelo.max_concurrentes} llamadas simultáneas al modelo)"
+        )
+
+    async def ejecutar(self, options):
+        client = AsyncClient()
+
+        async def medir_catalogo():
+            inicio = time.perf_counter()
+            response = await client.get('/api/libros/', {'page': 2})
+            assert response.status_code == 200, response.status_code
+            return (time.perf_counter() - inicio) * 1000
+
+        base = [await medir_catalogo() for _ in range(options['muestras'])]
+
+        async def chat(i):
+            await client.post(
+                '/api/async/bibliotecario/consulta/',
+                {'consulta': f'Recomiéndame libros sobre el tema {i}'},
+                content_type='application/json'
+            )
+
+        inicio = time.perf_counter()
+        tareas = [asyncio.create_task(chat(i)) for i in range(options['consultas'])]
+        # Dejar que las consultas lleguen hasta la llamada al modelo
+        await asyncio.sleep(min(0.5, options['demora'] / 4))
+        carga = []
+        for _ in range(options['muestras']):
+            carga.append(await medir_catalogo())
+        await asyncio.gather(*tareas)
+        duracion_chat = time.perf_counter() - inicio
+
+        return base, carga, duracion_chat
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from biblioteca_app.estadisticas import recalcular_estadisticas
+
+
+class Command(BaseCommand):
+    help = "Recalcula desde las tablas los contadores de estadísticas y corrige la deriva"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--intervalo', type=float, default=0,
+            help="Segundos entre recálculos; con 0 se ejecuta una sola vez"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            inicio = time.perf_counter()
+            resultado = recalcular_estadisticas()
+            deriva = ', '.join(f"{nombre} {correccion:+d}" for nombre, correccion in resultado['deriva'].items())
+            self.stdout.write(
+                f"Estadísticas recalculadas en {time.perf_counter() - inicio:.3f}s; "
+                f"deriva: {deriva or 'ninguna'}; num_reservas corregido en {resultado['libros_corregidos']} libros"
+            )
+            if not options['intervalo']:
+                break
+            connection.close()
+            time.sleep(options['intervalo'])
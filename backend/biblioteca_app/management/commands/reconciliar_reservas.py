@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from biblioteca_app.reservas import reconciliar_reservas_activas
+
+
+class Command(BaseCommand):
+    help = "Detecta y repara diferencias entre Libro.reserva_activa y las reservas activas"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reparar', action='store_true', help="Corrige los libros con desajuste")
+
+    def handle(self, *args, **options):
+        ids = reconciliar_reservas_activas(reparar=options['reparar'])
+        if not ids:
+            self.stdout.write(self.style.SUCCESS("Sin desajustes"))
+            return
+
+        muestra = ', '.join(str(i) for i in ids[:20])
+        self.stdout.write(f"{len(ids)} libros con desajuste: {muestra}{'...' if len(ids) > 20 else ''}")
+        if options['reparar']:
+            self.stdout.write(self.style.SUCCESS(f"{len(ids)} libros reparados"))
+        else:
+            self.stdout.write("Ejecuta con --reparar para corregirlos")
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from biblioteca_app.busqueda import obtener_indice, reconstruir_indice
+
+
+class Command(BaseCommand):
+    help = "Reconstruye en bloque el índice de texto completo del catálogo"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=2000, help="Libros por lote")
+
+    def handle(self, *args, **options):
+        if obtener_indice() is None:
+            self.stderr.write("El motor de base de datos actual no tiene índice de texto completo")
+            return
+
+        inicio = time.perf_counter()
+        with transaction.atomic():
+            total = reconstruir_indice(tamano_lote=options['lote'])
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(f"{total} libros indexados en {duracion:.2f}s"))
@@ -0,0 +1,22 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from biblioteca_app.vectores import IndiceVectorial, obtener_embedder
+
+
+class Command(BaseCommand):
+    help = "Vectoriza el catálogo y reescribe la matriz del índice semántico"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=2000, help="Libros por lote")
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        indice = IndiceVectorial(settings.BIBLIOTECA_VECTORES_DIR, obtener_embedder())
+        total = indice.reconstruir(tamano_lote=options['lote'])
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} libros vectorizados con {indice.embedder.nombre} en {duracion:.2f}s ({indice.ruta_meta})"
+        ))
@@ -0,0 +1,80 @@
+import unicodedata
+
+from django.db import migrations
+
+# Copia del SQL de biblioteca_app.busqueda en el momento de la migración: el
+# módulo puede cambiar después y la migración debe seguir creando lo mismo
+TABLA_FTS = 'biblioteca_app_libro_fts'
+
+SQL_CREAR = {
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} "
+        "USING fts5(titulo, autor, sinopsis, tokenize='unicode61 remove_diacritics 2')",
+    ],
+    'postgresql': [
+        f"CREATE TABLE IF NOT EXISTS {TABLA_FTS} ("
+        "libro_id bigint PRIMARY KEY REFERENCES biblioteca_app_libro(id) ON DELETE CASCADE, "
+        "documento tsvector NOT NULL)",
+        f"CREATE INDEX IF NOT EXISTS {TABLA_FTS}_gin ON {TABLA_FTS} USING GIN (documento)",
+    ],
+}
+
+SQL_INSERTAR = {
+    'sqlite': f"INSERT INTO {TABLA_FTS} (rowid, titulo, autor, sinopsis) VALUES (%s, %s, %s, %s)",
+    'postgresql': (
+        f"INSERT INTO {TABLA_FTS} (libro_id, documento) VALUES (%s, "
+        "setweight(to_tsvector('spanish', %s), 'A') || "
+        "setweight(to_tsvector('spanish', %s), 'B') || "
+        "setweight(to_tsvector('spanish', %s), 'D')) "
+        "ON CONFLICT (libro_id) DO UPDATE SET documento = EXCLUDED.documento"
+    ),
+}
+
+SQL_BORRAR = f"DROP TABLE IF EXISTS {TABLA_FTS}"
+
+TAMANO_LOTE = 2000
+
+
+def normalizar(texto):
+    """Minúsculas y sin acentos, como normalizar_texto() al crear la migración"""
+    if not texto:
+        return ''
+    descompuesto = unicodedata.normalize('NFKD', str(texto).lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def crear_indice(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in SQL_CREAR:
+        return
+    for sql in SQL_CREAR[vendor]:
+        schema_editor.execute(sql)
+
+    # Indexar los libros que ya existen
+    Libro = apps.get_model('biblioteca_app', 'Libro')
+    filas = Libro.objects.order_by().values_list('id', 'titulo', 'autor', 'sinopsis')
+    lote = []
+    with schema_editor.connection.cursor() as cursor:
+        for libro_id, titulo, autor, sinopsis in filas.iterator(chunk_size=TAMANO_LOTE):
+            lote.append((libro_id, normalizar(titulo), normalizar(autor), normalizar(sinopsis)))
+            if len(lote) >= TAMANO_LOTE:
+                cursor.executemany(SQL_INSERTAR[vendor], lote)
+                lote = []
+        if lote:
+            cursor.executemany(SQL_INSERTAR[vendor], lote)
+
+
+def borrar_indice(apps, schema_editor):
+    if schema_editor.connection.vendor in SQL_CREAR:
+        schema_editor.execute(SQL_BORRAR)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca_app', '0003_reserva'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def poblar_reserva_activa(apps, schema_editor):
+    Libro = apps.get_model('biblioteca_app', 'Libro')
+    Reserva = apps.get_model('biblioteca_app', 'Reserva')
+    activa = Reserva.objects.filter(
+        libro=models.OuterRef('pk'), estado='activa'
+    ).order_by('-fecha_reserva').values('id')[:1]
+    Libro.objects.update(reserva_activa=models.Subquery(activa))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca_app', '0004_indice_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='libro',
+            name='reserva_activa',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='biblioteca_app.reserva'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(condition=models.Q(('estado', 'activa')), fields=['libro'], name='reserva_libro_activa_idx'),
+        ),
+        migrations.RunPython(poblar_reserva_activa, migrations.RunPython.noop),
+    ]
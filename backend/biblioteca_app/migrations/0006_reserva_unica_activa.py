@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:32
+
+from django.db import migrations, models
+
+
+def cancelar_reservas_duplicadas(apps, schema_editor):
+    """Deja solo la reserva activa más reciente de cada libro para poder crear la restricción"""
+    Reserva = apps.get_model('biblioteca_app', 'Reserva')
+    Libro = apps.get_model('biblioteca_app', 'Libro')
+    duplicados = (
+        Reserva.objects.filter(estado='activa').values('libro')
+        .annotate(total=models.Count('id')).filter(total__gt=1).values_list('libro', flat=True)
+    )
+    for libro_id in list(duplicados):
+        activas = list(
+            Reserva.objects.filter(libro_id=libro_id, estado='activa')
+            .order_by('-fecha_reserva', '-id').values_list('id', flat=True)
+        )
+        Reserva.objects.filter(id__in=activas[1:]).update(estado='cancelada')
+        Libro.objects.filter(pk=libro_id).update(reserva_activa_id=activas[0])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca_app', '0005_reserva_activa'),
+    ]
+
+    operations = [
+        migrations.RunPython(cancelar_reservas_duplicadas, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='reserva',
+            name='reserva_libro_activa_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='reserva',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado', 'activa')), fields=('libro',), name='reserva_unica_activa_por_libro'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca_app', '0006_reserva_unica_activa'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['estado', 'fecha_vencimiento'], name='reserva_estado_venc_idx'),
+        ),
+    ]
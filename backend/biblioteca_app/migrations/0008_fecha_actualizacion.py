@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:38
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def rellenar_fecha_actualizacion(apps, schema_editor):
+    """Las filas existentes toman su fecha de alta como última modificación"""
+    apps.get_model('biblioteca_app', 'Libro').objects.update(fecha_actualizacion=F('fecha_creacion'))
+    apps.get_model('biblioteca_app', 'Reserva').objects.update(fecha_actualizacion=F('fecha_reserva'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca_app', '0007_reserva_estado_vencimiento_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='libro',
+            name='fecha_actualizacion',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='reserva',
+            name='fecha_actualizacion',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(rellenar_fecha_actualizacion, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca_app', '0009_indices_paginacion_keyset'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LibroSimilar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posicion', models.PositiveSmallIntegerField()),
+                ('puntuacion', models.FloatField()),
+                ('fecha_calculo', models.DateTimeField(db_index=True)),
+                ('libro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similares', to='biblioteca_app.libro')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='biblioteca_app.libro')),
+            ],
+            options={
+                'ordering': ['libro', 'posicion'],
+                'constraints': [models.UniqueConstraint(fields=('libro', 'posicion'), name='libro_similar_posicion_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+def calcular_estadisticas(apps, schema_editor):
+    Libro = apps.get_model('biblioteca_app', 'Libro')
+    Reserva = apps.get_model('biblioteca_app', 'Reserva')
+    Estadistica = apps.get_model('biblioteca_app', 'Estadistica')
+    por_estado = dict(Reserva.objects.order_by().values_list('estado').annotate(n=models.Count('id')))
+    valores = {
+        'libros': Libro.objects.count(),
+        'libros_disponibles': Libro.objects.filter(disponible=True).count(),
+        **{f'reservas_{estado}': por_estado.get(estado, 0) for estado in ('activa', 'completada', 'cancelada', 'vencida')},
+    }
+    Estadistica.objects.bulk_create([Estadistica(nombre=nombre, valor=valor) for nombre, valor in valores.items()])
+    reservas = Reserva.objects.filter(
+        libro=models.OuterRef('pk')
+    ).order_by().values('libro').annotate(n=models.Count('id')).values('n')
+    Libro.objects.filter(reservas__isnull=False).update(num_reservas=models.Subquery(reservas))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca_app', '0010_libros_similares'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Estadistica',
+            fields=[
+                ('nombre', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('valor', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='libro',
+            name='num_reservas',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='libro',
+            index=models.Index(fields=['num_reservas', 'id'], name='libro_num_reservas_idx'),
+        ),
+        migrations.RunPython(calcular_estadisticas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca_app', '0011_estadisticas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('reservas', models.PositiveIntegerField(default=0)),
+                ('devoluciones', models.PositiveIntegerField(default=0)),
+                ('segundos_prestamo', models.BigIntegerField(default=0)),
+                ('vencimientos', models.PositiveIntegerField(default=0)),
+                ('atrasadas', models.PositiveIntegerField(default=0)),
+                ('cerrado', models.BooleanField(default=False)),
+                ('fecha_calculo', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['dia', 'categoria'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['fecha_devolucion'], name='reserva_devolucion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['fecha_vencimiento'], name='reserva_vencimiento_idx'),
+        ),
+        migrations.AddField(
+            model_name='reservadiaria',
+            name='categoria',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='biblioteca_app.categoria'),
+        ),
+        migrations.AddConstraint(
+            model_name='reservadiaria',
+            constraint=models.UniqueConstraint(fields=('dia', 'categoria'), name='reserva_diaria_dia_categoria_unica'),
+        ),
+    ]
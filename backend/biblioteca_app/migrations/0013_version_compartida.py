@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:36
+
+import time
+
+from django.db import migrations, models
+
+
+def crear_version(apps, schema_editor):
+    VersionCompartida = apps.get_model('biblioteca_app', 'VersionCompartida')
+    ahora = time.time()
+    VersionCompartida.objects.create(nombre='catalogo', valor=int(ahora * 1000), modificado=int(ahora))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca_app', '0012_series_reservas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionCompartida',
+            fields=[
+                ('nombre', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('valor', models.BigIntegerField()),
+                ('modificado', models.BigIntegerField()),
+            ],
+        ),
+        migrations.RunPython(crear_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca_app', '0013_version_compartida'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consulta',
+            name='version_catalogo',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
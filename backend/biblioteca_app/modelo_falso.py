@@ -0,0 +1,96 @@
+"""
+Modelo de lenguaje falso y determinista para pruebas y benchmarks.
+
+Imita la parte de google.generativeai.GenerativeModel que usa BibliotecarioIA
+(generate_content y generate_content_async) sin hacer llamadas de red.
+"""
+import asyncio
+import json
+import threading
+import time
+
+
+class RespuestaFalsa:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FlujoAsync:
+    def __init__(self, fragmentos, demora):
+        self.fragmentos = fragmentos
+        self.demora = demora
+
+    async def __aiter__(self):
+        for fragmento in self.fragmentos:
+            await asyncio.sleep(self.demora)
+            yield RespuestaFalsa(fragmento)
+
+
+class ModeloFalso:
+    """
+    Con stream=True devuelve la respuesta en fragmentos de `tamano_fragmento`
+    caracteres, repartiendo la demora entre ellos.
+
+    `errores` simula fallos: la llamada n-ésima lanza errores[n] si no es None
+    (las llamadas posteriores a la lista responden bien). Una demora mayor que
+    el plazo del cliente simula un modelo colgado.
+    """
+
+    def __init__(self, respuesta=None, demora=0, tamano_fragmento=8, errores=()):
+        self.respuesta = respuesta or {"tipo": "informacion", "respuesta": "Hola"}
+        self.demora = demora
+        self.tamano_fragmento = tamano_fragmento
+        self.errores = list(errores)
+        self.llamadas = 0
+        self.concurrentes = 0
+        self.max_concurrentes = 0
+        self._lock = threading.Lock()
+
+    def _texto(self):
+        if isinstance(self.respuesta, str):
+            return self.respuesta
+        return json.dumps(self.respuesta, ensure_ascii=False)
+
+    def _entrar(self):
+        with self._lock:
+            self.llamadas += 1
+            error = self.errores[self.llamadas - 1] if self.llamadas <= len(self.errores) else None
+            if error is not None:
+                raise error
+            self.concurrentes += 1
+            self.max_concurrentes = max(self.max_concurrentes, self.concurrentes)
+
+    def _salir(self):
+        with self._lock:
+            self.concurrentes -= 1
+
+    def _fragmentos(self):
+        texto = self._texto()
+        return [texto[i:i + self.tamano_fragmento] for i in range(0, len(texto), self.tamano_fragmento)]
+
+    def _flujo(self):
+        fragmentos = self._fragmentos()
+        for fragmento in fragmentos:
+            time.sleep(self.demora / len(fragmentos))
+            yield RespuestaFalsa(fragmento)
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        self._entrar()
+        try:
+            if stream:
+                return self._flujo()
+            time.sleep(self.demora)
+            return RespuestaFalsa(self._texto())
+        finally:
+            self._salir()
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        self._entrar()
+        try:
+            if stream:
+                fragmentos = self._fragmentos()
+                return _FlujoAsync(fragmentos, self.demora / len(fragmentos))
+            await asyncio.sleep(self.demora)
+            return RespuestaFalsa(self._texto())
+        finally:
+            self._salir()
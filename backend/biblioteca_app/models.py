@@ -1,9 +1,22 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .cache_catalogo import invalidar_catalogo
 
 
 # Create your models here.
 
+# Campos de Libro que se vectorizan para la búsqueda semántica
+CAMPOS_TEXTO = ('titulo', 'autor', 'sinopsis')
+
+
+def textos_libro(libro):
+    """Título, autor y sinopsis cargados (sin consultar los campos diferidos)"""
+    return tuple(libro.__dict__.get(campo) for campo in CAMPOS_TEXTO)
+
+
 class Categoria(models.Model):
     nombre = models.CharField(max_length=100, unique=True)
     descripcion = models.TextField(blank=True)
@@ -11,6 +24,12 @@ class Categoria(models.Model):
     def __str__(self):
         return self.nombre
 
+class ActualizacionQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """Los UPDATE en bloque también marcan fecha_actualizacion (auto_now solo actúa en save)"""
+        kwargs.setdefault('fecha_actualizacion', timezone.now())
+        return super().update(**kwargs)
+
 class Libro(models.Model):
     titulo = models.CharField(max_length=200)
     autor = models.CharField(max_length=100)
@@ -23,22 +42,98 @@ class Libro(models.Model):
     idioma = models.CharField(max_length=50, default='Español')
     disponible = models.BooleanField(default=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
+    # Copia desnormalizada de la reserva activa; la mantiene Reserva.save
+    reserva_activa = models.ForeignKey(
+        'Reserva', on_delete=models.SET_NULL, null=True, blank=True, related_name='+', editable=False
+    )
+    # Reservas del libro (de cualquier estado); lo mantiene estadisticas.py para el top de populares
+    num_reservas = models.PositiveIntegerField(default=0, editable=False)
+    
+    objects = ActualizacionQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # Paginación por clave (fecha_creacion, id)
+            models.Index(fields=['fecha_creacion', 'id'], name='libro_creacion_id_idx'),
+            # Top de libros más reservados (ORDER BY num_reservas DESC, id DESC LIMIT n)
+            models.Index(fields=['num_reservas', 'id'], name='libro_num_reservas_idx'),
+        ]
     
     def __str__(self):
         return self.titulo
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        libro = super().from_db(db, field_names, values)
+        # Valor leído de la base de datos, para ajustar las estadísticas al guardar
+        libro._disponible_original = libro.__dict__.get('disponible')
+        libro._titulo_original = libro.__dict__.get('titulo')
+        libro._textos_original = textos_libro(libro)
+        return libro
+    
+    def save(self, *args, **kwargs):
+        # Las estadísticas se ajustan en post_save: dentro de la misma transacción
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
     def puede_reservarse(self):
         """Verifica si el libro está disponible para reserva"""
-        return self.disponible and not self.reservas.filter(estado='activa').exists()
+        return self.disponible and self.reserva_activa_id is None
 
 class Consulta(models.Model):
     texto = models.TextField()
     respuesta = models.TextField(blank=True)
     fecha = models.DateTimeField(auto_now_add=True)
+    # Versión del catálogo con la que se respondió (precarga de la caché de respuestas)
+    version_catalogo = models.BigIntegerField(null=True, blank=True, editable=False)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['fecha', 'id'], name='consulta_fecha_id_idx'),
+        ]
     
     def __str__(self):
         return self.texto[:50]
 
+def liberar_libros(filtro, esperados):
+    """
+    Marca disponibles los libros de `filtro` y les quita la reserva activa.
+    Devuelve cuántos pasaron de no disponibles a disponibles; solo si no son
+    `esperados` hace falta un segundo UPDATE para los que ya estaban disponibles.
+    """
+    liberados = Libro.objects.filter(filtro, disponible=False).update(disponible=True, reserva_activa=None)
+    if liberados < esperados:
+        Libro.objects.filter(filtro, reserva_activa__isnull=False).update(reserva_activa=None)
+    return liberados
+
+class ReservaQuerySet(ActualizacionQuerySet):
+    def bulk_cancelar(self):
+        """Cancela las reservas activas del queryset; devuelve cuántas se cancelaron"""
+        return self._bulk_cerrar('cancelada')
+    
+    def bulk_completar(self):
+        """Completa las reservas activas del queryset; devuelve cuántas se completaron"""
+        return self._bulk_cerrar('completada', fecha_devolucion=timezone.now())
+    
+    def _bulk_cerrar(self, estado, **campos):
+        """
+        Igual que Reserva._cerrar pero para todo el queryset: cuatro consultas en
+        una transacción (leer ids, cerrar reservas, liberar libros, ajustar
+        estadísticas), sin importar cuántas reservas haya.
+        """
+        with transaction.atomic():
+            ids = list(self.filter(estado='activa').order_by().values_list('id', flat=True))
+            if not ids:
+                return 0
+            cerradas = self.model.objects.filter(id__in=ids, estado='activa').update(estado=estado, **campos)
+            from .estadisticas import ajustar_reservas
+            
+            liberados = liberar_libros(Q(reserva_activa_id__in=ids), cerradas)
+            ajustar_reservas('activa', estado, cerradas, libros_disponibles=liberados)
+            invalidar_catalogo()
+        return cerradas
+
 class Reserva(models.Model):
     ESTADO_CHOICES = [
         ('activa', 'Activa'),
@@ -55,31 +150,146 @@ class Reserva(models.Model):
     fecha_devolucion = models.DateTimeField(null=True, blank=True)
     estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='activa')
     notas = models.TextField(blank=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
+    
+    objects = ReservaQuerySet.as_manager()
     
     class Meta:
         ordering = ['-fecha_reserva']
+        constraints = [
+            # Como mucho una reserva activa por libro (índice único parcial)
+            models.UniqueConstraint(fields=['libro'], condition=Q(estado='activa'), name='reserva_unica_activa_por_libro'),
+        ]
+        indexes = [
+            # Barrido de reservas vencidas (estado='activa' y fecha_vencimiento < ahora)
+            models.Index(fields=['estado', 'fecha_vencimiento'], name='reserva_estado_venc_idx'),
+            # Paginación por clave (fecha_reserva, id)
+            models.Index(fields=['fecha_reserva', 'id'], name='reserva_fecha_id_idx'),
+            # Rangos de días para las series (series.py)
+            models.Index(fields=['fecha_devolucion'], name='reserva_devolucion_idx'),
+            models.Index(fields=['fecha_vencimiento'], name='reserva_vencimiento_idx'),
+        ]
     
     def __str__(self):
         return f"{self.libro.titulo} - {self.usuario_nombre} ({self.estado})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        reserva = super().from_db(db, field_names, values)
+        reserva._estado_original = reserva.__dict__.get('estado')
+        return reserva
+    
+    def save(self, *args, **kwargs):
+        """Guarda la reserva y actualiza Libro.reserva_activa en la misma transacción"""
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.estado == 'activa':
+                Libro.objects.filter(pk=self.libro_id).update(reserva_activa=self)
+                reserva_activa_id = self.pk
+            else:
+                Libro.objects.filter(pk=self.libro_id, reserva_activa=self).update(reserva_activa=None)
+                reserva_activa_id = None
+        
+        # Mantener al día la instancia del libro si ya está cargada
+        libro = self._state.fields_cache.get('libro')
+        if libro is not None and (self.estado == 'activa' or libro.reserva_activa_id == self.pk):
+            libro.reserva_activa_id = reserva_activa_id
+    
     def cancelar(self):
         """Cancela la reserva y marca el libro como disponible"""
-        if self.estado == 'activa':
-            self.estado = 'cancelada'
-            self.libro.disponible = True
-            self.libro.save()
-            self.save()
-            return True
-        return False
+        return self._cerrar('cancelada')
     
     def completar(self):
         """Completa la reserva (libro devuelto)"""
-        if self.estado == 'activa':
-            from django.utils import timezone
-            self.estado = 'completada'
-            self.fecha_devolucion = timezone.now()
-            self.libro.disponible = True
-            self.libro.save()
-            self.save()
-            return True
-        return False
\ No newline at end of file
+        return self._cerrar('completada', fecha_devolucion=timezone.now())
+    
+    def _cerrar(self, estado, **campos):
+        """
+        Pasa la reserva de 'activa' a `estado` y libera el libro en una transacción.
+        
+        El UPDATE condicionado a estado='activa' hace de compare-and-set: si dos
+        peticiones cierran la misma reserva a la vez, solo una lo consigue.
+        """
+        with transaction.atomic():
+            cerradas = Reserva.objects.filter(pk=self.pk, estado='activa').update(estado=estado, **campos)
+            if not cerradas:
+                return False
+            from .estadisticas import ajustar_reservas
+            
+            liberados = liberar_libros(Q(pk=self.libro_id), 1)
+            ajustar_reservas('activa', estado, libros_disponibles=liberados)
+            invalidar_catalogo()
+        
+        self.estado = estado
+        for campo, valor in campos.items():
+            setattr(self, campo, valor)
+        libro = self._state.fields_cache.get('libro')
+        if libro is not None:
+            libro.disponible = True
+            libro.reserva_activa_id = None
+        return True
+
+class LibroSimilar(models.Model):
+    """Vecinos precalculados de cada libro (ver similares.py)"""
+    libro = models.ForeignKey(Libro, on_delete=models.CASCADE, related_name='similares')
+    similar = models.ForeignKey(Libro, on_delete=models.CASCADE, related_name='+')
+    posicion = models.PositiveSmallIntegerField()
+    puntuacion = models.FloatField()
+    fecha_calculo = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        ordering = ['libro', 'posicion']
+        constraints = [
+            models.UniqueConstraint(fields=['libro', 'posicion'], name='libro_similar_posicion_unica'),
+        ]
+    
+    def __str__(self):
+        return f"{self.libro_id} -> {self.similar_id} ({self.puntuacion:.3f})"
+
+class Estadistica(models.Model):
+    """Contadores del catálogo mantenidos de forma incremental (ver estadisticas.py)"""
+    nombre = models.CharField(max_length=50, primary_key=True)
+    valor = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.nombre} = {self.valor}"
+
+class VersionCompartida(models.Model):
+    """
+    Versiones de las cachés (catálogo, títulos) cuando la caché de Django es
+    local del proceso: aquí las ven todos los workers (ver cache_catalogo.py).
+    """
+    nombre = models.CharField(max_length=50, primary_key=True)
+    valor = models.BigIntegerField()
+    # Segundos desde la época del último cambio (Last-Modified)
+    modificado = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.nombre} v{self.valor}"
+
+class ReservaDiaria(models.Model):
+    """
+    Agregado de reservas por día (zona horaria local) y categoría (ver series.py).
+    Los días cerrados no se vuelven a calcular; el de hoy se rehace en cada pasada.
+    """
+    dia = models.DateField()
+    categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    # Reservas creadas ese día
+    reservas = models.PositiveIntegerField(default=0)
+    # Reservas completadas ese día y suma de sus duraciones (fecha_devolucion - fecha_reserva)
+    devoluciones = models.PositiveIntegerField(default=0)
+    segundos_prestamo = models.BigIntegerField(default=0)
+    # Reservas que vencían ese día y cuántas de ellas se devolvieron tarde o siguen sin devolver
+    vencimientos = models.PositiveIntegerField(default=0)
+    atrasadas = models.PositiveIntegerField(default=0)
+    cerrado = models.BooleanField(default=False)
+    fecha_calculo = models.DateTimeField()
+    
+    class Meta:
+        ordering = ['dia', 'categoria']
+        constraints = [
+            models.UniqueConstraint(fields=['dia', 'categoria'], name='reserva_diaria_dia_categoria_unica'),
+        ]
+    
+    def __str__(self):
+        return f"{self.dia} {self.categoria_id}: {self.reservas}"
@@ -0,0 +1,157 @@
+"""
+Paginación de los listados de la API.
+
+Por defecto se mantiene la paginación por número de página. Con
+?paginacion=keyset (o al seguir un ?cursor=...) se usa paginación por clave:
+cada página filtra por la última fila vista según el orden de la vista, así
+que la página 10.000 cuesta lo mismo que la primera y no hay COUNT(*).
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Con ?contar=aprox se cuentan como mucho estas filas
+LIMITE_CONTEO = 10000
+
+
+def max_tamano_pagina():
+    return getattr(settings, 'PAGINACION_MAX_TAMANO', 100)
+
+
+def codificar_cursor(valores):
+    datos = json.dumps([v.isoformat() if hasattr(v, 'isoformat') else v for v in valores])
+    return base64.urlsafe_b64encode(datos.encode()).decode()
+
+
+def decodificar_cursor(cursor):
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise NotFound("Cursor inválido")
+    if not isinstance(valores, list):
+        raise NotFound("Cursor inválido")
+    return valores
+
+
+def filtro_despues_de(campos, valores):
+    """
+    Condición "fila posterior a `valores`" para un orden por `campos`:
+    a >= x AND ((a > x) OR (a = x AND b > y) OR ...)
+
+    La cota sobre el primer campo es redundante, pero permite al motor recorrer
+    el índice compuesto desde ese punto en lugar de evaluar el OR fila a fila.
+    """
+    def operador(campo, estricto=True):
+        if campo.startswith('-'):
+            return 'lt' if estricto else 'lte'
+        return 'gt' if estricto else 'gte'
+
+    condicion = Q()
+    for i, campo in enumerate(campos):
+        parte = Q(**{f'{campo.lstrip("-")}__{operador(campo)}': valores[i]})
+        for previo, valor in zip(campos[:i], valores):
+            parte &= Q(**{previo.lstrip('-'): valor})
+        condicion |= parte
+    primero = campos[0]
+    return Q(**{f'{primero.lstrip("-")}__{operador(primero, estricto=False)}': valores[0]}) & condicion
+
+
+def conteo_aproximado(queryset):
+    """Devuelve (total, exacto): cuenta como mucho LIMITE_CONTEO filas"""
+    total = queryset.order_by()[:LIMITE_CONTEO + 1].count()
+    if total > LIMITE_CONTEO:
+        return LIMITE_CONTEO, False
+    return total, True
+
+
+class PaginacionKeyset(BasePagination):
+    """
+    Paginación por clave según `orden_keyset` de la vista (p. ej. ('fecha_creacion', 'id')).
+
+    El último campo debe ser único para que el orden sea total. Solo se ofrece
+    enlace a la página siguiente, que es lo que necesita un scroll infinito.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.campos = list(view.orden_keyset)
+        self.tamano = self.obtener_tamano(request)
+        self.conteo = None
+        if request.query_params.get('contar') == 'aprox':
+            self.conteo = conteo_aproximado(queryset)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            valores = decodificar_cursor(cursor)
+            if len(valores) != len(self.campos):
+                raise NotFound("Cursor inválido")
+            try:
+                queryset = queryset.filter(filtro_despues_de(self.campos, valores))
+            except (ValidationError, ValueError, TypeError):
+                # El cursor decodificó bien pero sus valores no encajan con los campos
+                raise NotFound("Cursor inválido")
+
+        filas = list(queryset.order_by(*self.campos)[:self.tamano + 1])
+        self.hay_siguiente = len(filas) > self.tamano
+        filas = filas[:self.tamano]
+        self.ultimo = filas[-1] if filas else None
+        return filas
+
+    def obtener_tamano(self, request):
+        try:
+            tamano = int(request.query_params.get(self.page_size_query_param, settings.REST_FRAMEWORK['PAGE_SIZE']))
+        except ValueError:
+            tamano = settings.REST_FRAMEWORK['PAGE_SIZE']
+        return max(1, min(tamano, max_tamano_pagina()))
+
+    def get_next_link(self):
+        if not self.hay_siguiente:
+            return None
+        # Las filas pueden ser instancias o dicts de .values()
+        valores = [
+            self.ultimo[campo.lstrip('-')] if isinstance(self.ultimo, dict) else getattr(self.ultimo, campo.lstrip('-'))
+            for campo in self.campos
+        ]
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, 'paginacion', 'keyset')
+        return replace_query_param(url, self.cursor_query_param, codificar_cursor(valores))
+
+    def get_paginated_response(self, data):
+        respuesta = {'next': self.get_next_link(), 'results': data}
+        if self.conteo is not None:
+            respuesta['count'], respuesta['count_exacto'] = self.conteo
+        return Response(respuesta)
+
+
+class PaginacionBiblioteca(PageNumberPagination):
+    """Paginación por número de página, o por clave si se pide y la vista lo admite"""
+    page_size_query_param = 'page_size'
+
+    @property
+    def max_page_size(self):
+        return max_tamano_pagina()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self._keyset = None
+        pide_keyset = (
+            request.query_params.get('paginacion') == 'keyset'
+            or PaginacionKeyset.cursor_query_param in request.query_params
+        )
+        if pide_keyset and getattr(view, 'orden_keyset', None):
+            self._keyset = PaginacionKeyset()
+            return self._keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self._keyset is not None:
+            return self._keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
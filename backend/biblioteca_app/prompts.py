@@ -0,0 +1,178 @@
+"""
+Construcción del prompt del asistente con recuperación y presupuesto de tokens.
+
+En lugar de enviar siempre los mismos 20 libros, se recuperan del índice de
+texto completo (y opcionalmente del vectorial) los libros más relevantes para
+la consulta y se añaden, de más a menos relevante, hasta agotar el presupuesto
+de tokens. Las instrucciones van primero y no cambian entre llamadas, así el
+proveedor puede reutilizar el prefijo cacheado.
+"""
+import math
+
+from django.conf import settings
+from django.db.models import F
+
+from .busqueda import obtener_indice, tokenizar
+from .cache_catalogo import contadores, obtener_contexto
+from .vectores import PALABRAS_VACIAS, IndiceNoConstruido, obtener_indice_vectorial
+
+# Aproximación para español en los tokenizadores habituales (~4 caracteres por token)
+CARACTERES_POR_TOKEN = 4
+
+# Caracteres de sinopsis por libro en el contexto
+LARGO_SINOPSIS = 160
+
+# Constante de la fusión por rango recíproco al combinar texto completo y vectores
+RRF_K = 60
+
+# Palabras de la forma de preguntar que no dicen nada sobre el libro buscado
+PALABRAS_CONSULTA = PALABRAS_VACIAS | {
+    'libro', 'libros', 'buscar', 'busco', 'busca', 'quiero', 'recomienda', 'recomiendame',
+    'recomendacion', 'recomendaciones', 'hay', 'tienen', 'tiene', 'algun', 'alguno', 'alguna',
+    'me', 'mi', 'yo', 'tu', 'cual', 'cuales', 'donde', 'sobre', 'acerca', 'gustaria', 'leer',
+}
+
+INSTRUCCIONES = """Eres el asistente de una biblioteca digital. Tu objetivo es ayudar a los usuarios a encontrar libros y recursos, así como gestionar consultas sobre reservas.
+
+Puedes responder sobre:
+- Búsqueda de libros por título, autor, categoría o tema
+- Estado de disponibilidad de libros
+- Información sobre reservas (cuántos libros están reservados, cuáles están disponibles)
+- Recomendaciones de libros
+- Preguntas generales sobre el funcionamiento de la biblioteca
+
+Si la consulta parece ser una búsqueda de libros, responde con formato JSON que contenga:
+1. Una lista de libros recomendados basados en la consulta
+2. Una explicación amigable de tu respuesta
+3. Sugerencias relacionadas
+
+Formato del JSON para búsqueda:
+{"tipo": "busqueda", "recomendaciones": ["título1", "título2"], "explicacion": "texto explicativo", "sugerencias": ["sugerencia1", "sugerencia2"]}
+
+Si la consulta es sobre reservas o disponibilidad, responde con este formato:
+{"tipo": "reservas", "respuesta": "información sobre reservas", "libros_disponibles": ["título1", "título2"], "libros_no_disponibles": ["título3", "título4"]}
+
+IMPORTANTE para consultas de reservas:
+- Si el usuario pregunta por libros DISPONIBLES, incluye solo la lista "libros_disponibles"
+- Si el usuario pregunta por libros NO DISPONIBLES, RESERVADOS o PRESTADOS, incluye solo la lista "libros_no_disponibles"
+- Si el usuario pregunta por TODOS los libros o no especifica, incluye ambas listas
+- Incluye el título exacto de los libros tal como aparecen en la información proporcionada
+
+Si la consulta es una pregunta general sobre la biblioteca o cómo usarla, responde con formato JSON:
+{"tipo": "informacion", "respuesta": "tu respuesta detallada aquí"}
+
+Responde basándote únicamente en la información de la biblioteca que aparece a continuación a menos que la consulta explícitamente pida otra cosa. Los libros listados son los del catálogo más relacionados con la consulta, de más a menos relevante.
+
+IMPORTANTE: Responde únicamente con el JSON, sin formato markdown, sin backticks, y sin texto adicional.
+"""
+
+
+def estimar_tokens(texto):
+    return math.ceil(len(texto) / CARACTERES_POR_TOKEN)
+
+
+def presupuesto_tokens():
+    return getattr(settings, 'BIBLIOTECA_PROMPT_MAX_TOKENS', 3000)
+
+
+def _fusionar(*rankings):
+    """Fusión por rango recíproco de varias listas de ids ordenadas por relevancia"""
+    puntuaciones = {}
+    for ranking in rankings:
+        for posicion, libro_id in enumerate(ranking):
+            puntuaciones[libro_id] = puntuaciones.get(libro_id, 0) + 1 / (RRF_K + posicion)
+    return sorted(puntuaciones, key=puntuaciones.get, reverse=True)
+
+
+def recuperar_libros(consulta, limite):
+    """Ids de los libros más relevantes para la consulta, del más al menos relevante"""
+    terminos = [t for t in tokenizar(consulta) if t not in PALABRAS_CONSULTA and len(t) > 1]
+    if not terminos:
+        return []
+    texto = ' '.join(terminos)
+
+    rankings = []
+    indice = obtener_indice()
+    if indice is not None:
+        # Basta con que coincida algún término; bm25/ts_rank premian a los que coinciden en más
+        rankings.append(indice.buscar(texto, limite, cualquiera=True))
+    if getattr(settings, 'BIBLIOTECA_PROMPT_RECUPERACION', 'texto') == 'hibrida':
+        try:
+            rankings.append([libro_id for libro_id, _ in obtener_indice_vectorial().buscar(texto, limite)])
+        except IndiceNoConstruido:
+            # Hasta que se construya el índice semántico se recupera solo por texto
+            pass
+    return _fusionar(*rankings)[:limite]
+
+
+def _filas_libros(ids, limite):
+    """Datos de los libros recuperados; si no llegan a `limite` se completa con los más recientes"""
+    from .models import Libro
+
+    campos = ('id', 'titulo', 'autor', 'sinopsis', 'disponible', 'reserva_activa_id')
+    consulta = Libro.objects.values(*campos, nombre_categoria=F('categoria__nombre'))
+    por_id = {fila['id']: fila for fila in consulta.filter(id__in=ids)} if ids else {}
+    filas = [por_id[i] for i in ids if i in por_id]
+    if len(filas) < limite:
+        filas += consulta.exclude(id__in=ids).order_by('-fecha_creacion', '-id')[:limite - len(filas)]
+    return filas
+
+
+def _linea_libro(fila):
+    if fila['disponible']:
+        estado = 'disponible'
+    else:
+        estado = 'reservado' if fila['reserva_activa_id'] else 'no disponible'
+    linea = f"- {fila['titulo']} | {fila['autor']} | {fila['nombre_categoria'] or 'Sin categoría'} | {estado}"
+    sinopsis = ' '.join((fila['sinopsis'] or '').split())
+    if sinopsis:
+        linea += f" | {sinopsis[:LARGO_SINOPSIS]}{'…' if len(sinopsis) > LARGO_SINOPSIS else ''}"
+    return linea
+
+
+def construir_prompt(consulta, presupuesto=None):
+    """
+    Devuelve (prompt, métricas). El prompt es INSTRUCCIONES, el resumen de la
+    biblioteca, los libros recuperados que quepan en el presupuesto y la consulta.
+    """
+    presupuesto = presupuesto or presupuesto_tokens()
+    contexto = obtener_contexto()
+    libros_reservados = contexto['libros_reservados']
+    cabecera = (
+        f"\nInformación de la biblioteca:\n"
+        f"Categorías disponibles: {contexto['contexto_categorias']}\n"
+        f"Total de reservas activas: {contexto['total_reservas']}\n"
+        f"Libros más reservados recientemente: {', '.join(libros_reservados) if libros_reservados else 'Ninguno'}\n"
+        f"\nLibros del catálogo (título | autor | categoría | estado | sinopsis):\n"
+    )
+    pie = f'\nLa consulta del usuario es: "{consulta}"\n'
+
+    tokens = estimar_tokens(INSTRUCCIONES) + estimar_tokens(cabecera) + estimar_tokens(pie)
+    max_libros = getattr(settings, 'BIBLIOTECA_PROMPT_MAX_LIBROS', 60)
+    ids = recuperar_libros(consulta, max_libros)
+    filas = _filas_libros(ids, max_libros)
+
+    lineas = []
+    for fila in filas:
+        linea = _linea_libro(fila)
+        coste = estimar_tokens(linea) + 1
+        if tokens + coste > presupuesto:
+            break
+        lineas.append(linea)
+        tokens += coste
+
+    metricas = {
+        'tokens': tokens,
+        'tokens_instrucciones': estimar_tokens(INSTRUCCIONES),
+        'presupuesto': presupuesto,
+        'libros_recuperados': len(ids),
+        'libros_incluidos': len(lineas),
+        'libros_recortados': len(filas) - len(lineas),
+    }
+    contadores.incrementar('prompts')
+    contadores.incrementar('prompt_tokens', tokens)
+    contadores.incrementar('prompt_libros', len(lineas))
+    contadores.incrementar('prompt_libros_recortados', metricas['libros_recortados'])
+
+    prompt = INSTRUCCIONES + cabecera + ('\n'.join(lineas) or 'Ninguno') + '\n' + pie
+    return prompt, metricas
@@ -0,0 +1,120 @@
+"""
+Operaciones sobre el estado de las reservas.
+"""
+import time
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .cache_catalogo import contadores, invalidar_catalogo
+from .estadisticas import ajustar_reservas
+from .models import Libro, Reserva, liberar_libros
+
+
+def _reserva_activa_esperada():
+    return Reserva.objects.filter(
+        libro=OuterRef('pk'), estado='activa'
+    ).order_by('-fecha_reserva', '-id').values('id')[:1]
+
+
+def libros_con_desajuste():
+    """Libros cuyo Libro.reserva_activa no coincide con la tabla de reservas"""
+    return Libro.objects.annotate(esperada=Subquery(_reserva_activa_esperada())).filter(
+        Q(reserva_activa__isnull=True, esperada__isnull=False) |
+        Q(reserva_activa__isnull=False, esperada__isnull=True) |
+        (Q(reserva_activa__isnull=False, esperada__isnull=False) & ~Q(reserva_activa=F('esperada')))
+    )
+
+
+def reconciliar_reservas_activas(reparar=False):
+    """
+    Detecta (y opcionalmente corrige) la deriva entre Libro.reserva_activa y
+    las reservas activas. Devuelve la lista de ids de libros afectados.
+    """
+    with transaction.atomic():
+        ids = list(libros_con_desajuste().values_list('id', flat=True))
+        if reparar and ids:
+            Libro.objects.filter(id__in=ids).update(reserva_activa=Subquery(_reserva_activa_esperada()))
+    return ids
+
+
+class ReservaNoDisponible(Exception):
+    """El libro ya está reservado o no está disponible"""
+
+
+def reservar_libro(libro_id, usuario_nombre, usuario_email, fecha_vencimiento, notas=''):
+    """
+    Reserva un libro de forma atómica y segura ante peticiones concurrentes.
+
+    El UPDATE condicionado a disponible=True hace de compare-and-set: bloquea la
+    fila del libro y solo una transacción puede pasarlo a no disponible. La
+    restricción única sobre reservas activas protege además a nivel de base de datos.
+    Las filas de Estadistica se bloquean al final, en un único UPDATE.
+    """
+    with transaction.atomic():
+        marcados = Libro.objects.filter(
+            pk=libro_id, disponible=True, reserva_activa__isnull=True
+        ).update(disponible=False)
+        if not marcados:
+            raise ReservaNoDisponible("El libro no está disponible para reserva")
+
+        reserva = Reserva(
+            libro_id=libro_id,
+            usuario_nombre=usuario_nombre,
+            usuario_email=usuario_email,
+            fecha_vencimiento=fecha_vencimiento,
+            notas=notas
+        )
+        # Las estadísticas se ajustan abajo en un único UPDATE, no desde la señal
+        reserva._estadisticas_diferidas = True
+        try:
+            with transaction.atomic():
+                reserva.save()
+        except IntegrityError:
+            # Otra reserva activa se creó por una vía que no pasó por disponible
+            raise ReservaNoDisponible("El libro no está disponible para reserva")
+        finally:
+            del reserva._estadisticas_diferidas
+
+        # Los contadores se bloquean los últimos, como en los cierres y expiraciones
+        ajustar_reservas(None, 'activa', libros_disponibles=-1)
+        return reserva
+
+
+def expirar_reservas_vencidas(ahora=None, tamano_lote=1000):
+    """
+    Marca como vencidas las reservas activas cuya fecha de vencimiento ya pasó
+    y libera sus libros.
+
+    Trabaja por lotes de `tamano_lote` ids: cada lote son tres UPDATE (reservas,
+    libros y estadísticas) en una transacción corta. Devuelve un dict con el
+    total procesado, el número de lotes, la duración y las filas por segundo.
+    """
+    ahora = ahora or timezone.now()
+    inicio = time.perf_counter()
+    total = lotes = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                Reserva.objects.filter(estado='activa', fecha_vencimiento__lt=ahora)
+                .order_by('fecha_vencimiento').values_list('id', flat=True)[:tamano_lote]
+            )
+            if not ids:
+                break
+            vencidas = Reserva.objects.filter(id__in=ids, estado='activa').update(estado='vencida')
+            liberados = liberar_libros(Q(reserva_activa_id__in=ids), vencidas)
+            ajustar_reservas('activa', 'vencida', vencidas, libros_disponibles=liberados)
+        total += vencidas
+        lotes += 1
+
+    if total:
+        invalidar_catalogo()
+        contadores.incrementar('reservas_vencidas', total)
+    duracion = time.perf_counter() - inicio
+    return {
+        'reservas_vencidas': total,
+        'lotes': lotes,
+        'duracion': round(duracion, 4),
+        'filas_por_segundo': round(total / duracion) if duracion else 0,
+    }
@@ -0,0 +1,198 @@
+"""
+Interpretación tolerante de las respuestas JSON del modelo.
+
+Se pide al modelo JSON con esquema (CONFIGURACION_JSON), pero la respuesta
+puede venir igualmente envuelta en ```json, con texto alrededor o cortada. En
+lugar de descartar la llamada, se intenta por orden: JSON directo, quitar los
+bloques de código, el primer objeto con llaves equilibradas y, si el texto
+termina a medias, cerrar cadenas y llaves pendientes. El resultado se valida
+contra la forma de cada tipo de respuesta.
+"""
+import ast
+import json
+import re
+
+from .cache_catalogo import contadores
+
+# Respuesta cuando el modelo devuelve algo que no se puede interpretar (no se cachea)
+RESPUESTA_NO_INTERPRETADA = {
+    "tipo": "informacion",
+    "respuesta": "No pude procesar tu consulta. Por favor, intenta reformularla."
+}
+
+# Esquema para el modo JSON de Gemini (subconjunto de OpenAPI); los campos dependen del tipo
+ESQUEMA_RESPUESTA = {
+    'type': 'object',
+    'properties': {
+        'tipo': {'type': 'string', 'enum': ['busqueda', 'reservas', 'informacion']},
+        'recomendaciones': {'type': 'array', 'items': {'type': 'string'}},
+        'explicacion': {'type': 'string'},
+        'sugerencias': {'type': 'array', 'items': {'type': 'string'}},
+        'respuesta': {'type': 'string'},
+        'libros_disponibles': {'type': 'array', 'items': {'type': 'string'}},
+        'libros_no_disponibles': {'type': 'array', 'items': {'type': 'string'}},
+    },
+    'required': ['tipo'],
+}
+
+CONFIGURACION_JSON = {
+    'response_mime_type': 'application/json',
+    'response_schema': ESQUEMA_RESPUESTA,
+}
+
+# Campos de cada tipo: (textos, listas de textos, campos obligatorios)
+FORMAS = {
+    'busqueda': (('explicacion',), ('recomendaciones', 'sugerencias'), ('recomendaciones',)),
+    'reservas': (('respuesta',), ('libros_disponibles', 'libros_no_disponibles'), ()),
+    'informacion': (('respuesta',), (), ('respuesta',)),
+}
+
+_BLOQUE_CODIGO = re.compile(r'```[a-zA-Z]*\s*(.*?)\s*(?:```|$)', re.DOTALL)
+_COMA_FINAL = re.compile(r',\s*([}\]])')
+
+# Recortes como mucho al reparar una respuesta cortada
+MAX_RECORTES = 20
+
+
+def _escanear(texto, inicio):
+    """
+    Recorre desde la llave de `inicio` respetando las cadenas. Devuelve
+    (fin, cierres_pendientes, en_cadena): `fin` es la posición tras la llave
+    que cierra el objeto, o None si el texto se corta antes.
+    """
+    pila = []
+    en_cadena = escape = False
+    for i in range(inicio, len(texto)):
+        c = texto[i]
+        if en_cadena:
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                en_cadena = False
+        elif c == '"':
+            en_cadena = True
+        elif c in '{[':
+            pila.append('}' if c == '{' else ']')
+        elif c in '}]':
+            if not pila or pila[-1] != c:
+                return None, [], False
+            pila.pop()
+            if not pila:
+                return i + 1, [], False
+    return None, pila, en_cadena
+
+
+def _cargar(texto):
+    """json.loads tolerando comas finales y literales de Python con comillas simples"""
+    for intento in (texto, _COMA_FINAL.sub(r'\1', texto)):
+        try:
+            return json.loads(intento)
+        except json.JSONDecodeError:
+            pass
+    try:
+        valor = ast.literal_eval(texto)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+    return valor if isinstance(valor, dict) else None
+
+
+def _reparar(texto):
+    """Cierra una respuesta cortada: termina la cadena abierta y las llaves pendientes, recortando lo incompleto"""
+    for _ in range(MAX_RECORTES):
+        _, pila, en_cadena = _escanear(texto, 0)
+        candidato = texto + ('"' if en_cadena else '') + ''.join(reversed(pila))
+        valor = _cargar(candidato)
+        if isinstance(valor, dict):
+            return valor
+        # Quitar el último elemento incompleto ("clave": sin valor, número a medias, ...)
+        corte = max(texto.rfind(','), texto.rfind('['), texto.rfind('{'))
+        if corte <= 0:
+            return None
+        texto = texto[:corte + 1] if texto[corte] in '[{' else texto[:corte]
+    return None
+
+
+def extraer_json(texto):
+    """
+    Devuelve (dict, calidad) con calidad 'directo', 'extraido' o 'reparado',
+    o (None, None) si no hay ningún objeto JSON utilizable.
+    """
+    texto = (texto or '').strip()
+    try:
+        valor = json.loads(texto)
+        if isinstance(valor, dict):
+            return valor, 'directo'
+    except json.JSONDecodeError:
+        pass
+
+    bloque = _BLOQUE_CODIGO.search(texto)
+    if bloque:
+        texto = bloque.group(1)
+
+    inicio = texto.find('{')
+    while inicio != -1:
+        fin, _, _ = _escanear(texto, inicio)
+        if fin is None:
+            break
+        valor = _cargar(texto[inicio:fin])
+        if isinstance(valor, dict):
+            return valor, 'extraido'
+        inicio = texto.find('{', inicio + 1)
+
+    if inicio != -1:
+        valor = _reparar(texto[inicio:])
+        if valor is not None:
+            return valor, 'reparado'
+    return None, None
+
+
+def _como_texto(valor):
+    return valor if isinstance(valor, str) else ''
+
+
+def _como_lista(valor):
+    if isinstance(valor, str):
+        return [valor] if valor.strip() else []
+    if isinstance(valor, (list, tuple)):
+        return [v for v in valor if isinstance(v, str) and v.strip()]
+    return []
+
+
+def validar_respuesta(datos):
+    """Normaliza la respuesta a la forma de su tipo; None si no encaja con ninguno"""
+    tipo = datos.get('tipo')
+    if tipo not in FORMAS:
+        # Sin tipo reconocible, pero con una respuesta en texto: se trata como información
+        if isinstance(datos.get('respuesta'), str) and datos['respuesta'].strip():
+            tipo = 'informacion'
+        elif 'recomendaciones' in datos:
+            tipo = 'busqueda'
+        else:
+            return None
+    textos, listas, obligatorios = FORMAS[tipo]
+    resultado = {'tipo': tipo}
+    for campo in textos:
+        resultado[campo] = _como_texto(datos.get(campo))
+    for campo in listas:
+        resultado[campo] = _como_lista(datos.get(campo))
+    for campo in obligatorios:
+        if campo not in datos:
+            return None
+    return resultado
+
+
+def interpretar_respuesta(texto):
+    """
+    Devuelve (resultado, cacheable). resultado es None si no se pudo
+    interpretar; una respuesta reparada no se cachea porque puede estar incompleta.
+    """
+    contadores.incrementar('respuestas_modelo')
+    datos, calidad = extraer_json(texto)
+    resultado = validar_respuesta(datos) if datos is not None else None
+    if resultado is None:
+        contadores.incrementar('respuestas_invalidas')
+        return None, False
+    contadores.incrementar(f'respuestas_{calidad}')
+    return resultado, calidad != 'reparado'
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from django.db.models import F
 from .models import Libro, Categoria, Consulta, Reserva
 from django.contrib.auth.models import User
 
@@ -17,10 +18,30 @@ class LibroSerializer(serializers.ModelSerializer):
     def get_nombre_categoria(self, obj):
         return obj.categoria.nombre if obj.categoria else None
 
+class LibroListaSerializer(serializers.BaseSerializer):
+    """
+    Serializer de solo lectura para el listado de libros.
+
+    Recibe las filas de LibroListaSerializer.queryset() (dicts de .values() con
+    el nombre de la categoría ya anotado) y las devuelve tal cual, con las
+    mismas claves que LibroSerializer pero sin instanciar modelos ni campos.
+    """
+    CAMPOS = [f.attname for f in Libro._meta.concrete_fields]
+    
+    @classmethod
+    def queryset(cls, queryset):
+        return queryset.values(*cls.CAMPOS, nombre_categoria=F('categoria__nombre'))
+    
+    def to_representation(self, fila):
+        # Las claves de las FK sin el sufijo _id, como en LibroSerializer
+        fila['categoria'] = fila.pop('categoria_id')
+        fila['reserva_activa'] = fila.pop('reserva_activa_id')
+        return fila
+
 class ConsultaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Consulta
-        fields = '__all__'
+        exclude = ('version_catalogo',)
         read_only_fields = ('respuesta', 'fecha')
 
 class ReservaSerializer(serializers.ModelSerializer):
@@ -46,6 +67,15 @@ class ReservaSerializer(serializers.ModelSerializer):
         if not libro.puede_reservarse():
             raise serializers.ValidationError("El libro no está disponible para reserva")
         return data
+    
+    def create(self, validated_data):
+        """Crea la reserva de forma atómica para evitar dobles reservas concurrentes"""
+        from .reservas import ReservaNoDisponible, reservar_libro
+        libro = validated_data.pop('libro')
+        try:
+            return reservar_libro(libro.id, **validated_data)
+        except ReservaNoDisponible as e:
+            raise serializers.ValidationError(str(e))
 
 class LibroDetalleSerializer(serializers.ModelSerializer):
     """Serializer extendido con información de reservas"""
@@ -59,9 +89,16 @@ class LibroDetalleSerializer(serializers.ModelSerializer):
         return obj.categoria.nombre if obj.categoria else None
     
     def get_reserva_activa(self, obj):
-        reserva = obj.reservas.filter(estado='activa').first()
+        reserva = obj.reserva_activa
         if reserva:
+            reserva.libro = obj
             return ReservaSerializer(reserva).data
         return None
 
 
+def serializar_libros_encontrados(libros, request=None):
+    """Serializa los libros recomendados añadiendo la puntuación de coincidencia del título"""
+    datos = LibroSerializer(libros, many=True, context={'request': request}).data
+    for libro_serializado, libro in zip(datos, libros):
+        libro_serializado['puntuacion'] = getattr(libro, 'puntuacion', None)
+    return datos
@@ -0,0 +1,218 @@
+"""
+Series temporales de reservas: agregados diarios por categoría.
+
+ReservaDiaria guarda, por día local y categoría, las reservas creadas, las
+devoluciones con la suma de sus duraciones y los vencimientos con cuántos se
+atrasaron. actualizar_series() cierra los días pendientes desde la última
+pasada (un día cerrado ya no cambia: las reservas se crean y se devuelven con
+la fecha de ese momento) y rehace solo el día en curso. Todo día cerrado tiene
+al menos una fila, así el último cerrado marca dónde sigue la próxima pasada.
+La primera pasada recorre todo el historial por tramos de días, agregando con
+numpy.
+
+Las consultas de series (por día o semana) solo leen ReservaDiaria.
+"""
+from datetime import date, datetime, time as hora, timedelta
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .cache_catalogo import contadores
+from .models import Categoria, Reserva, ReservaDiaria
+
+# Días agregados por tramo en la reconstrucción del historial
+DIAS_POR_TRAMO = 90
+
+# Días máximos de una consulta de series
+MAX_DIAS_CONSULTA = 3 * 366
+
+INTERVALOS = ('dia', 'semana')
+
+_EPOCA = date(1970, 1, 1).toordinal()
+
+
+def _inicio_dia(dia):
+    return timezone.make_aware(datetime.combine(dia, hora.min))
+
+
+def _segundos(fechas):
+    """Segundos desde la época de una lista de datetimes (NaN para None)"""
+    return np.array([np.nan if f is None else f.timestamp() for f in fechas], dtype=np.float64)
+
+
+def _dias_locales(segundos):
+    """
+    Ordinal del día local de cada instante. El desfase de la zona horaria se
+    resuelve una vez por hora UTC distinta, no por fila.
+    """
+    horas = np.floor(segundos / 3600)
+    unicas, inversa = np.unique(horas, return_inverse=True)
+    zona = timezone.get_current_timezone()
+    desfases = np.array([
+        datetime.fromtimestamp(h * 3600, zona).utcoffset().total_seconds() for h in unicas
+    ], dtype=np.float64)
+    return (np.floor((segundos + desfases[inversa]) / 86400) + _EPOCA).astype(np.int64)
+
+
+class _Agregado:
+    """Acumula por (día, categoría) dentro de un tramo de días"""
+
+    CAMPOS = ('reservas', 'devoluciones', 'segundos_prestamo', 'vencimientos', 'atrasadas')
+
+    def __init__(self, desde, dias, categorias):
+        self.desde = desde.toordinal()
+        self.dias = dias
+        # Posición 0 para los libros sin categoría
+        self.categorias = np.array([-1] + sorted(set(categorias) - {None}), dtype=np.int64)
+        self.totales = {campo: np.zeros(dias * len(self.categorias), dtype=np.float64) for campo in self.CAMPOS}
+
+    def sumar(self, campo, dias, categorias, pesos=None):
+        if not len(dias):
+            return
+        categorias = np.array([-1 if c is None else c for c in categorias], dtype=np.int64)
+        posiciones = np.searchsorted(self.categorias, categorias)
+        fuera = (posiciones >= len(self.categorias)) | (
+            self.categorias[np.minimum(posiciones, len(self.categorias) - 1)] != categorias
+        )
+        if fuera.any():
+            raise ValueError(f"Categorías fuera del agregado: {sorted(set(categorias[fuera].tolist()))}")
+        claves = (dias - self.desde) * len(self.categorias) + posiciones
+        self.totales[campo] += np.bincount(claves, weights=pesos, minlength=len(self.totales[campo]))
+
+    def filas(self, cerrado, fecha_calculo):
+        ocupadas = sum(self.totales.values()) != 0
+        if cerrado:
+            # Cada día cerrado deja al menos una fila (a cero, sin categoría) para marcar hasta dónde se cerró
+            ocupadas.reshape(self.dias, len(self.categorias))[:, 0] |= ~ocupadas.reshape(self.dias, -1).any(axis=1)
+        for clave in np.flatnonzero(ocupadas):
+            dia, categoria = divmod(int(clave), len(self.categorias))
+            yield ReservaDiaria(
+                dia=date.fromordinal(self.desde + dia),
+                categoria_id=None if categoria == 0 else int(self.categorias[categoria]),
+                cerrado=cerrado, fecha_calculo=fecha_calculo,
+                **{campo: int(round(self.totales[campo][clave])) for campo in self.CAMPOS},
+            )
+
+
+def agregar_dias(desde, hasta, ahora=None, cerrado=True):
+    """Filas de ReservaDiaria (sin guardar) para los días [desde, hasta)"""
+    ahora = ahora or timezone.now()
+    inicio, fin = _inicio_dia(desde), _inicio_dia(hasta)
+
+    creadas = list(Reserva.objects.filter(
+        fecha_reserva__gte=inicio, fecha_reserva__lt=fin
+    ).order_by().values_list('libro__categoria_id', 'fecha_reserva'))
+    devueltas = list(Reserva.objects.filter(
+        estado='completada', fecha_devolucion__gte=inicio, fecha_devolucion__lt=fin
+    ).order_by().values_list('libro__categoria_id', 'fecha_devolucion', 'fecha_reserva'))
+    vencen = list(Reserva.objects.filter(
+        fecha_vencimiento__gte=inicio, fecha_vencimiento__lt=min(fin, ahora)
+    ).order_by().values_list('libro__categoria_id', 'fecha_vencimiento', 'estado', 'fecha_devolucion'))
+
+    # Las categorías salen de las propias filas: una creada entre consultas también tiene su posición
+    agregado = _Agregado(desde, (hasta - desde).days, [fila[0] for fila in creadas + devueltas + vencen])
+
+    if creadas:
+        categorias, fechas = zip(*creadas)
+        agregado.sumar('reservas', _dias_locales(_segundos(fechas)), categorias)
+
+    if devueltas:
+        categorias, devoluciones, reservas = zip(*devueltas)
+        devoluciones = _segundos(devoluciones)
+        dias = _dias_locales(devoluciones)
+        agregado.sumar('devoluciones', dias, categorias)
+        agregado.sumar('segundos_prestamo', dias, categorias, np.maximum(devoluciones - _segundos(reservas), 0))
+
+    if vencen:
+        categorias, vencimientos, estados, devoluciones = zip(*vencen)
+        vencimientos = _segundos(vencimientos)
+        estados = np.array(estados)
+        devoluciones = _segundos(devoluciones)
+        # Vencida, todavía activa pasado el plazo o devuelta después del plazo
+        atrasadas = (
+            (estados == 'vencida') | (estados == 'activa') |
+            ((estados == 'completada') & (devoluciones > vencimientos))
+        )
+        dias = _dias_locales(vencimientos)
+        agregado.sumar('vencimientos', dias, categorias)
+        agregado.sumar('atrasadas', dias, categorias, atrasadas.astype(np.float64))
+
+    return list(agregado.filas(cerrado, ahora))
+
+
+def actualizar_series(ahora=None, reconstruir=False, dias_por_tramo=DIAS_POR_TRAMO):
+    """
+    Cierra los días pendientes y rehace el día en curso. Con `reconstruir`
+    (o si no hay agregados todavía) recorre todo el historial de reservas.
+    Devuelve cuántos días se cerraron y cuántas filas se escribieron.
+    """
+    ahora = ahora or timezone.now()
+    hoy = timezone.localdate(ahora)
+    with transaction.atomic():
+        if reconstruir:
+            ReservaDiaria.objects.all().delete()
+        ultimo = ReservaDiaria.objects.filter(cerrado=True).aggregate(ultimo=Max('dia'))['ultimo']
+        if ultimo is not None:
+            desde = ultimo + timedelta(days=1)
+        else:
+            primera = Reserva.objects.aggregate(primera=Min('fecha_reserva'))['primera']
+            desde = min(timezone.localdate(primera), hoy) if primera else hoy
+
+        ReservaDiaria.objects.filter(dia__gte=desde).delete()
+        filas = 0
+        tramo = desde
+        while tramo < hoy:
+            fin = min(tramo + timedelta(days=dias_por_tramo), hoy)
+            filas += len(ReservaDiaria.objects.bulk_create(agregar_dias(tramo, fin, ahora), batch_size=2000))
+            tramo = fin
+        filas += len(ReservaDiaria.objects.bulk_create(
+            agregar_dias(hoy, hoy + timedelta(days=1), ahora, cerrado=False)
+        ))
+
+    dias_cerrados = max((hoy - desde).days, 0)
+    contadores.incrementar('series_dias_cerrados', dias_cerrados)
+    return {'dias_cerrados': dias_cerrados, 'filas': filas}
+
+
+def _periodo(dia, intervalo):
+    # Las semanas empiezan en lunes
+    return dia - timedelta(days=dia.weekday()) if intervalo == 'semana' else dia
+
+
+def obtener_series(desde, hasta, intervalo='dia', categoria_id=None):
+    """
+    Series del rango [desde, hasta] (ambos incluidos) por periodo y categoría,
+    leídas de ReservaDiaria. `categoria_id` 0 selecciona los libros sin categoría.
+    """
+    filas = ReservaDiaria.objects.filter(dia__gte=desde, dia__lte=hasta).order_by()
+    if categoria_id is not None:
+        filas = filas.filter(categoria__isnull=True) if categoria_id == 0 else filas.filter(categoria_id=categoria_id)
+    nombres = dict(Categoria.objects.values_list('id', 'nombre'))
+
+    series = {}
+    for fila in filas.values('dia', 'categoria_id', *_Agregado.CAMPOS):
+        if not any(fila[campo] for campo in _Agregado.CAMPOS):
+            continue
+        clave = (_periodo(fila['dia'], intervalo), fila['categoria_id'])
+        punto = series.setdefault(clave, dict.fromkeys(_Agregado.CAMPOS, 0))
+        for campo in _Agregado.CAMPOS:
+            punto[campo] += fila[campo]
+
+    resultado = []
+    for (periodo, categoria), punto in sorted(series.items(), key=lambda e: (e[0][0], e[0][1] or 0)):
+        resultado.append({
+            'periodo': periodo.isoformat(),
+            'categoria_id': categoria,
+            'categoria': nombres.get(categoria, 'Sin categoría'),
+            'reservas': punto['reservas'],
+            'devoluciones': punto['devoluciones'],
+            'duracion_media_dias': (
+                round(punto['segundos_prestamo'] / punto['devoluciones'] / 86400, 2) if punto['devoluciones'] else None
+            ),
+            'vencimientos': punto['vencimientos'],
+            'atrasadas': punto['atrasadas'],
+            'tasa_atraso': round(punto['atrasadas'] / punto['vencimientos'], 4) if punto['vencimientos'] else None,
+        })
+    return resultado
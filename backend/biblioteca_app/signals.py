@@ -0,0 +1,86 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import CAMPOS_TEXTO, Libro, Categoria, Reserva, textos_libro
+from .busqueda import obtener_indice
+from . import estadisticas
+from .cache_catalogo import invalidar_catalogo, invalidar_textos, invalidar_titulos
+
+
+CAMPOS_INDEXADOS = {'titulo', 'autor', 'sinopsis'}
+
+
+@receiver(post_save, sender=Libro)
+def indexar_libro(sender, instance, update_fields=None, **kwargs):
+    """Mantiene el índice de texto completo al crear o editar un libro"""
+    if update_fields is not None and not CAMPOS_INDEXADOS.intersection(update_fields):
+        return
+    indice = obtener_indice()
+    if indice is not None:
+        indice.indexar([instance])
+
+
+@receiver(post_delete, sender=Libro)
+def desindexar_libro(sender, instance, **kwargs):
+    indice = obtener_indice()
+    if indice is not None:
+        indice.eliminar([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Libro)
+@receiver([post_save, post_delete], sender=Categoria)
+@receiver([post_save, post_delete], sender=Reserva)
+def invalidar_cache_catalogo(sender, **kwargs):
+    """Cualquier escritura en el catálogo invalida el contexto cacheado"""
+    invalidar_catalogo()
+
+
+@receiver(post_save, sender=Libro)
+def invalidar_titulos_libro_guardado(sender, instance, created, update_fields=None, **kwargs):
+    """El índice de títulos solo se rehace si cambia algún título (no con reservas ni disponibilidad)"""
+    if update_fields is not None and 'titulo' not in update_fields:
+        return
+    if created or getattr(instance, '_titulo_original', None) != instance.titulo:
+        invalidar_titulos()
+    instance._titulo_original = instance.titulo
+
+
+@receiver(post_delete, sender=Libro)
+def invalidar_titulos_libro_eliminado(sender, **kwargs):
+    invalidar_titulos()
+
+
+@receiver(post_save, sender=Libro)
+def invalidar_textos_libro_guardado(sender, instance, created, update_fields=None, **kwargs):
+    """El índice semántico solo se sincroniza si cambia el texto vectorizado"""
+    if update_fields is not None and not set(CAMPOS_TEXTO).intersection(update_fields):
+        return
+    textos = textos_libro(instance)
+    if created or getattr(instance, '_textos_original', None) != textos:
+        invalidar_textos()
+    instance._textos_original = textos
+
+
+@receiver(post_delete, sender=Libro)
+def invalidar_textos_libro_eliminado(sender, **kwargs):
+    invalidar_textos()
+
+
+@receiver(post_save, sender=Libro)
+def estadisticas_libro_guardado(sender, instance, created, update_fields=None, **kwargs):
+    estadisticas.libro_guardado(instance, created, update_fields)
+
+
+@receiver(post_delete, sender=Libro)
+def estadisticas_libro_eliminado(sender, instance, **kwargs):
+    estadisticas.libro_eliminado(instance)
+
+
+@receiver(post_save, sender=Reserva)
+def estadisticas_reserva_guardada(sender, instance, created, update_fields=None, **kwargs):
+    estadisticas.reserva_guardada(instance, created, update_fields)
+
+
+@receiver(post_delete, sender=Reserva)
+def estadisticas_reserva_eliminada(sender, instance, **kwargs):
+    estadisticas.reserva_eliminada(instance)
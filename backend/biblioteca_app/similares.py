@@ -0,0 +1,157 @@
+"""
+Tabla precalculada de libros similares.
+
+Para cada libro se guardan sus K vecinos según una puntuación que combina la
+similitud de texto (coseno entre los vectores del índice semántico), misma
+categoría, mismo autor y co-reservas (lectores que reservaron ambos libros,
+normalizado como coseno). Se calcula por bloques de filas con operaciones
+matriciales de numpy; las sugerencias solo leen la tabla.
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .busqueda import normalizar_texto
+from .cache_catalogo import contadores
+from .models import Libro, LibroSimilar, Reserva
+from .vectores import _top_k, obtener_indice_vectorial
+
+PESOS = {'texto': 1.0, 'autor': 0.3, 'categoria': 0.15, 'coreservas': 0.5}
+
+K_VECINOS = 10
+
+# Filas de la matriz de puntuaciones por bloque (bloque x libros del catálogo, float32)
+TAMANO_BLOQUE = 256
+
+# Los lectores con más reservas distintas no cuentan para las co-reservas (cuentas de prueba,
+# bibliotecarios): aportan poco y sus pares crecen con el cuadrado
+MAX_LIBROS_POR_LECTOR = 200
+
+
+class _Catalogo:
+    """Autor, categoría, vector y co-reservas de todos los libros, alineados por posición"""
+
+    def __init__(self):
+        filas = list(Libro.objects.order_by('id').values_list('id', 'autor', 'categoria_id'))
+        self.ids = np.array([f[0] for f in filas], dtype=np.int64)
+        self.autores = np.unique([normalizar_texto(f[1]).strip() for f in filas], return_inverse=True)[1]
+        self.categorias = np.array([-1 if f[2] is None else f[2] for f in filas], dtype=np.int64)
+        self.vectores = obtener_indice_vectorial().matriz_de(self.ids)
+        self._cargar_coreservas()
+
+    def _cargar_coreservas(self):
+        pares = list(Reserva.objects.values_list('libro_id', 'usuario_email').distinct())
+        libros = np.array([p[0] for p in pares], dtype=np.int64)
+        posiciones = np.searchsorted(self.ids, libros)
+        validos = posiciones < len(self.ids)
+        validos[validos] = self.ids[posiciones[validos]] == libros[validos]
+        posiciones = posiciones[validos]
+        usuarios = np.unique([p[1].lower() for p, v in zip(pares, validos) if v], return_inverse=True)[1]
+
+        # Pares (a, b) de libros reservados por un mismo lector, agrupando por lector
+        orden = np.argsort(usuarios, kind='stable')
+        posiciones, usuarios = posiciones[orden], usuarios[orden]
+        cortes = np.flatnonzero(np.diff(usuarios)) + 1
+        grupos = [g for g in np.split(posiciones, cortes) if 1 < len(g) <= MAX_LIBROS_POR_LECTOR]
+        if not grupos:
+            self.co_a = self.co_b = np.zeros(0, dtype=np.int64)
+            self.co_valor = np.zeros(0, dtype=np.float32)
+            return
+        a = np.concatenate([np.repeat(g, len(g)) for g in grupos])
+        b = np.concatenate([np.tile(g, len(g)) for g in grupos])
+        distintos = a != b
+        claves, veces = np.unique(a[distintos] * len(self.ids) + b[distintos], return_counts=True)
+
+        # Ordenados por `a`, así las co-reservas de cada fila son un tramo contiguo
+        self.co_a, self.co_b = np.divmod(claves, len(self.ids))
+        lectores = np.bincount(posiciones, minlength=len(self.ids))
+        self.co_valor = (veces / np.sqrt(lectores[self.co_a] * lectores[self.co_b])).astype(np.float32)
+
+    def puntuar(self, filas):
+        """Matriz (len(filas) x libros) de puntuaciones; el propio libro queda en -inf"""
+        puntuaciones = self.vectores[filas] @ self.vectores.T
+        np.maximum(puntuaciones, 0, out=puntuaciones)
+        puntuaciones *= PESOS['texto']
+        np.add(puntuaciones, PESOS['autor'], out=puntuaciones, where=self.autores[filas, None] == self.autores)
+        categorias = self.categorias[filas, None]
+        np.add(
+            puntuaciones, PESOS['categoria'], out=puntuaciones,
+            where=(categorias == self.categorias) & (categorias >= 0)
+        )
+
+        inicios = np.searchsorted(self.co_a, filas, side='left')
+        finales = np.searchsorted(self.co_a, filas, side='right')
+        for i, (inicio, final) in enumerate(zip(inicios, finales)):
+            puntuaciones[i, self.co_b[inicio:final]] += PESOS['coreservas'] * self.co_valor[inicio:final]
+
+        puntuaciones[np.arange(len(filas)), filas] = -np.inf
+        return puntuaciones
+
+
+def calcular_similares(libro_ids=None, k=K_VECINOS, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Calcula y guarda los vecinos de `libro_ids` (de todo el catálogo si es None)
+    comparando contra todo el catálogo. Devuelve el número de libros procesados.
+    """
+    fecha_calculo = timezone.now()
+    catalogo = _Catalogo()
+    if libro_ids is None:
+        posiciones = np.arange(len(catalogo.ids))
+    else:
+        libro_ids = np.unique(np.fromiter(libro_ids, dtype=np.int64))
+        posiciones = np.searchsorted(catalogo.ids, libro_ids)
+        dentro = posiciones < len(catalogo.ids)
+        posiciones = posiciones[dentro][catalogo.ids[posiciones[dentro]] == libro_ids[dentro]]
+
+    for inicio in range(0, len(posiciones), tamano_bloque):
+        filas = posiciones[inicio:inicio + tamano_bloque]
+        puntuaciones = catalogo.puntuar(filas)
+        mejores = _top_k(puntuaciones, k)
+        vecinos = []
+        for i, fila in enumerate(filas):
+            posicion = 0
+            for columna in mejores[i]:
+                puntuacion = float(puntuaciones[i, columna])
+                if puntuacion <= 0:
+                    break
+                vecinos.append(LibroSimilar(
+                    libro_id=int(catalogo.ids[fila]), similar_id=int(catalogo.ids[columna]),
+                    posicion=posicion, puntuacion=round(puntuacion, 4), fecha_calculo=fecha_calculo,
+                ))
+                posicion += 1
+        with transaction.atomic():
+            LibroSimilar.objects.filter(libro_id__in=catalogo.ids[filas].tolist()).delete()
+            LibroSimilar.objects.bulk_create(vecinos, batch_size=2000)
+
+    contadores.incrementar('similares_calculados', len(posiciones))
+    return len(posiciones)
+
+
+def actualizar_similares(k=K_VECINOS, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Recalcula solo los libros modificados (o con reservas nuevas) desde el
+    último cálculo y los que los tenían como vecino. Los libros nuevos entran
+    en las listas de los demás libros en la siguiente reconstrucción completa.
+    """
+    marca = LibroSimilar.objects.aggregate(marca=Max('fecha_calculo'))['marca']
+    if marca is None:
+        return calcular_similares(k=k, tamano_bloque=tamano_bloque)
+    cambiados = set(Libro.objects.filter(fecha_actualizacion__gt=marca).values_list('id', flat=True))
+    cambiados |= set(Reserva.objects.filter(fecha_actualizacion__gt=marca).values_list('libro_id', flat=True))
+    if not cambiados:
+        return 0
+    afectados = cambiados | set(
+        LibroSimilar.objects.filter(similar_id__in=cambiados).values_list('libro_id', flat=True)
+    )
+    return calcular_similares(afectados, k=k, tamano_bloque=tamano_bloque)
+
+
+def libros_vecinos(libro_id, k=K_VECINOS):
+    """Vecinos guardados de un libro, con el atributo `puntuacion`, en orden"""
+    vecinos = LibroSimilar.objects.filter(libro_id=libro_id).select_related('similar')[:k]
+    libros = []
+    for vecino in vecinos:
+        vecino.similar.puntuacion = vecino.puntuacion
+        libros.append(vecino.similar)
+    return libros
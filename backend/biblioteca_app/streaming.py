@@ -0,0 +1,164 @@
+"""
+Respuestas del asistente en streaming (Server-Sent Events).
+
+El modelo devuelve un JSON por fragmentos. ExtractorIncremental lo recorre a
+medida que llega y entrega el texto de los campos legibles (`explicacion`,
+`respuesta`) sin esperar a que el JSON se cierre; el resultado completo se
+interpreta al final, igual que en la ruta sin streaming.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .cache_catalogo import version_catalogo
+from .models import Consulta
+from .serializers import serializar_libros_encontrados
+
+CAMPOS_TEXTO = ('explicacion', 'respuesta')
+
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', '/': '/', '\\': '\\', '"': '"'}
+
+
+class ExtractorIncremental:
+    """Parser JSON incremental que extrae el texto de campos de primer nivel"""
+
+    def __init__(self, campos=CAMPOS_TEXTO):
+        self.campos = set(campos)
+        self._fragmentos = []
+        self._iniciado = False
+        self._profundidad = 0
+        self._en_cadena = False
+        self._escape = False
+        self._unicode = None
+        self._surrogado = None
+        self._cadena = []
+        self._es_clave = False
+        self._clave = None
+        self._esperando_valor = False
+        self._campo = None
+
+    @property
+    def texto(self):
+        """Todo el texto recibido hasta ahora"""
+        return ''.join(self._fragmentos)
+
+    def alimentar(self, fragmento):
+        """Procesa un fragmento y devuelve una lista de (campo, delta)"""
+        self._fragmentos.append(fragmento)
+        deltas = []
+        for c in fragmento:
+            caracter = self._procesar(c)
+            if caracter is not None and self._campo:
+                if deltas and deltas[-1][0] == self._campo:
+                    deltas[-1] = (self._campo, deltas[-1][1] + caracter)
+                else:
+                    deltas.append((self._campo, caracter))
+        return deltas
+
+    def _procesar(self, c):
+        """Avanza la máquina de estados; devuelve el carácter decodificado si está dentro de una cadena"""
+        if not self._iniciado:
+            # Ignora cualquier prefijo (p. ej. ```json) hasta la primera llave
+            if c != '{':
+                return None
+            self._iniciado = True
+
+        if self._en_cadena:
+            return self._procesar_cadena(c)
+
+        if c == '"':
+            self._en_cadena = True
+            self._cadena = []
+            self._es_clave = self._profundidad == 1 and not self._esperando_valor
+            if self._profundidad == 1 and self._esperando_valor and self._clave in self.campos:
+                self._campo = self._clave
+        elif c in '{[':
+            self._profundidad += 1
+            self._esperando_valor = False
+        elif c in '}]':
+            self._profundidad -= 1
+        elif c == ':' and self._profundidad == 1:
+            self._esperando_valor = True
+        elif c == ',' and self._profundidad == 1:
+            self._esperando_valor = False
+            self._clave = None
+        return None
+
+    def _procesar_cadena(self, c):
+        if self._unicode is not None:
+            self._unicode += c
+            if len(self._unicode) < 4:
+                return None
+            codigo = int(self._unicode, 16)
+            self._unicode = None
+            if 0xD800 <= codigo < 0xDC00:
+                self._surrogado = codigo
+                return None
+            if 0xDC00 <= codigo < 0xE000 and self._surrogado is not None:
+                codigo = 0x10000 + ((self._surrogado - 0xD800) << 10) + (codigo - 0xDC00)
+            self._surrogado = None
+            return self._agregar(chr(codigo))
+
+        if self._escape:
+            self._escape = False
+            if c == 'u':
+                self._unicode = ''
+                return None
+            return self._agregar(_ESCAPES.get(c, c))
+
+        if c == '\\':
+            self._escape = True
+            return None
+
+        if c == '"':
+            self._en_cadena = False
+            if self._es_clave:
+                self._clave = ''.join(self._cadena)
+            self._campo = None
+            return None
+
+        return self._agregar(c)
+
+    def _agregar(self, caracter):
+        if self._es_clave:
+            self._cadena.append(caracter)
+        return caracter
+
+
+def formatear_evento(nombre, datos):
+    """Serializa un evento en formato Server-Sent Events"""
+    return f"event: {nombre}\ndata: {json.dumps(datos, ensure_ascii=False, cls=DjangoJSONEncoder)}\n\n"
+
+
+def _resultado_final(bibliotecario, texto_consulta, resultado, buscar, request, version):
+    """Resuelve los libros recomendados (búsqueda) o guarda la consulta (chat)"""
+    if buscar:
+        encontrado = bibliotecario._resolver_libros(texto_consulta, resultado)
+        return {
+            "libros": serializar_libros_encontrados(encontrado["libros"], request),
+            "explicacion": encontrado["explicacion"],
+            "sugerencias": encontrado["sugerencias"]
+        }
+    Consulta.objects.create(texto=texto_consulta, respuesta=str(resultado), version_catalogo=version)
+    return resultado
+
+
+def eventos_sse(bibliotecario, texto_consulta, request, buscar=False):
+    """Generador de eventos SSE para StreamingHttpResponse (WSGI)"""
+    consulta = f"Buscar libros sobre: {texto_consulta}" if buscar else texto_consulta
+    version = version_catalogo()
+    for tipo, datos in bibliotecario.procesar_consulta_stream(consulta):
+        if tipo == 'resultado':
+            datos = _resultado_final(bibliotecario, texto_consulta, datos, buscar, request, version)
+        yield formatear_evento(tipo, datos)
+
+
+async def eventos_sse_async(bibliotecario, texto_consulta, request, buscar=False):
+    """Generador asíncrono de eventos SSE para StreamingHttpResponse (ASGI)"""
+    consulta = f"Buscar libros sobre: {texto_consulta}" if buscar else texto_consulta
+    version = await sync_to_async(version_catalogo)()
+    async for tipo, datos in bibliotecario.procesar_consulta_stream_async(consulta):
+        if tipo == 'resultado':
+            datos = await sync_to_async(_resultado_final)(bibliotecario, texto_consulta, datos, buscar, request, version)
+        yield formatear_evento(tipo, datos)
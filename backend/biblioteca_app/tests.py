@@ -1,3 +1,1521 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import logging
+import tempfile
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from itertools import count
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.models import Count, F
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.test import APIClient
+
+from .busqueda import normalizar_texto, reconstruir_indice
+from . import importacion
+from .importacion import importar_libros, leer_ndjson
+from .cache_catalogo import contadores, obtener_cache, obtener_contexto, version_catalogo, version_en_bd
+from .datos_sinteticos import generar_catalogo, generar_reservas
+from .cache_respuestas import (
+    CacheRespuestas, clave_respuesta, obtener_cache_respuestas, precargar_desde_consultas
+)
+from . import async_views
+from .ai_bibliotecario import BibliotecarioIA
+from . import cliente_modelo
+from .cliente_modelo import Interruptor, ModeloNoDisponible, ModeloResiliente, ModeloSaturado, obtener_modelo
+from .modelo_falso import ModeloFalso
+from .paginacion import codificar_cursor
+from .prompts import INSTRUCCIONES, construir_prompt, estimar_tokens
+from .serializers import LibroSerializer
+from .instrumentacion import InstrumentacionMiddleware, metricas, registrar_modelo
+from .estadisticas import obtener_estadisticas, recalcular_estadisticas, valores_exactos
+from .models import Estadistica, Libro, Categoria, Consulta, Reserva, ReservaDiaria, VersionCompartida
+from .reservas import ReservaNoDisponible, expirar_reservas_vencidas, reconciliar_reservas_activas, reservar_libro
+from .streaming import ExtractorIncremental
+from .titulos import IndiceTitulos, resolver_libros
+from .salida_modelo import RESPUESTA_NO_INTERPRETADA, extraer_json, interpretar_respuesta
+from . import series
+from .series import actualizar_series, agregar_dias
+from .similares import actualizar_similares, calcular_similares, libros_vecinos
+from . import vectores
+from .vectores import IndiceNoConstruido, buscar_semantico, libros_similares, obtener_indice_vectorial
+
+
+_nivel_log = None
+
+
+def setUpModule():
+    # Sin la línea de cada petición en la salida de las pruebas (assertLogs sigue viendo los INFO)
+    global _nivel_log
+    registro = logging.getLogger('biblioteca')
+    _nivel_log = registro.level
+    registro.setLevel(logging.WARNING)
+
+
+def tearDownModule():
+    logging.getLogger('biblioteca').setLevel(_nivel_log)
+
+
+_isbns = count(9780000000000)
+
+
+def crear_libro(titulo, autor='Autor', sinopsis='', isbn=None, **kwargs):
+    return Libro.objects.create(
+        titulo=titulo,
+        autor=autor,
+        sinopsis=sinopsis,
+        isbn=isbn or str(next(_isbns)),
+        fecha_publicacion=date(2000, 1, 1),
+        **kwargs
+    )
+
+
+def directorio_temporal(test):
+    directorio = tempfile.TemporaryDirectory()
+    test.addCleanup(directorio.cleanup)
+    return directorio.name
+
+
+def crear_reserva(libro, **kwargs):
+    return Reserva.objects.create(
+        libro=libro,
+        usuario_nombre='Ana',
+        usuario_email='ana@example.com',
+        fecha_vencimiento=kwargs.pop('fecha_vencimiento', timezone.now() + timedelta(days=14)),
+        **kwargs
+    )
+
+
+class BusquedaTextoCompletoTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        obtener_cache().clear()
+        self.corazon = crear_libro('El corazón de las tinieblas', 'Joseph Conrad', 'Un viaje por el río Congo')
+        self.rio = crear_libro('Crónica de una muerte anunciada', 'Gabriel García Márquez', 'Un pueblo junto al río')
+        self.otro = crear_libro('Rayuela', 'Julio Cortázar', 'Novela experimental en París')
+
+    def buscar(self, q):
+        response = self.client.get('/api/libros/', {'q': q})
+        return [libro['id'] for libro in response.data['results']]
+
+    def test_normalizar_texto_quita_acentos(self):
+        self.assertEqual(normalizar_texto('Corazón ÁRBOL Ñandú'), 'corazon arbol nandu')
+
+    def test_busqueda_ignora_acentos_y_admite_prefijos(self):
+        self.assertEqual(self.buscar('corazon'), [self.corazon.id])
+        self.assertEqual(self.buscar('Marq'), [self.rio.id])
+        self.assertEqual(self.buscar('cortazar'), [self.otro.id])
+
+    def test_titulo_pesa_mas_que_sinopsis(self):
+        en_titulo = crear_libro('Historias del río', 'Autora', 'Cuentos cortos')
+        self.assertEqual(self.buscar('rio')[0], en_titulo.id)
+
+    def test_indice_se_actualiza_al_editar_y_borrar(self):
+        self.otro.titulo = 'Los premios'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.otro.save()
+        self.assertEqual(self.buscar('premios'), [self.otro.id])
+        self.assertEqual(self.buscar('rayuela'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.otro.delete()
+        self.assertEqual(self.buscar('premios'), [])
+
+    def test_filtros_orden_y_conteo_en_sql(self):
+        mareas = [crear_libro(f'Marea {i}', disponible=i % 5 != 0) for i in range(25)]
+        en_titulo = crear_libro('Marea alta y marea baja')
+        response = self.client.get('/api/libros/', {'q': 'marea', 'page_size': 10, 'page': 3})
+        self.assertEqual(response.data['count'], 26)
+        self.assertEqual(len(response.data['results']), 6)
+        primera = self.client.get('/api/libros/', {'q': 'marea', 'page_size': 10}).data['results']
+        self.assertEqual(primera[0]['id'], en_titulo.id)
+        # El filtro se aplica sobre todas las coincidencias, no sobre un recorte previo
+        response = self.client.get('/api/libros/', {'q': 'marea', 'disponible': 'false'})
+        self.assertEqual({l['id'] for l in response.data['results']}, {l.id for l in mareas[::5]})
+
+    def test_reconstruir_indice(self):
+        Libro.objects.bulk_create([
+            Libro(titulo='Pedro Páramo', autor='Juan Rulfo', sinopsis='Comala',
+                  isbn='9999999999999', fecha_publicacion=date(1955, 1, 1))
+        ])
+        self.assertEqual(self.buscar('paramo'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reconstruir_indice(), 4)
+        self.assertEqual(len(self.buscar('paramo')), 1)
+
+
+class ContextoCacheTests(TestCase):
+    def setUp(self):
+        obtener_cache().clear()
+        contadores.reiniciar()
+        self.categoria = Categoria.objects.create(nombre='Novela')
+        for i in range(3):
+            crear_libro(f'Libro {i}', categoria=self.categoria)
+
+    def test_segunda_lectura_solo_consulta_la_version(self):
+        primero = obtener_contexto()
+        # Con la caché local del proceso la versión del catálogo se lee de la base de datos
+        with self.assertNumQueries(1):
+            segundo = obtener_contexto()
+        self.assertEqual(primero, segundo)
+        self.assertEqual(contadores.obtener()['contexto_aciertos'], 1)
+        self.assertEqual(contadores.obtener()['contexto_fallos'], 1)
+
+    def test_contexto_con_consultas_fijas(self):
+        for i in range(3, 15):
+            crear_libro(f'Libro {i}', categoria=self.categoria)
+        obtener_cache().clear()
+        # Versión + las tres del contexto
+        with self.assertNumQueries(4):
+            obtener_contexto()
+
+    def test_escrituras_invalidan_el_contexto(self):
+        self.assertNotIn('Nuevo', obtener_contexto()['contexto_categorias'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Categoria.objects.create(nombre='Nuevo')
+        self.assertIn('Nuevo', obtener_contexto()['contexto_categorias'])
+        self.assertEqual(contadores.obtener()['contexto_fallos'], 2)
+
+
+class CacheHTTPTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        obtener_cache().clear()
+        contadores.reiniciar()
+        self.libro = crear_libro('Ficciones', 'Borges')
+
+    def test_etag_y_304_sin_consultas(self):
+        response = self.client.get('/api/libros/')
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        # Solo la versión del catálogo, que con la caché local del proceso vive en la base de datos
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/libros/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # Otra URL, otro ETag; una escritura cambia la versión y con ella todos los ETag
+        self.assertNotEqual(self.client.get('/api/libros/', {'page': 1})['ETag'], etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            crear_libro('El Aleph', 'Borges')
+        response = self.client.get('/api/libros/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_listados_anonimos_se_sirven_renderizados(self):
+        primera = self.client.get('/api/categorias/')
+        with self.assertNumQueries(1):
+            segunda = self.client.get('/api/categorias/')
+        self.assertEqual(segunda.content, primera.content)
+        self.assertEqual(segunda['Content-Type'], primera['Content-Type'])
+
+        # El detalle solo lleva validadores
+        detalle = self.client.get(f'/api/libros/{self.libro.id}/')
+        self.assertEqual(self.client.get(f'/api/libros/{self.libro.id}/', HTTP_IF_NONE_MATCH=detalle['ETag']).status_code, 304)
+        disponibilidad = self.client.get(f'/api/bibliotecario/{self.libro.id}/disponibilidad/')
+        self.assertTrue(disponibilidad.has_header('ETag'))
+
+        http = self.client.get('/api/bibliotecario/estado_cache/').data['http']
+        self.assertEqual((http['aciertos'], http['fallos'], http['no_modificadas']), (1, 1, 1))
+        self.assertEqual(http['tasa_aciertos'], 0.5)
+
+
+    def test_detalle_y_disponibilidad_se_revalidan_cada_dia(self):
+        # Incluyen los días restantes de la reserva activa, que cambian sin escrituras
+        crear_reserva(self.libro)
+        for url in (f'/api/libros/{self.libro.id}/', f'/api/bibliotecario/{self.libro.id}/disponibilidad/'):
+            response = self.client.get(url)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+            with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(days=5)):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+                self.assertEqual(
+                    self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 200
+                )
+
+
+class VersionCompartidaTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        obtener_cache().clear()
+        crear_libro('Ficciones', 'Borges')
+
+    def test_la_version_la_comparten_todos_los_workers(self):
+        etag = self.client.get('/api/libros/')['ETag']
+        # Otro worker confirma una escritura: solo cambia la fila compartida, no la caché de este proceso
+        VersionCompartida.objects.filter(nombre='catalogo').update(valor=F('valor') + 1)
+        response = self.client.get('/api/libros/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_con_cache_compartida_el_304_no_consulta_la_base_de_datos(self):
+        with tempfile.TemporaryDirectory() as directorio, override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directorio,
+        }}):
+            self.assertFalse(version_en_bd())
+            etag = self.client.get('/api/libros/')['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get('/api/libros/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            with self.captureOnCommitCallbacks(execute=True):
+                crear_libro('El Aleph', 'Borges')
+            self.assertEqual(self.client.get('/api/libros/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class InstrumentacionTests(TestCase):
+    def setUp(self):
+        metricas.reiniciar()
+        contadores.reiniciar()
+        crear_libro('Ficciones', 'Borges')
+
+    @override_settings(BIBLIOTECA_METRICS_TOKEN='secreto')
+    def test_metricas_en_formato_prometheus(self):
+        self.client.get('/api/libros/')
+        texto = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secreto').content.decode()
+        self.assertIn('# TYPE biblioteca_peticion_segundos histogram', texto)
+        self.assertRegex(texto, r'biblioteca_peticiones_total\{metodo="GET",ruta="api/libros/\$",estado="200"\} 1')
+        self.assertRegex(texto, r'biblioteca_consultas_bd_total\{ruta="api/libros/\$"\} [1-9]')
+
+    @override_settings(BIBLIOTECA_METRICS_TOKEN='secreto')
+    def test_metricas_con_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secreto')
+        self.assertEqual(response.status_code, 200)
+
+    def test_metricas_sin_token_solo_en_desarrollo(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(BIBLIOTECA_UMBRAL_CONSULTAS_REPETIDAS=5)
+    def test_detecta_consultas_repetidas(self):
+        def vista(request):
+            for libro_id in range(8):
+                Libro.objects.filter(pk=libro_id).exists()
+            registrar_modelo(0.25)
+            return HttpResponse('ok')
+
+        with self.assertLogs('biblioteca.peticiones', 'WARNING') as registros:
+            InstrumentacionMiddleware(vista)(RequestFactory().get('/n-mas-1'))
+        datos = registros.records[0].datos
+        self.assertEqual(datos['consultas'], 8)
+        self.assertEqual(datos['consultas_repetidas'], 7)
+        self.assertEqual(datos['sentencia_repetida']['veces'], 8)
+        self.assertEqual(datos['llamadas_modelo'], 1)
+        self.assertEqual(datos['modelo_ms'], 250.0)
+        self.assertEqual(contadores.obtener()['peticiones_n_mas_1'], 1)
+
+    @override_settings(BIBLIOTECA_PERFIL_MUESTREO=1.0, BIBLIOTECA_PERFIL_UMBRAL=0.0)
+    def test_perfila_peticiones_lentas(self):
+        with self.assertLogs('biblioteca.perfil', 'WARNING') as registros:
+            InstrumentacionMiddleware(lambda request: HttpResponse('ok'))(RequestFactory().get('/'))
+        self.assertIn('cumulative', registros.records[0].datos['perfil'])
+
+    @override_settings(BIBLIOTECA_PERFIL_MUESTREO=1.0, BIBLIOTECA_PERFIL_UMBRAL=0.0)
+    def test_un_solo_perfil_a_la_vez(self):
+        peticiones = []
+
+        def vista(request):
+            # Una petición que llega mientras esta se está perfilando
+            peticiones.append(InstrumentacionMiddleware(lambda r: HttpResponse('ok'))(RequestFactory().get('/')))
+            return HttpResponse('ok')
+
+        with self.assertLogs('biblioteca.perfil', 'WARNING') as registros:
+            response = InstrumentacionMiddleware(vista)(RequestFactory().get('/'))
+        self.assertEqual((response.status_code, peticiones[0].status_code), (200, 200))
+        self.assertEqual(len(registros.records), 1)
+
+        # Otra herramienta de perfilado activa: la petición se sirve sin perfil
+        with mock.patch('cProfile.Profile.enable', side_effect=ValueError('Another profiling tool is already active')):
+            response = InstrumentacionMiddleware(lambda r: HttpResponse('ok'))(RequestFactory().get('/'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_tiempo_del_modelo_en_la_peticion(self):
+        cliente = ModeloResiliente(ModeloFalso(demora=0.05), interruptor=Interruptor())
+
+        def vista(request):
+            cliente.generate_content('hola')
+            return HttpResponse('ok')
+
+        with self.assertLogs('biblioteca.peticiones', 'INFO') as registros:
+            InstrumentacionMiddleware(vista)(RequestFactory().get('/'))
+        datos = registros.records[0].datos
+        self.assertEqual(datos['llamadas_modelo'], 1)
+        self.assertGreaterEqual(datos['modelo_ms'], 50)
+
+
+class PromptTests(TestCase):
+    def setUp(self):
+        obtener_cache().clear()
+        contadores.reiniciar()
+        self.categoria = Categoria.objects.create(nombre='Ciencia')
+        for i in range(30):
+            crear_libro(f'Relleno {i}', sinopsis='Texto de relleno ' * 20)
+        self.agujeros = crear_libro('Agujeros negros', 'Stephen Hawking', sinopsis='Física del universo', categoria=self.categoria)
+        self.cosmos = crear_libro('Cosmos', 'Carl Sagan', sinopsis='Un viaje por el universo', categoria=self.categoria)
+
+    def test_recupera_los_libros_relevantes_primero(self):
+        prompt, metricas = construir_prompt('Buscar libros sobre el universo y los agujeros negros')
+        self.assertTrue(prompt.startswith(INSTRUCCIONES))
+        libros = prompt.split('sinopsis):\n')[1]
+        self.assertTrue(libros.startswith('- Agujeros negros | Stephen Hawking | Ciencia | disponible'))
+        self.assertIn('- Cosmos', libros.splitlines()[1])
+        self.assertEqual(metricas['libros_recuperados'], 2)
+        # El resto del presupuesto se completa con otros libros del catálogo
+        self.assertGreater(metricas['libros_incluidos'], 2)
+
+    def test_respeta_el_presupuesto_de_tokens(self):
+        prompt, metricas = construir_prompt('universo', presupuesto=estimar_tokens(INSTRUCCIONES) + 200)
+        self.assertLessEqual(estimar_tokens(prompt), metricas['presupuesto'])
+        self.assertLessEqual(metricas['tokens'], metricas['presupuesto'])
+        self.assertGreater(metricas['libros_recortados'], 0)
+        self.assertIn('Agujeros negros', prompt)
+        self.assertEqual(contadores.obtener()['prompt_libros'], metricas['libros_incluidos'])
+
+
+class CacheRespuestasTests(TestCase):
+    def setUp(self):
+        obtener_cache().clear()
+        contadores.reiniciar()
+        obtener_cache_respuestas().vaciar()
+        self.modelo = ModeloFalso()
+        self.bibliotecario = BibliotecarioIA(model=self.modelo)
+
+    def test_consultas_casi_identicas_comparten_respuesta(self):
+        self.bibliotecario.procesar_consulta('¿Qué libros de ciencia hay?')
+        resultado = self.bibliotecario.procesar_consulta('que libros de CIENCIA hay')
+        self.assertEqual(resultado['respuesta'], 'Hola')
+        self.assertEqual(self.modelo.llamadas, 1)
+
+    def test_cambio_de_catalogo_invalida_respuestas(self):
+        self.bibliotecario.procesar_consulta('hola')
+        with self.captureOnCommitCallbacks(execute=True):
+            crear_libro('Nuevo')
+        self.bibliotecario.procesar_consulta('hola')
+        self.assertEqual(self.modelo.llamadas, 2)
+
+    def test_respuestas_invalidas_no_se_cachean(self):
+        self.modelo.respuesta = 'esto no es json'
+        self.bibliotecario.procesar_consulta('hola')
+        self.bibliotecario.procesar_consulta('hola')
+        self.assertEqual(self.modelo.llamadas, 2)
+
+    def test_peticiones_concurrentes_comparten_una_llamada(self):
+        cache_respuestas = CacheRespuestas()
+        modelo = ModeloFalso(demora=0.2)
+        resultados = []
+
+        def pedir():
+            resultados.append(cache_respuestas.obtener_o_calcular(
+                'clave', lambda: (json.loads(modelo.generate_content('').text), True)
+            ))
+
+        hilos = [threading.Thread(target=pedir) for _ in range(10)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(modelo.llamadas, 1)
+        self.assertEqual(len(resultados), 10)
+        self.assertEqual(contadores.obtener()['respuestas_coalescidas'], 9)
+
+    async def test_cancelar_al_que_calcula_no_cancela_a_los_que_esperan(self):
+        cache_respuestas = CacheRespuestas()
+        llamadas = []
+
+        async def calcular():
+            llamadas.append(1)
+            await asyncio.sleep(0.05 if len(llamadas) > 1 else 10)
+            return {'respuesta': 'Hola'}, True
+
+        lider = asyncio.create_task(cache_respuestas.obtener_o_calcular_async('clave', calcular))
+        await asyncio.sleep(0)
+        seguidores = [
+            asyncio.create_task(cache_respuestas.obtener_o_calcular_async('clave', calcular)) for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+        lider.cancel()
+
+        resultados = await asyncio.gather(*seguidores)
+        self.assertTrue(lider.cancelled())
+        self.assertEqual(resultados, [{'respuesta': 'Hola'}] * 3)
+        self.assertEqual(len(llamadas), 2)
+
+    def test_precarga_desde_consultas(self):
+        version = version_catalogo()
+        Consulta.objects.create(
+            texto='Hola', respuesta=str({"tipo": "informacion", "respuesta": "Guardada"}), version_catalogo=version
+        )
+        # Respondida con otro catálogo, sin modelo o sin poder interpretar la respuesta: no se precargan
+        Consulta.objects.create(
+            texto='Antigua', respuesta=str({"tipo": "informacion", "respuesta": "Vieja"}), version_catalogo=version - 1
+        )
+        Consulta.objects.create(
+            texto='Local', respuesta=str({"tipo": "busqueda", "recomendaciones": [], "degradada": True}),
+            version_catalogo=version
+        )
+        Consulta.objects.create(texto='Rota', respuesta=str(RESPUESTA_NO_INTERPRETADA), version_catalogo=version)
+        cache_respuestas = CacheRespuestas()
+        self.assertEqual(precargar_desde_consultas(cache_respuestas), 1)
+        resultado = cache_respuestas.obtener_o_calcular(clave_respuesta('hola'), lambda: ({}, False))
+        self.assertEqual(resultado['respuesta'], 'Guardada')
+
+    def test_consulta_guarda_la_version_del_catalogo(self):
+        with mock.patch('biblioteca_app.views.BibliotecarioIA', return_value=BibliotecarioIA(model=ModeloFalso())):
+            self.client.post('/api/bibliotecario/consulta/', {'consulta': 'Hola'}, content_type='application/json')
+        self.assertEqual(Consulta.objects.get().version_catalogo, version_catalogo())
+
+
+class ClienteModeloTests(TestCase):
+    def setUp(self):
+        obtener_cache().clear()
+        obtener_cache_respuestas().vaciar()
+        contadores.reiniciar()
+        self.interruptor = Interruptor(umbral=2, apertura=60)
+        crear_libro('Historia de Roma', sinopsis='El imperio romano')
+
+    def cliente(self, modelo, **kwargs):
+        parche = mock.patch('biblioteca_app.cliente_modelo.ESPERA_BASE', 0)
+        parche.start()
+        self.addCleanup(parche.stop)
+        return ModeloResiliente(modelo, interruptor=self.interruptor, **kwargs)
+
+    def test_reintenta_errores_transitorios(self):
+        modelo = ModeloFalso(errores=[ConnectionError('caído')])
+        respuesta = self.cliente(modelo, reintentos=1).generate_content('hola')
+        self.assertIn('Hola', respuesta.text)
+        self.assertEqual(modelo.llamadas, 2)
+        self.assertEqual(contadores.obtener()['modelo_reintentos'], 1)
+        self.assertEqual(self.interruptor.estado, 'cerrado')
+
+    def test_plazo_por_llamada(self):
+        cliente = self.cliente(ModeloFalso(demora=1), plazo=0.05, reintentos=0)
+        inicio = time.perf_counter()
+        with self.assertRaises(ModeloNoDisponible):
+            cliente.generate_content('hola')
+        self.assertLess(time.perf_counter() - inicio, 0.5)
+        self.assertEqual(contadores.obtener()['modelo_timeouts'], 1)
+
+    def test_saturacion_local_no_cuenta_como_fallo(self):
+        cliente = self.cliente(ModeloFalso(demora=0.3), plazo=0.5, reintentos=0)
+        resultados = []
+
+        def llamar():
+            try:
+                cliente.generate_content('hola')
+                resultados.append('ok')
+            except ModeloSaturado:
+                resultados.append('saturado')
+
+        hilos = [threading.Thread(target=llamar) for _ in range(24)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        # Las que no caben se rechazan al momento; las que entran tienen todo su plazo
+        self.assertEqual(len(resultados), 24)
+        self.assertIn('ok', resultados)
+        self.assertIn('saturado', resultados)
+        self.assertNotIn('modelo_timeouts', contadores.obtener())
+        self.assertEqual(self.interruptor.estado, 'cerrado')
+
+    def test_un_flujo_conserva_su_cupo_hasta_terminar(self):
+        cupos = threading.BoundedSemaphore(1)
+        ejecutor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(ejecutor.shutdown)
+        self.enterContext(mock.patch.object(cliente_modelo, '_ejecutor', ejecutor))
+        self.enterContext(mock.patch.object(cliente_modelo, '_cupos', cupos))
+        cliente = self.cliente(ModeloFalso(), reintentos=0)
+
+        fragmentos = iter(cliente.generate_content('hola', stream=True))
+        primero = next(fragmentos)
+        # El cupo es del flujo: otra llamada no lo puede tomar entre fragmentos
+        with self.assertRaises(ModeloSaturado):
+            cliente.generate_content('otra')
+        texto = primero.text + ''.join(fragmento.text for fragmento in fragmentos)
+        self.assertIn('Hola', texto)
+        self.assertTrue(cupos.acquire(blocking=False))
+        cupos.release()
+
+        # Un flujo abandonado sin leer también lo devuelve
+        flujo = cliente.generate_content('hola', stream=True)
+        del flujo
+        self.assertTrue(cupos.acquire(blocking=False))
+        cupos.release()
+
+    @override_settings(BIBLIOTECA_MODELO_PRESUPUESTO=1.0)
+    def test_presupuesto_total_entre_reintentos(self):
+        modelo = ModeloFalso(demora=1)
+        self.interruptor.umbral = 10
+        cliente = self.cliente(modelo, plazo=0.3, reintentos=5)
+        inicio = time.perf_counter()
+        with self.assertRaises(ModeloNoDisponible):
+            cliente.generate_content('hola')
+        # Dos intentos de 0.3s; para un tercero no queda presupuesto
+        self.assertLess(time.perf_counter() - inicio, 1.0)
+        self.assertEqual(modelo.llamadas, 2)
+
+    def test_interruptor_abierto_responde_con_busqueda_local(self):
+        modelo = ModeloFalso(errores=[ConnectionError()] * 2)
+        bibliotecario = BibliotecarioIA(model=modelo)
+        bibliotecario.model = self.cliente(modelo, reintentos=1)
+        resultado = bibliotecario.procesar_consulta('libros sobre el imperio romano')
+        self.assertTrue(resultado['degradada'])
+        self.assertEqual(resultado['recomendaciones'], ['Historia de Roma'])
+        self.assertEqual(self.interruptor.estado, 'abierto')
+
+        # Con el interruptor abierto ni siquiera se llama al modelo (ni se cachea la respuesta local)
+        resultado = bibliotecario.procesar_consulta('libros sobre el imperio romano')
+        self.assertTrue(resultado['degradada'])
+        self.assertEqual(modelo.llamadas, 2)
+        self.assertEqual(contadores.obtener()['modelo_rechazadas'], 1)
+
+    def test_un_cliente_por_modelo_y_proceso(self):
+        genai = mock.Mock()
+        self.enterContext(mock.patch.dict('sys.modules', {'google.generativeai': genai}))
+        self.enterContext(mock.patch.dict(cliente_modelo._modelos, clear=True))
+        self.enterContext(mock.patch.object(cliente_modelo, '_genai_configurado', False))
+
+        with override_settings(BIBLIOTECA_MODELO='models/otro'):
+            modelo = BibliotecarioIA().model
+            self.assertIs(BibliotecarioIA().model, modelo)
+        self.assertEqual(modelo.nombre, 'models/otro')
+        self.assertIsNot(obtener_modelo('models/gemini-2.5-flash'), modelo)
+        # configure una sola vez: volver a llamarlo descartaría los clientes ya creados
+        genai.configure.assert_called_once()
+        self.assertEqual(genai.GenerativeModel.call_count, 2)
+
+        # Un proceso hijo no hereda los clientes del padre
+        cliente_modelo._reiniciar_tras_fork()
+        self.assertIsNot(obtener_modelo('models/otro'), modelo)
+
+    def test_acciones_sin_modelo_no_crean_el_cliente(self):
+        libro = Libro.objects.get()
+        with mock.patch('biblioteca_app.ai_bibliotecario.obtener_modelo', side_effect=ImportError) as obtener:
+            response = self.client.get(f'/api/bibliotecario/{libro.id}/disponibilidad/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.client.get('/api/bibliotecario/estadisticas/').status_code, 200)
+        obtener.assert_not_called()
+
+    def test_semiabierto_deja_pasar_una_prueba(self):
+        self.interruptor.apertura = 0.05
+        self.interruptor.fallo()
+        self.interruptor.fallo()
+        self.assertFalse(self.interruptor.permitir())
+        time.sleep(0.06)
+        self.assertEqual(self.interruptor.estado, 'semiabierto')
+        self.assertTrue(self.interruptor.permitir())
+        self.assertFalse(self.interruptor.permitir())
+        self.interruptor.exito()
+        self.assertEqual(self.interruptor.estado, 'cerrado')
+
+
+@override_settings(BIBLIOTECA_MAX_LLAMADAS_MODELO=3)
+class BibliotecarioAsyncTests(TestCase):
+    def setUp(self):
+        obtener_cache().clear()
+        obtener_cache_respuestas().vaciar()
+        self.libro = crear_libro('Cien años de soledad', 'Gabriel García Márquez')
+        self.modelo = ModeloFalso(demora=0.05, respuesta={
+            "tipo": "busqueda",
+            "recomendaciones": ["Cien años de soledad"],
+            "explicacion": "Un clásico",
+            "sugerencias": [],
+        })
+        parche = mock.patch.object(
+            async_views, 'obtener_bibliotecario', lambda: BibliotecarioIA(model=self.modelo)
+        )
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    async def test_consulta_async_guarda_la_consulta(self):
+        response = await self.async_client.post(
+            '/api/async/bibliotecario/consulta/', {'consulta': 'algo de García Márquez'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['tipo'], 'busqueda')
+        self.assertEqual(await Consulta.objects.acount(), 1)
+
+    async def test_consulta_vacia(self):
+        response = await self.async_client.post(
+            '/api/async/bibliotecario/consulta/', {}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    async def test_buscar_libros_async(self):
+        response = await self.async_client.post(
+            '/api/async/bibliotecario/buscar_libros/', {'consulta': 'realismo mágico'},
+            content_type='application/json'
+        )
+        self.assertEqual([libro['id'] for libro in response.json()['libros']], [self.libro.id])
+
+    async def test_sugerencias_async(self):
+        self.enterContext(override_settings(BIBLIOTECA_VECTORES_DIR=directorio_temporal(self)))
+        response = await self.async_client.get(f'/api/async/bibliotecario/{self.libro.id}/sugerencias/')
+        self.assertEqual(response.json()['tipo'], 'busqueda')
+        # Las sugerencias salen del índice semántico local
+        self.assertEqual(self.modelo.llamadas, 0)
+
+    async def test_llamadas_al_modelo_limitadas_por_semaforo(self):
+        await asyncio.gather(*[
+            self.async_client.post(
+                '/api/async/bibliotecario/consulta/', {'consulta': f'tema {i}'},
+                content_type='application/json'
+            )
+            for i in range(10)
+        ])
+        self.assertEqual(self.modelo.llamadas, 10)
+        self.assertLessEqual(self.modelo.max_concurrentes, 3)
+        self.assertGreater(self.modelo.max_concurrentes, 1)
+
+
+def leer_eventos(contenido):
+    eventos = []
+    for bloque in contenido.strip().split('\n\n'):
+        nombre, datos = bloque.split('\n', 1)
+        eventos.append((nombre[len('event: '):], json.loads(datos[len('data: '):])))
+    return eventos
+
+
+class StreamingTests(TestCase):
+    RESPUESTA = {
+        "tipo": "busqueda",
+        "recomendaciones": ["Cien años de soledad"],
+        "explicacion": "Te recomiendo \"Cien años\" \u00e9pico\n📚",
+        "sugerencias": ["Realismo mágico"],
+    }
+
+    def setUp(self):
+        obtener_cache().clear()
+        obtener_cache_respuestas().vaciar()
+        self.libro = crear_libro('Cien años de soledad', 'Gabriel García Márquez')
+
+    def test_extractor_entrega_texto_por_fragmentos(self):
+        texto = '```json\n' + json.dumps(self.RESPUESTA) + '\n```'
+        extractor = ExtractorIncremental()
+        deltas = []
+        for i in range(0, len(texto), 3):
+            deltas.extend(extractor.alimentar(texto[i:i + 3]))
+
+        self.assertGreater(len(deltas), 1)
+        self.assertEqual({campo for campo, _ in deltas}, {'explicacion'})
+        self.assertEqual(''.join(delta for _, delta in deltas), self.RESPUESTA['explicacion'])
+
+    def test_extractor_ignora_campos_anidados(self):
+        extractor = ExtractorIncremental()
+        deltas = extractor.alimentar('{"datos": {"respuesta": "no"}, "respuesta": "sí"}')
+        self.assertEqual(deltas, [('respuesta', 'sí')])
+
+    def test_buscar_libros_stream(self):
+        bibliotecario = BibliotecarioIA(model=ModeloFalso(respuesta=self.RESPUESTA, tamano_fragmento=5))
+        with mock.patch('biblioteca_app.views.BibliotecarioIA', return_value=bibliotecario):
+            response = APIClient().post(
+                '/api/bibliotecario/buscar_libros_stream/', {'consulta': 'realismo'}, format='json'
+            )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        eventos = leer_eventos(b''.join(response.streaming_content).decode())
+
+        textos = [datos['delta'] for nombre, datos in eventos if nombre == 'texto']
+        self.assertGreater(len(textos), 1)
+        self.assertEqual(''.join(textos), self.RESPUESTA['explicacion'])
+        nombre, final = eventos[-1]
+        self.assertEqual(nombre, 'resultado')
+        self.assertEqual([libro['id'] for libro in final['libros']], [self.libro.id])
+        self.assertEqual(final['sugerencias'], ['Realismo mágico'])
+
+    async def test_consulta_stream_async_guarda_la_consulta(self):
+        bibliotecario = BibliotecarioIA(model=ModeloFalso(respuesta=self.RESPUESTA))
+        with mock.patch.object(async_views, 'obtener_bibliotecario', lambda: bibliotecario):
+            response = await self.async_client.post(
+                '/api/async/bibliotecario/consulta_stream/', {'consulta': 'realismo'},
+                content_type='application/json'
+            )
+            contenido = ''.join([parte.decode() async for parte in response.streaming_content])
+
+        nombre, final = leer_eventos(contenido)[-1]
+        self.assertEqual(final['recomendaciones'], ['Cien años de soledad'])
+        self.assertEqual(await Consulta.objects.acount(), 1)
+
+
+class SalidaModeloTests(TestCase):
+    BUSQUEDA = {"tipo": "busqueda", "recomendaciones": ["Rayuela"], "explicacion": "Un clásico", "sugerencias": []}
+
+    # (respuesta del modelo, resultado esperado, calidad esperada)
+    CORPUS = [
+        ('{"tipo": "busqueda", "recomendaciones": ["Rayuela"], "explicacion": "Un clásico", "sugerencias": []}',
+         BUSQUEDA, 'directo'),
+        ('```json\n{"tipo": "busqueda", "recomendaciones": ["Rayuela"], "explicacion": "Un clásico"}\n```',
+         BUSQUEDA, 'extraido'),
+        ('Claro, aquí tienes: {"tipo": "busqueda", "recomendaciones": ["Rayuela"], "explicacion": "Un clásico"} ¡Que lo disfrutes!',
+         BUSQUEDA, 'extraido'),
+        ('{"tipo": "busqueda", "recomendaciones": ["Rayuela",], "explicacion": "Un clásico",}',
+         BUSQUEDA, 'extraido'),
+        ("{'tipo': 'busqueda', 'recomendaciones': ['Rayuela'], 'explicacion': 'Un clásico'}",
+         BUSQUEDA, 'extraido'),
+        ('{"tipo": "busqueda", "recomendaciones": "Rayuela", "explicacion": "Un clásico", "sugerencias": null}',
+         BUSQUEDA, 'directo'),
+        ('{"tipo": "informacion", "respuesta": "Abrimos de 9 a 18 {sin festivos}"}',
+         {"tipo": "informacion", "respuesta": "Abrimos de 9 a 18 {sin festivos}"}, 'directo'),
+        ('{"tipo": "informacion", "respuesta": "Abrimos de 9 a',
+         {"tipo": "informacion", "respuesta": "Abrimos de 9 a"}, 'reparado'),
+        ('{"tipo": "busqueda", "recomendaciones": ["Rayuela"], "explicacion": "Un clásico", "sugerencias": ["Cort',
+         {**BUSQUEDA, "sugerencias": ["Cort"]}, 'reparado'),
+        ('{"tipo": "busqueda", "recomendaciones": ["Rayuela"], "explicacion": "Un clásico", "sugerencias":',
+         BUSQUEDA, 'reparado'),
+        ('{"tipo": "reservas", "libros_disponibles": ["Rayuela"]}',
+         {"tipo": "reservas", "respuesta": "", "libros_disponibles": ["Rayuela"], "libros_no_disponibles": []}, 'directo'),
+        ('{"respuesta": "Hola"}', {"tipo": "informacion", "respuesta": "Hola"}, 'directo'),
+    ]
+
+    INVALIDAS = [
+        'Lo siento, no puedo ayudarte con eso.',
+        '',
+        '[1, 2, 3]',
+        '{"tipo": "busqueda", "explicacion": "sin recomendaciones"}',
+        '{"tipo": "desconocido"}',
+    ]
+
+    def setUp(self):
+        contadores.reiniciar()
+
+    def test_corpus_de_respuestas_malformadas(self):
+        for texto, esperado, calidad in self.CORPUS:
+            with self.subTest(texto=texto):
+                self.assertEqual(extraer_json(texto)[1], calidad)
+                resultado, cacheable = interpretar_respuesta(texto)
+                self.assertEqual(resultado, esperado)
+                # Lo reparado puede estar incompleto: no se cachea
+                self.assertEqual(cacheable, calidad != 'reparado')
+
+    def test_respuestas_invalidas_se_cuentan(self):
+        for texto in self.INVALIDAS:
+            with self.subTest(texto=texto):
+                self.assertEqual(interpretar_respuesta(texto), (None, False))
+        self.assertEqual(contadores.obtener()['respuestas_invalidas'], len(self.INVALIDAS))
+        self.assertEqual(contadores.obtener()['respuestas_modelo'], len(self.INVALIDAS))
+
+
+class ResolucionTitulosTests(TestCase):
+    def setUp(self):
+        obtener_cache().clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cien = crear_libro('Cien años de soledad')
+            self.amor = crear_libro('El amor en los tiempos del cólera')
+            self.hojarasca = crear_libro('La hojarasca', disponible=False)
+
+    def test_coincidencia_exacta_aproximada_y_por_subcadena(self):
+        indice = IndiceTitulos([(1, 'Cien años de soledad'), (2, 'El amor en los tiempos del cólera')])
+        self.assertEqual(indice.buscar('CIEN AÑOS DE SOLEDAD'), [(1, 1.0)])
+        self.assertEqual(indice.buscar('tiempos del colera'), [(2, 0.9)])
+        self.assertEqual(indice.buscar('Cien anos de soledd')[0][0], 1)
+        self.assertEqual(indice.buscar('Rayuela'), [])
+
+    def test_resuelve_en_orden_sin_duplicados_con_consultas_fijas(self):
+        titulos = ['El amor en los tiempos del colera', 'Cien años', 'Cien años de soledad', 'Inexistente']
+        resolver_libros(titulos)  # construye el índice
+        # La versión (con la caché local del proceso, de la base de datos) y los libros
+        with self.assertNumQueries(2):
+            libros = resolver_libros(titulos)
+        self.assertEqual([libro.id for libro in libros], [self.amor.id, self.cien.id])
+        self.assertEqual(libros[0].puntuacion, 1.0)
+
+    def test_filtra_por_disponibilidad(self):
+        self.assertEqual(resolver_libros(['La hojarasca'], disponible=True), [])
+        self.assertEqual(resolver_libros(['La hojarasca'], disponible=False), [self.hojarasca])
+
+    def test_indice_se_refresca_al_cambiar_el_catalogo(self):
+        resolver_libros(['Cien años de soledad'])
+        with self.captureOnCommitCallbacks(execute=True):
+            nuevo = crear_libro('Memoria de mis putas tristes')
+        self.assertEqual(resolver_libros(['Memoria de mis putas tristes']), [nuevo])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            nuevo.titulo = 'Del amor y otros demonios'
+            nuevo.save()
+        self.assertEqual(resolver_libros(['Del amor y otros demonios']), [nuevo])
+
+    def test_reservas_no_reconstruyen_el_indice(self):
+        titulos = ['Cien años de soledad']
+        resolver_libros(titulos)
+        with self.captureOnCommitCallbacks(execute=True):
+            reservar_libro(self.cien.id, 'Ana', 'ana@example.com', timezone.now() + timedelta(days=7))
+            self.amor.disponible = False
+            self.amor.save()
+        # Versión de los títulos y los libros: sin volver a leer todos los títulos
+        with self.assertNumQueries(2):
+            self.assertEqual(resolver_libros(titulos), [self.cien])
+
+
+class ReservaActivaTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.libro = crear_libro('Ficciones')
+
+    def test_reservar_y_devolver_mantienen_la_reserva_activa(self):
+        response = self.client.post(f'/api/libros/{self.libro.id}/reservar/', {
+            'usuario_nombre': 'Ana', 'usuario_email': 'ana@example.com'
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.libro.refresh_from_db()
+        self.assertEqual(self.libro.reserva_activa_id, response.data['id'])
+        self.assertFalse(self.libro.disponible)
+
+        with self.assertNumQueries(0):
+            self.assertFalse(self.libro.puede_reservarse())
+
+        self.client.post(f'/api/libros/{self.libro.id}/devolver/')
+        self.libro.refresh_from_db()
+        self.assertIsNone(self.libro.reserva_activa_id)
+        self.assertTrue(self.libro.puede_reservarse())
+
+    def test_cancelar_libera_el_libro(self):
+        reserva = crear_reserva(self.libro)
+        self.assertTrue(reserva.cancelar())
+        self.libro.refresh_from_db()
+        self.assertIsNone(self.libro.reserva_activa_id)
+
+    def test_detalle_muestra_la_reserva_activa(self):
+        reserva = crear_reserva(self.libro)
+        response = self.client.get(f'/api/libros/{self.libro.id}/')
+        self.assertEqual(response.data['reserva_activa']['id'], reserva.id)
+        self.assertEqual(response.data['reserva_activa']['libro_titulo'], 'Ficciones')
+
+    def test_no_se_puede_reservar_dos_veces(self):
+        vencimiento = timezone.now() + timedelta(days=7)
+        reserva = reservar_libro(self.libro.id, 'Ana', 'ana@example.com', vencimiento)
+        with self.assertRaises(ReservaNoDisponible):
+            reservar_libro(self.libro.id, 'Luis', 'luis@example.com', vencimiento)
+
+        response = self.client.post(f'/api/libros/{self.libro.id}/reservar/', {
+            'usuario_nombre': 'Luis', 'usuario_email': 'luis@example.com'
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Reserva.objects.filter(libro=self.libro, estado='activa').count(), 1)
+        self.libro.refresh_from_db()
+        self.assertEqual(self.libro.reserva_activa_id, reserva.id)
+
+    def test_reservar_bloquea_las_estadisticas_al_final_en_un_update(self):
+        vencimiento = timezone.now() + timedelta(days=7)
+        antes = obtener_estadisticas()
+        with CaptureQueriesContext(connection) as consultas:
+            reservar_libro(self.libro.id, 'Ana', 'ana@example.com', vencimiento)
+        sql = [q['sql'] for q in consultas.captured_queries if 'estadistica' in q['sql'].lower()]
+        self.assertEqual(len(sql), 1)
+        ultimo_update = [q['sql'] for q in consultas.captured_queries if q['sql'].startswith('UPDATE')][-1]
+        self.assertIn('estadistica', ultimo_update.lower())
+
+        despues = obtener_estadisticas()
+        self.assertEqual(despues['libros_disponibles'], antes['libros_disponibles'] - 1)
+        self.assertEqual(despues['reservas_activas'], antes['reservas_activas'] + 1)
+        self.assertEqual(dict(Estadistica.objects.values_list('nombre', 'valor')), valores_exactos())
+
+    def test_cancelar_dos_veces_solo_cierra_una(self):
+        reserva = crear_reserva(self.libro)
+        duplicada = Reserva.objects.get(pk=reserva.pk)
+        self.assertTrue(reserva.cancelar())
+        self.assertFalse(duplicada.completar())
+        self.assertEqual(Reserva.objects.get(pk=reserva.pk).estado, 'cancelada')
+
+    def test_expirar_vencidas_libera_los_libros_por_lotes(self):
+        pasado = timezone.now() - timedelta(days=1)
+        vencidas = [crear_reserva(crear_libro(f'Vencido {i}'), fecha_vencimiento=pasado) for i in range(5)]
+        vigente = crear_reserva(self.libro)
+        Libro.objects.filter(reserva_activa__isnull=False).update(disponible=False)
+
+        with CaptureQueriesContext(connection) as consultas:
+            metricas = expirar_reservas_vencidas(tamano_lote=2)
+        # Tres UPDATE por lote (reservas, libros, estadísticas), nunca uno por reserva
+        self.assertEqual(sum(q['sql'].startswith('UPDATE') for q in consultas.captured_queries), 9)
+        self.assertEqual(metricas['reservas_vencidas'], 5)
+        self.assertEqual(metricas['lotes'], 3)
+
+        self.assertEqual(Reserva.objects.filter(estado='vencida').count(), 5)
+        self.assertFalse(Libro.objects.filter(reservas__in=vencidas, disponible=False).exists())
+        self.assertFalse(Libro.objects.filter(reserva_activa__in=vencidas).exists())
+        self.libro.refresh_from_db()
+        self.assertEqual(self.libro.reserva_activa_id, vigente.id)
+
+        response = self.client.post('/api/reservas/verificar_vencidas/')
+        self.assertEqual(response.data['reservas_vencidas'], 0)
+
+    def test_bulk_cancelar_usa_consultas_constantes(self):
+        reservas = [crear_reserva(crear_libro(f'Lote {i}')) for i in range(20)]
+        Libro.objects.filter(reserva_activa__isnull=False).update(disponible=False)
+        reservas[0].completar()
+
+        # SELECT de ids + tres UPDATE (reservas, libros, estadísticas), más SAVEPOINT/RELEASE por estar dentro del TestCase
+        with self.assertNumQueries(6):
+            cantidad = Reserva.objects.filter(id__in=[r.id for r in reservas]).bulk_cancelar()
+        self.assertEqual(cantidad, 19)
+        self.assertEqual(Reserva.objects.filter(estado='cancelada').count(), 19)
+        self.assertFalse(Libro.objects.filter(reserva_activa__isnull=False).exists())
+
+    def test_completar_lote_desde_la_api(self):
+        reservas = [crear_reserva(crear_libro(f'Lote {i}')) for i in range(3)]
+        response = self.client.post('/api/reservas/completar_lote/', {
+            'ids': [r.id for r in reservas]
+        }, format='json')
+        self.assertEqual(response.data, {'reservas_completadas': 3})
+        self.assertFalse(Reserva.objects.filter(estado='completada', fecha_devolucion__isnull=True).exists())
+
+        response = self.client.post('/api/reservas/completar_lote/', {'ids': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_reconciliar_detecta_y_repara_desajustes(self):
+        reserva = crear_reserva(self.libro)
+        otro = crear_libro('El Aleph')
+        Libro.objects.filter(pk=self.libro.pk).update(reserva_activa=None)
+        Libro.objects.filter(pk=otro.pk).update(reserva_activa=reserva)
+
+        self.assertEqual(sorted(reconciliar_reservas_activas()), sorted([self.libro.id, otro.id]))
+        reconciliar_reservas_activas(reparar=True)
+        self.assertEqual(reconciliar_reservas_activas(), [])
+        self.libro.refresh_from_db()
+        self.assertEqual(self.libro.reserva_activa_id, reserva.id)
+
+
+class EstadisticasTests(TestCase):
+    def assertContadoresExactos(self):
+        valores = dict(Estadistica.objects.values_list('nombre', 'valor'))
+        self.assertEqual(valores, valores_exactos())
+        reales = dict(Libro.objects.annotate(n=Count('reservas')).values_list('id', 'n'))
+        self.assertEqual(dict(Libro.objects.values_list('id', 'num_reservas')), reales)
+
+    def test_los_contadores_siguen_las_escrituras(self):
+        recalcular_estadisticas()
+        libros = [crear_libro(f'Contado {i}') for i in range(4)]
+        vencimiento = timezone.now() + timedelta(days=14)
+        reservas = [reservar_libro(libro.id, 'Ana', 'ana@example.com', vencimiento) for libro in libros]
+        self.assertContadoresExactos()
+
+        reservas[0].cancelar()
+        Reserva.objects.filter(pk=reservas[1].pk).bulk_completar()
+        Reserva.objects.filter(pk=reservas[2].pk).update(fecha_vencimiento=timezone.now() - timedelta(days=1))
+        expirar_reservas_vencidas()
+        self.assertContadoresExactos()
+
+        reserva = Reserva.objects.get(pk=reservas[0].pk)
+        reserva.estado = 'completada'
+        reserva.save()
+        libro = Libro.objects.get(pk=libros[3].pk)
+        libro.disponible = True
+        libro.save()
+        reservas[3].delete()
+        libros[2].delete()
+        self.assertContadoresExactos()
+
+        datos = obtener_estadisticas()
+        self.assertEqual(datos['total_libros'], 3)
+        self.assertEqual(datos['reservas_activas'], 0)
+        self.assertEqual(datos['libros_populares'][0]['num_reservas'], 1)
+
+    def test_recalcular_corrige_la_deriva(self):
+        libro = crear_libro('Popular')
+        for _ in range(3):
+            crear_reserva(libro, estado='completada')
+        crear_reserva(crear_libro('Menos popular'), estado='cancelada')
+        # bulk_create no pasa por las señales
+        Libro.objects.bulk_create([Libro(titulo='Sin contar', autor='A', isbn=str(next(_isbns)),
+                                         sinopsis='', fecha_publicacion=date(2000, 1, 1))])
+
+        resultado = recalcular_estadisticas()
+        self.assertEqual(resultado['deriva'], {'libros': 1, 'libros_disponibles': 1})
+        self.assertEqual(resultado['libros_corregidos'], 0)
+        self.assertContadoresExactos()
+
+        Libro.objects.filter(pk=libro.pk).update(num_reservas=0)
+        self.assertEqual(recalcular_estadisticas()['libros_corregidos'], 1)
+
+        with self.assertNumQueries(2):
+            datos = obtener_estadisticas()
+        self.assertEqual([l['titulo'] for l in datos['libros_populares']], ['Popular', 'Menos popular'])
+        self.assertEqual(datos['libros_populares'][0]['num_reservas'], 3)
+        self.assertEqual(datos['reservas_completadas'], 3)
+
+
+class SeriesTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.ahora = timezone.now()
+        self.hoy = timezone.localdate(self.ahora)
+        categoria = Categoria.objects.create(nombre='Novela')
+        libro = crear_libro('Con categoría', categoria=categoria)
+
+        def reserva(libro, hace, vence, devuelta=None, estado='completada'):
+            r = crear_reserva(libro, estado=estado)
+            Reserva.objects.filter(pk=r.pk).update(
+                fecha_reserva=self.ahora - timedelta(days=hace),
+                fecha_vencimiento=self.ahora - timedelta(days=vence),
+                fecha_devolucion=None if devuelta is None else self.ahora - timedelta(days=devuelta),
+            )
+
+        reserva(libro, hace=10, vence=3, devuelta=2)   # devuelta tarde
+        reserva(libro, hace=10, vence=5, devuelta=8)   # devuelta a tiempo
+        reserva(libro, hace=9, vence=4, estado='vencida')
+        crear_reserva(crear_libro('Sin categoría'))
+        self.categoria = categoria
+
+    def test_agrega_el_historial_por_dia_y_categoria(self):
+        resultado = actualizar_series(ahora=self.ahora)
+        self.assertEqual(resultado['dias_cerrados'], 10)
+
+        dia = ReservaDiaria.objects.get(dia=self.hoy - timedelta(days=10), categoria=self.categoria)
+        self.assertEqual(dia.reservas, 2)
+        self.assertTrue(dia.cerrado)
+        self.assertEqual(ReservaDiaria.objects.get(dia=self.hoy - timedelta(days=8)).segundos_prestamo, 2 * 86400)
+        self.assertEqual(ReservaDiaria.objects.get(dia=self.hoy - timedelta(days=3)).atrasadas, 1)
+        self.assertEqual(ReservaDiaria.objects.get(dia=self.hoy - timedelta(days=5)).atrasadas, 0)
+        hoy = ReservaDiaria.objects.get(dia=self.hoy)
+        self.assertIsNone(hoy.categoria_id)
+        self.assertFalse(hoy.cerrado)
+
+        # Pasadas siguientes: solo el día abierto, y al cambiar de día se cierra
+        self.assertEqual(actualizar_series(ahora=self.ahora)['dias_cerrados'], 0)
+        crear_reserva(crear_libro('Otra más'))
+        self.assertEqual(actualizar_series(ahora=self.ahora + timedelta(days=1))['dias_cerrados'], 1)
+        self.assertEqual(ReservaDiaria.objects.get(dia=self.hoy).reservas, 2)
+        self.assertTrue(ReservaDiaria.objects.get(dia=self.hoy).cerrado)
+
+    def test_categoria_creada_tras_leer_la_lista(self):
+        # Simula una categoría creada después de leer Categoria: no debe descuadrar las posiciones
+        categorias = mock.Mock()
+        categorias.objects.values_list.return_value = []
+        with mock.patch('biblioteca_app.series.Categoria', categorias):
+            filas = agregar_dias(self.hoy - timedelta(days=10), self.hoy, ahora=self.ahora)
+        dia = [f for f in filas if f.dia == self.hoy - timedelta(days=10) and f.categoria_id == self.categoria.id]
+        self.assertEqual(dia[0].reservas, 2)
+
+        agregado = series._Agregado(self.hoy, 1, [self.categoria.id])
+        with self.assertRaises(ValueError):
+            agregado.sumar('reservas', np.array([self.hoy.toordinal()]), [self.categoria.id + 1])
+
+    def test_endpoint_series_por_semana(self):
+        actualizar_series(ahora=self.ahora)
+        response = self.client.get('/api/bibliotecario/estadisticas/series/', {
+            'desde': (self.hoy - timedelta(days=30)).isoformat(), 'hasta': self.hoy.isoformat(),
+            'intervalo': 'semana', 'categoria': self.categoria.id,
+        })
+        self.assertEqual(response.status_code, 200)
+        series = response.data['series']
+        self.assertEqual(sum(p['reservas'] for p in series), 3)
+        self.assertEqual(sum(p['atrasadas'] for p in series), 2)
+        self.assertTrue(all(p['categoria'] == 'Novela' for p in series))
+        self.assertTrue(all(date.fromisoformat(p['periodo']).weekday() == 0 for p in series))
+        devoluciones = [p for p in series if p['devoluciones']]
+        self.assertTrue(all(p['duracion_media_dias'] for p in devoluciones))
+
+        response = self.client.get('/api/bibliotecario/estadisticas/series/', {'intervalo': 'mes'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ImportacionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        reconstruir_indice()
+
+    def fila(self, isbn, **kwargs):
+        datos = {
+            'titulo': f'Libro {isbn}', 'autor': 'Autor', 'fecha_publicacion': '2001-02-03',
+            'isbn': isbn, 'sinopsis': 'Una historia', 'categoria': 'Ensayo',
+        }
+        datos.update(kwargs)
+        return json.dumps(datos)
+
+    def test_importa_ndjson_por_lotes_con_upsert_y_errores(self):
+        existente = crear_libro('Título viejo')
+        lineas = [
+            self.fila('1000000000001'),
+            self.fila(existente.isbn, titulo='Título nuevo'),
+            self.fila('1000000000002', fecha_publicacion='ayer'),
+            'no es json',
+            self.fila('1000000000003', titulo='Cometa lejano'),
+        ]
+        response = self.client.post(
+            '/api/libros/importar/?lote=2', '\n'.join(lineas), content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['creados'], response.data['actualizados'], response.data['errores']), (2, 1, 2))
+        self.assertEqual(len(response.data['lotes']), 3)
+        self.assertEqual(response.data['lotes'][1]['detalle'][0]['fila'], 3)
+        self.assertIn('fecha_publicacion', response.data['lotes'][1]['detalle'][0]['errores'])
+
+        existente.refresh_from_db()
+        self.assertEqual(existente.titulo, 'Título nuevo')
+        self.assertEqual(Categoria.objects.filter(nombre='Ensayo').count(), 1)
+        # Los libros importados quedan en el índice de texto completo
+        response = self.client.get('/api/libros/', {'q': 'cometa'})
+        self.assertEqual([l['isbn'] for l in response.data['results']], ['1000000000003'])
+
+    def test_importa_csv(self):
+        contenido = (
+            'titulo,autor,fecha_publicacion,isbn,sinopsis,paginas\n'
+            'Rayuela,Julio Cortázar,1963-06-28,2000000000001,Una novela,600\n'
+            'Sin fecha,Anónimo,,2000000000002,Nada,\n'
+        )
+        response = self.client.post('/api/libros/importar/', contenido, content_type='text/csv')
+        self.assertEqual((response.data['creados'], response.data['errores']), (1, 1))
+        self.assertEqual(Libro.objects.get(isbn='2000000000001').paginas, 600)
+
+    def test_lote_invalido(self):
+        linea = json.dumps({'titulo': 'Ficciones', 'autor': 'Borges', 'fecha_publicacion': '1944-01-01',
+                            'isbn': '3000000000001', 'sinopsis': 'Cuentos'})
+        for lote in ('dos', '0', '-5', '10001'):
+            response = self.client.post(
+                f'/api/libros/importar/?lote={lote}', linea, content_type='application/x-ndjson'
+            )
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Libro.objects.filter(isbn='3000000000001').exists())
+
+    def test_utf8_invalido_se_informa_en_el_lote(self):
+        cuerpo = b'\n'.join([
+            self.fila('4000000000001').encode(), b'{"titulo": "\xff"}', self.fila('4000000000002').encode()
+        ])
+        response = self.client.post('/api/libros/importar/', cuerpo, content_type='application/x-ndjson')
+        self.assertEqual((response.data['creados'], response.data['errores']), (2, 1))
+
+        cuerpo = (
+            'titulo,autor,fecha_publicacion,isbn,sinopsis\n'
+            'Rayuela,Julio Cortázar,1963-06-28,4000000000003,Una novela\n'
+        ).encode() + b'Mal,\xff,1963-06-28,4000000000004,Nada\n' + b'Otra,Autora,1990-01-01,4000000000005,Algo\n'
+        response = self.client.post('/api/libros/importar/', cuerpo, content_type='text/csv')
+        self.assertEqual((response.data['creados'], response.data['errores']), (2, 1))
+
+    def test_csv_mal_formado_se_informa_en_el_lote(self):
+        contenido = (
+            'titulo,autor,fecha_publicacion,isbn,sinopsis\n'
+            'Roto,Aut\ror,1963-06-28,5000000000001,Nada\n'
+            'Bien,Autora,1990-01-01,5000000000002,Algo\n'
+        )
+        response = self.client.post('/api/libros/importar/', contenido, content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['creados'], response.data['errores']), (1, 1))
+
+    def test_categoria_con_digitos_no_decimales(self):
+        response = self.client.post(
+            '/api/libros/importar/', self.fila('6000000000001', categoria='²'), content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Libro.objects.get(isbn='6000000000001').categoria.nombre, '²')
+
+    def test_los_lotes_escritos_se_invalidan_aunque_falle_uno_posterior(self):
+        importar_lote = importacion._importar_lote
+        llamadas = []
+
+        def fallar_en_el_segundo(*args):
+            llamadas.append(args)
+            if len(llamadas) > 1:
+                raise DatabaseError('conexión perdida')
+            return importar_lote(*args)
+
+        version = version_catalogo()
+        with mock.patch.object(importacion, '_importar_lote', side_effect=fallar_en_el_segundo):
+            with self.captureOnCommitCallbacks(execute=True), self.assertRaises(DatabaseError):
+                importar_libros(leer_ndjson([self.fila('7000000000001'), self.fila('7000000000002')]), tamano_lote=1)
+        self.assertTrue(Libro.objects.filter(isbn='7000000000001').exists())
+        self.assertNotEqual(version_catalogo(), version)
+
+
+class ExportacionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        categoria = Categoria.objects.create(nombre='Cuento')
+        self.libros = [crear_libro('Ficciones', categoria=categoria), crear_libro('El Aleph')]
+        crear_reserva(self.libros[0])
+
+    def test_exporta_libros_en_ndjson_de_forma_incremental(self):
+        response = self.client.get('/api/libros/export/')
+        self.assertTrue(response.streaming)
+        filas = [json.loads(linea) for linea in b''.join(response.streaming_content).decode().splitlines()]
+        # Ordenadas por última modificación: reservar Ficciones la actualizó después
+        self.assertEqual([f['titulo'] for f in filas], ['El Aleph', 'Ficciones'])
+        self.assertEqual(filas[1]['nombre_categoria'], 'Cuento')
+
+        with override_settings(BIBLIOTECA_EXPORTACION_MARGEN=0):
+            marca = self.client.get('/api/libros/export/')['X-Export-Watermark']
+        Libro.objects.filter(pk=self.libros[1].pk).update(paginas=99)
+        response = self.client.get('/api/libros/export/', {'since': marca})
+        filas = [json.loads(linea) for linea in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(f['titulo'], f['paginas']) for f in filas], [('El Aleph', 99)])
+
+    def test_la_marca_deja_margen_para_confirmaciones_tardias(self):
+        response = self.client.get('/api/libros/export/')
+        b''.join(response.streaming_content)
+        marca = parse_datetime(response['X-Export-Watermark'])
+        self.assertLessEqual(marca, timezone.now() - timedelta(seconds=59))
+        # Una transacción fechó la fila antes de la exportación y confirmó después
+        Libro.objects.filter(pk=self.libros[1].pk).update(
+            paginas=7, fecha_actualizacion=timezone.now() - timedelta(seconds=30)
+        )
+        response = self.client.get('/api/libros/export/', {'since': response['X-Export-Watermark']})
+        filas = [json.loads(linea) for linea in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertIn(('El Aleph', 7), [(f['titulo'], f['paginas']) for f in filas])
+
+    def test_exporta_reservas_en_csv(self):
+        response = self.client.get('/api/reservas/export/', {'formato': 'csv'})
+        lineas = b''.join(response.streaming_content).decode().splitlines()
+        self.assertTrue(lineas[0].startswith('id,libro_id,libro_titulo'))
+        self.assertEqual(len(lineas), 2)
+        self.assertIn('Ficciones', lineas[1])
+
+        response = self.client.get('/api/reservas/export/', {'since': 'ayer'})
+        self.assertEqual(response.status_code, 400)
+
+
+class PaginacionKeysetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        obtener_cache().clear()
+        self.libros = [crear_libro(f'Libro {i}') for i in range(7)]
+        # Empates en fecha_creacion: el id desempata
+        Libro.objects.filter(id__in=[l.id for l in self.libros[2:5]]).update(
+            fecha_creacion=self.libros[2].fecha_creacion
+        )
+
+    def test_recorre_todas_las_paginas_sin_repetir_ni_saltar(self):
+        vistos = []
+        url = '/api/libros/?paginacion=keyset&page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            vistos += [libro['id'] for libro in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(vistos, [l.id for l in self.libros])
+
+    def test_tamano_de_pagina_limitado_y_conteo_aproximado(self):
+        with override_settings(PAGINACION_MAX_TAMANO=5):
+            response = self.client.get('/api/libros/', {'paginacion': 'keyset', 'page_size': 50, 'contar': 'aprox'})
+            self.assertEqual(len(response.data['results']), 5)
+            self.assertEqual((response.data['count'], response.data['count_exacto']), (7, True))
+
+            response = self.client.get('/api/libros/', {'page_size': 50})
+            self.assertEqual(len(response.data['results']), 5)
+            self.assertEqual(response.data['count'], 7)
+
+    def test_cursor_invalido(self):
+        response = self.client.get('/api/libros/', {'cursor': 'no-es-un-cursor'})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/api/libros/', {'cursor': codificar_cursor(['ayer', 1])})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(PAGINACION_MAX_TAMANO=1000)
+class NumeroConsultasTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categorias = Categoria.objects.bulk_create([Categoria(nombre=f'Categoría {i}') for i in range(5)])
+        libros = Libro.objects.bulk_create([
+            Libro(titulo=f'Libro {i}', autor='Autor', sinopsis='', isbn=f'4{i:012d}',
+                  fecha_publicacion=date(2000, 1, 1), categoria=categorias[i % 5])
+            for i in range(1000)
+        ])
+        Reserva.objects.bulk_create([
+            Reserva(libro=libro, usuario_nombre='Ana', usuario_email='ana@example.com',
+                    fecha_vencimiento=timezone.now() + timedelta(days=7))
+            for libro in libros
+        ])
+        reconciliar_reservas_activas(reparar=True)
+        Consulta.objects.bulk_create([Consulta(texto=f'Consulta {i}') for i in range(1000)])
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_listados_con_numero_fijo_de_consultas(self):
+        for tamano in (10, 100, 1000):
+            for url in ('/api/libros/', '/api/reservas/', '/api/consultas/'):
+                with self.subTest(url=url, tamano=tamano):
+                    # Los libros leen además la versión del catálogo para el ETag
+                    version = 1 if url == '/api/libros/' else 0
+                    # COUNT + página
+                    with self.assertNumQueries(2 + version):
+                        response = self.client.get(url, {'page_size': tamano})
+                    self.assertEqual(len(response.data['results']), tamano)
+                    # Por clave: solo la página
+                    with self.assertNumQueries(1 + version):
+                        self.client.get(url, {'page_size': tamano, 'paginacion': 'keyset'})
+
+    def test_detalle_con_una_consulta(self):
+        libro = Libro.objects.first()
+        # Versión del catálogo (ETag) + el libro con su reserva
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/libros/{libro.id}/')
+        self.assertEqual(response.data['reserva_activa']['libro_titulo'], libro.titulo)
+        with self.assertNumQueries(1):
+            self.client.get(f'/api/reservas/{libro.reserva_activa_id}/')
+
+    def test_listado_rapido_igual_que_el_serializer_completo(self):
+        response = self.client.get('/api/libros/', {'page_size': 3, 'paginacion': 'keyset'})
+        libros = Libro.objects.filter(id__in=[l['id'] for l in response.data['results']]).order_by('fecha_creacion', 'id')
+        esperado = json.loads(json.dumps(LibroSerializer(libros, many=True).data))
+        self.assertEqual(json.loads(response.content), {'next': response.data['next'], 'results': esperado})
+
+
+class BusquedaSemanticaTests(TestCase):
+    def setUp(self):
+        self.enterContext(override_settings(BIBLIOTECA_VECTORES_DIR=directorio_temporal(self)))
+        obtener_cache().clear()
+        self.client = APIClient()
+        self.oceano = crear_libro('El océano infinito', sinopsis='Un viaje por el mar, las olas y los barcos')
+        self.marinero = crear_libro('Memorias de un marinero', sinopsis='Barcos, tormentas y olas en alta mar')
+        self.cocina = crear_libro('Cocina mexicana', sinopsis='Recetas de tacos, salsas y tortillas')
+        call_command('reconstruir_indice_vectorial', stdout=io.StringIO())
+
+    def test_busca_por_contenido(self):
+        libros = buscar_semantico('historias de barcos en el mar', k=2)
+        self.assertEqual({l.id for l in libros}, {self.oceano.id, self.marinero.id})
+        self.assertTrue(all(0 < l.puntuacion <= 1 for l in libros))
+
+        response = self.client.get('/api/libros/semantica/', {'q': 'recetas de tacos'})
+        self.assertEqual(response.data[0]['id'], self.cocina.id)
+
+    def test_similares_excluye_el_propio_libro(self):
+        self.assertEqual([l.id for l in libros_similares(self.oceano.id, k=1)], [self.marinero.id])
+        sugerencias = BibliotecarioIA(model=ModeloFalso()).obtener_sugerencias(self.oceano.id, k=1)
+        self.assertEqual(sugerencias['recomendaciones'], ['Memorias de un marinero'])
+
+    def test_cambios_en_el_catalogo_sin_reconstruir(self):
+        obtener_indice_vectorial()
+        with self.captureOnCommitCallbacks(execute=True):
+            nuevo = crear_libro('Tacos al pastor', sinopsis='Tacos, salsas y tortillas de maíz')
+            self.cocina.sinopsis = 'Guisos de la abuela'
+            self.cocina.save()
+        self.assertEqual([l.id for l in buscar_semantico('tacos y tortillas', k=1)], [nuevo.id])
+
+    def test_busqueda_en_lote(self):
+        indice = obtener_indice_vectorial()
+        consultas = indice.embedder.vectorizar(['barcos y olas', 'recetas de tacos'])
+        resultados = indice.buscar_vectores(consultas, k=1)
+        self.assertEqual([r[0][0] for r in resultados], [self.oceano.id, self.cocina.id])
+
+    def test_sin_indice_no_se_construye_en_la_peticion(self):
+        with override_settings(BIBLIOTECA_VECTORES_DIR=directorio_temporal(self)):
+            response = self.client.get('/api/libros/semantica/', {'q': 'barcos'})
+            self.assertEqual(response.status_code, 503)
+            with self.assertRaises(IndiceNoConstruido):
+                obtener_indice_vectorial()
+            self.assertEqual(libros_similares(self.oceano.id), [])
+
+    def test_k_no_numerico(self):
+        response = self.client.get('/api/libros/semantica/', {'q': 'barcos', 'k': 'diez'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_libros_borrados_no_se_devuelven(self):
+        obtener_indice_vectorial()
+        marinero_id = self.marinero.id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.marinero.delete()
+        indice = obtener_indice_vectorial()
+        self.assertEqual([i for i, _ in indice.similares(self.oceano.id, k=5)], [])
+        self.assertIsNone(indice.vector_de(marinero_id))
+
+    def test_reservas_no_sincronizan_el_indice(self):
+        obtener_indice_vectorial()
+        sincronizados = contadores.obtener().get('vectores_sincronizados', 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            crear_reserva(self.oceano)
+        obtener_indice_vectorial()
+        self.assertEqual(contadores.obtener().get('vectores_sincronizados', 0), sincronizados)
+
+    def test_fusiona_los_cambios_pasado_el_umbral(self):
+        indice = obtener_indice_vectorial()
+        with mock.patch.object(vectores, 'UMBRAL_DELTA', 2):
+            with self.captureOnCommitCallbacks(execute=True):
+                nuevo = crear_libro('Tacos al pastor', sinopsis='Tacos, salsas y tortillas de maíz')
+                self.cocina.sinopsis = 'Guisos de la abuela'
+                self.cocina.save()
+            obtener_indice_vectorial()
+        self.assertEqual(indice._delta, {})
+        self.assertEqual(indice.ids.tolist(), sorted([self.oceano.id, self.marinero.id, self.cocina.id, nuevo.id]))
+        self.assertEqual([l.id for l in buscar_semantico('tacos y tortillas', k=1)], [nuevo.id])
+
+
+class LibrosSimilaresTests(TestCase):
+    def setUp(self):
+        self.enterContext(override_settings(BIBLIOTECA_VECTORES_DIR=directorio_temporal(self)))
+        obtener_cache().clear()
+        obtener_cache_respuestas().vaciar()
+        self.poesia = Categoria.objects.create(nombre='Poesía')
+        self.veinte = crear_libro('Veinte poemas de amor', 'Pablo Neruda', sinopsis='Poemas de amor', categoria=self.poesia)
+        self.canto = crear_libro('Canto general', 'Pablo Neruda', sinopsis='Historia de América en verso')
+        self.rayuela = crear_libro('Rayuela', 'Julio Cortázar', sinopsis='Novela experimental en París')
+        self.odas = crear_libro('Odas elementales', 'Otro', sinopsis='Poemas sencillos', categoria=self.poesia)
+        self.cocina = crear_libro('Cocina fácil', 'Chef', sinopsis='Recetas')
+        call_command('reconstruir_indice_vectorial', stdout=io.StringIO())
+
+    def test_combina_autor_categoria_texto_y_coreservas(self):
+        for libro in (self.rayuela, self.cocina):
+            crear_reserva(libro, estado='completada')
+        self.assertEqual(calcular_similares(k=3), 5)
+        vecinos = libros_vecinos(self.veinte.id)
+        # Mismo autor y misma categoría + "poemas" en la sinopsis
+        self.assertEqual({l.id for l in vecinos[:2]}, {self.canto.id, self.odas.id})
+        self.assertNotIn(self.veinte.id, [l.id for l in vecinos])
+        # Sin nada en común salvo que los reservó el mismo lector
+        self.assertEqual(libros_vecinos(self.rayuela.id)[0].id, self.cocina.id)
+
+    def test_actualizacion_incremental(self):
+        calcular_similares()
+        self.assertEqual(actualizar_similares(), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cocina.sinopsis = 'Poemas de amor para cocinar'
+            self.cocina.save()
+        # El libro cambiado y los que lo tenían de vecino
+        self.assertGreaterEqual(actualizar_similares(), 1)
+        self.assertIn(self.veinte.id, [l.id for l in libros_vecinos(self.cocina.id)])
+
+    def test_sugerencias_desde_la_tabla_sin_llamar_al_modelo(self):
+        calcular_similares()
+        modelo = ModeloFalso(respuesta='Comparten autor y tono.')
+        bibliotecario = BibliotecarioIA(model=modelo)
+        with self.assertNumQueries(2):
+            resultado = bibliotecario.obtener_sugerencias(self.veinte.id, k=2)
+        self.assertEqual(len(resultado['libros']), 2)
+        self.assertEqual(modelo.llamadas, 0)
+        # El modelo solo redacta la explicación si se pide
+        resultado = bibliotecario.obtener_sugerencias(self.veinte.id, k=2, explicar=True)
+        self.assertEqual(resultado['explicacion'], 'Comparten autor y tono.')
+        self.assertEqual(modelo.llamadas, 1)
+
+
+class BenchmarkSuiteTests(TestCase):
+    def test_generar_reservas_deja_el_catalogo_coherente(self):
+        generar_catalogo(50, num_categorias=2, semilla=7)
+        libro_ids = list(Libro.objects.values_list('id', flat=True))
+        self.assertEqual(generar_reservas(libro_ids, 300, semilla=7), 305)
+        activas = Reserva.objects.filter(estado='activa')
+        self.assertEqual(set(activas.values_list('libro_id', flat=True)),
+                         set(Libro.objects.filter(disponible=False).values_list('id', flat=True)))
+        # La historia se reparte en el pasado en lugar de quedarse en la fecha de inserción
+        self.assertLess(Reserva.objects.order_by('fecha_reserva').first().fecha_reserva,
+                        timezone.now() - timedelta(days=30))
+        self.assertTrue(activas.filter(fecha_vencimiento__lt=timezone.now()).exists())
+
+    def test_suite_escribe_json(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            salida = f'{directorio}/benchmark.json'
+            call_command(
+                'benchmark_suite', libros=60, reservas=200, repeticiones=3, calentamiento=1,
+                salida=salida, en_transaccion=True, stdout=io.StringIO(),
+            )
+            with open(salida) as f:
+                resultado = json.load(f)
+        self.assertEqual(resultado['parametros']['libros'], 60)
+        self.assertIn('reservar', resultado['escenarios'])
+        for medida in resultado['escenarios'].values():
+            self.assertLessEqual(medida['p50_ms'], medida['p99_ms'])
+        self.assertEqual(resultado['escenarios']['estadisticas']['consultas'], 2)
+        self.assertEqual(resultado['escenarios']['libros_lista_cache']['consultas'], 1)
+        # Todo se revierte al terminar
+        self.assertFalse(Libro.objects.exists())
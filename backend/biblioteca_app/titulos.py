@@ -0,0 +1,131 @@
+"""
+Resolución de títulos recomendados por el modelo a libros del catálogo.
+
+Mantiene en memoria un índice de títulos normalizados (minúsculas, sin acentos
+ni puntuación) con una lista invertida de trigramas. Con él toda la lista de
+recomendaciones se resuelve sin consultas por título: una consulta para
+reconstruir el índice cuando cambia la versión de los títulos (solo al crear,
+renombrar o borrar libros; las reservas no la tocan) y otra para leer los
+libros encontrados.
+"""
+import threading
+from collections import Counter, defaultdict
+
+from .cache_catalogo import version_titulos
+from .cache_respuestas import normalizar_consulta
+
+# Similitud mínima para aceptar una coincidencia aproximada
+UMBRAL_SIMILITUD = 0.5
+
+# Puntuación de una coincidencia por subcadena (el título del catálogo contiene el buscado)
+PUNTUACION_SUBCADENA = 0.9
+
+
+def trigramas(texto):
+    texto = f'  {texto} '
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceTitulos:
+    def __init__(self, libros):
+        """`libros` es un iterable de pares (id, titulo)"""
+        self.titulos = {}
+        self.exactos = defaultdict(list)
+        self.por_trigrama = defaultdict(list)
+        self.num_trigramas = {}
+        for libro_id, titulo in libros:
+            normalizado = normalizar_consulta(titulo)
+            self.titulos[libro_id] = normalizado
+            self.exactos[normalizado].append(libro_id)
+            grams = trigramas(normalizado)
+            self.num_trigramas[libro_id] = len(grams)
+            for gram in grams:
+                self.por_trigrama[gram].append(libro_id)
+
+    def buscar(self, titulo, umbral=UMBRAL_SIMILITUD):
+        """Devuelve [(libro_id, puntuacion)] ordenado de mayor a menor puntuación"""
+        normalizado = normalizar_consulta(titulo)
+        if not normalizado:
+            return []
+
+        exactos = self.exactos.get(normalizado)
+        if exactos:
+            return [(libro_id, 1.0) for libro_id in exactos]
+
+        grams = trigramas(normalizado)
+        compartidos = Counter()
+        for gram in grams:
+            compartidos.update(self.por_trigrama.get(gram, ()))
+
+        candidatos = []
+        for libro_id, comunes in compartidos.items():
+            # Similitud de Jaccard entre los conjuntos de trigramas
+            puntuacion = comunes / (len(grams) + self.num_trigramas[libro_id] - comunes)
+            if normalizado in self.titulos[libro_id]:
+                puntuacion = max(puntuacion, PUNTUACION_SUBCADENA)
+            if puntuacion >= umbral:
+                candidatos.append((libro_id, round(puntuacion, 3)))
+        candidatos.sort(key=lambda c: (-c[1], c[0]))
+        return candidatos
+
+    def resolver(self, titulos, umbral=UMBRAL_SIMILITUD):
+        """
+        Resuelve una lista de títulos en orden de recomendación, sin duplicados.
+
+        Devuelve [(libro_id, puntuacion)]: primero las coincidencias del primer
+        título, luego las del segundo, etc.
+        """
+        vistos = set()
+        resultado = []
+        for titulo in titulos:
+            for libro_id, puntuacion in self.buscar(titulo, umbral):
+                if libro_id not in vistos:
+                    vistos.add(libro_id)
+                    resultado.append((libro_id, puntuacion))
+        return resultado
+
+
+_indice = None
+_indice_version = None
+_indice_lock = threading.Lock()
+
+
+def obtener_indice_titulos():
+    """Índice del proceso, reconstruido cuando cambia la versión de los títulos"""
+    global _indice, _indice_version
+    from .models import Libro
+
+    version = version_titulos()
+    with _indice_lock:
+        if _indice is None or _indice_version != version:
+            _indice = IndiceTitulos(Libro.objects.values_list('id', 'titulo').iterator(chunk_size=5000))
+            _indice_version = version
+        return _indice
+
+
+def resolver_libros(titulos, **filtros):
+    """
+    Devuelve los libros que corresponden a `titulos`, en orden y sin duplicados.
+
+    Cada libro lleva el atributo `puntuacion` con la similitud del título. Los
+    `filtros` (p. ej. disponible=True) se aplican en la consulta que lee los libros.
+    """
+    from .models import Libro
+
+    if not titulos:
+        return []
+    coincidencias = obtener_indice_titulos().resolver(titulos)
+    if not coincidencias:
+        return []
+
+    libros = Libro.objects.filter(**filtros).select_related('categoria').in_bulk(
+        [libro_id for libro_id, _ in coincidencias]
+    )
+    resultado = []
+    for libro_id, puntuacion in coincidencias:
+        libro = libros.get(libro_id)
+        if libro is None:
+            continue
+        libro.puntuacion = puntuacion
+        resultado.append(libro)
+    return resultado
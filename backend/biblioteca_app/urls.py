@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import views, async_views
 
 router = DefaultRouter()
 router.register(r'libros', views.LibroViewSet)
@@ -9,6 +9,17 @@ router.register(r'bibliotecario', views.BibliotecarioViewSet, basename='bibliote
 router.register(r'consultas', views.ConsultaViewSet)
 router.register(r'reservas', views.ReservaViewSet)
 
+# Variantes asíncronas del asistente (servidas por ASGI)
+async_urlpatterns = [
+    path('bibliotecario/consulta/', async_views.consulta, name='bibliotecario-async-consulta'),
+    path('bibliotecario/buscar_libros/', async_views.buscar_libros, name='bibliotecario-async-buscar-libros'),
+    path('bibliotecario/consulta_stream/', async_views.consulta_stream, name='bibliotecario-async-consulta-stream'),
+    path('bibliotecario/buscar_libros_stream/', async_views.buscar_libros_stream,
+         name='bibliotecario-async-buscar-libros-stream'),
+    path('bibliotecario/<int:pk>/sugerencias/', async_views.sugerencias, name='bibliotecario-async-sugerencias'),
+]
+
 urlpatterns = [
+    path('async/', include(async_urlpatterns)),
     path('', include(router.urls)),
 ]
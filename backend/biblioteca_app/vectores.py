@@ -0,0 +1,435 @@
+"""
+Búsqueda semántica local sobre título, autor y sinopsis.
+
+Cada libro se convierte en un vector normalizado con un "embedder"
+intercambiable: por defecto un vectorizador por hashing de términos sin
+dependencias, u opcionalmente un modelo local de sentence-transformers
+(BIBLIOTECA_EMBEDDER = 'sentence-transformers'). La matriz de vectores se
+guarda en disco como .npy y se abre con memory-map, así varios procesos
+comparten las mismas páginas y el arranque no lee el archivo entero.
+
+La matriz se construye con el comando reconstruir_indice_vectorial (nunca
+dentro de una petición): mientras no exista, obtener_indice_vectorial() lanza
+IndiceNoConstruido. Entre reconstrucciones, cuando cambia la versión de los
+textos (version_textos), los libros modificados después de la marca de la
+matriz (Libro.fecha_actualizacion) se vectorizan en memoria y sustituyen a su
+fila del archivo, y los borrados dejan de devolverse. Pasadas UMBRAL_DELTA
+filas en memoria se fusionan con la matriz.
+"""
+import json
+import math
+import os
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import timedelta
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+from .busqueda import tokenizar
+from .cache_catalogo import contadores, version_textos
+
+# Filas de la matriz que se multiplican de una vez al buscar
+TAMANO_BLOQUE = 65536
+
+# Margen al sincronizar por fecha_actualizacion, por transacciones que confirman tarde
+MARGEN_SINCRONIZACION = timedelta(seconds=5)
+
+# Libros vectorizados en memoria a partir de los cuales se fusionan con la matriz
+UMBRAL_DELTA = 5000
+
+PALABRAS_VACIAS = {
+    'el', 'la', 'los', 'las', 'un', 'una', 'unos', 'unas', 'de', 'del', 'al', 'y', 'o', 'en',
+    'que', 'se', 'su', 'sus', 'con', 'por', 'para', 'como', 'es', 'lo', 'le', 'les', 'mas',
+    'pero', 'sin', 'sobre', 'entre', 'este', 'esta', 'ese', 'esa', 'son', 'fue', 'ha', 'the', 'of', 'and',
+}
+
+
+def documento(titulo, autor, sinopsis):
+    """Texto que se vectoriza por libro; el título se repite para darle más peso"""
+    return f"{titulo}\n{titulo}\n{autor}\n{sinopsis or ''}"
+
+
+class EmbedderHashing:
+    """
+    Vectorizador por hashing de términos y bigramas (sin dependencias ni
+    entrenamiento). Usa crc32 porque hash() cambia entre procesos.
+    """
+
+    def __init__(self, dimension=512):
+        self.dimension = dimension
+        self.nombre = f'hashing-{dimension}'
+
+    def vectorizar(self, textos):
+        matriz = np.zeros((len(textos), self.dimension), dtype=np.float32)
+        for fila, texto in enumerate(textos):
+            terminos = [t for t in tokenizar(texto) if t not in PALABRAS_VACIAS and len(t) > 1]
+            caracteristicas = terminos + [f'{a} {b}' for a, b in zip(terminos, terminos[1:])]
+            for caracteristica, veces in Counter(caracteristicas).items():
+                h = zlib.crc32(caracteristica.encode('utf-8'))
+                signo = 1.0 if h & 0x80000000 else -1.0
+                matriz[fila, h % self.dimension] += signo * (1.0 + math.log(veces))
+        return _normalizar(matriz)
+
+
+class EmbedderSentenceTransformers:
+    """Modelo local en CPU de sentence-transformers (dependencia opcional)"""
+
+    def __init__(self, modelo='paraphrase-multilingual-MiniLM-L12-v2'):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "BIBLIOTECA_EMBEDDER='sentence-transformers' requiere instalar sentence-transformers"
+            ) from e
+        self.modelo = SentenceTransformer(modelo, device='cpu')
+        self.dimension = self.modelo.get_sentence_embedding_dimension()
+        self.nombre = f"st-{modelo.replace('/', '_')}"
+
+    def vectorizar(self, textos):
+        vectores = self.modelo.encode(list(textos), batch_size=64, convert_to_numpy=True)
+        return _normalizar(vectores.astype(np.float32))
+
+
+EMBEDDERS = {
+    'hashing': EmbedderHashing,
+    'sentence-transformers': EmbedderSentenceTransformers,
+}
+
+
+def _normalizar(matriz):
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return matriz / normas
+
+
+def obtener_embedder():
+    """Embedder según BIBLIOTECA_EMBEDDER (nombre registrado o ruta a una clase)"""
+    nombre = getattr(settings, 'BIBLIOTECA_EMBEDDER', 'hashing')
+    opciones = getattr(settings, 'BIBLIOTECA_EMBEDDER_OPCIONES', {})
+    clase = EMBEDDERS[nombre] if nombre in EMBEDDERS else import_string(nombre)
+    return clase(**opciones)
+
+
+def _top_k(puntuaciones, k):
+    """Índices de las k mayores puntuaciones de cada fila, de mayor a menor"""
+    k = min(k, puntuaciones.shape[1])
+    if k == 0:
+        return np.empty((puntuaciones.shape[0], 0), dtype=np.int64)
+    mejores = np.argpartition(-puntuaciones, k - 1, axis=1)[:, :k]
+    orden = np.argsort(-np.take_along_axis(puntuaciones, mejores, axis=1), axis=1)
+    return np.take_along_axis(mejores, orden, axis=1)
+
+
+class IndiceNoConstruido(Exception):
+    """Aún no se ha ejecutado reconstruir_indice_vectorial para este embedder"""
+
+
+class IndiceVectorial:
+    def __init__(self, directorio, embedder):
+        self.embedder = embedder
+        self.directorio = Path(directorio)
+        # El archivo de metadatos apunta a la matriz y los ids vigentes
+        self.ruta_meta = self.directorio / f'{embedder.nombre}.json'
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._version = None
+        self._vaciar()
+
+    def _vaciar(self):
+        self.vectores = np.zeros((0, self.embedder.dimension), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self._ocultos = np.zeros(0, dtype=bool)
+        self._delta = {}
+        self._delta_ids = np.zeros(0, dtype=np.int64)
+        self._delta_matriz = np.zeros((0, self.embedder.dimension), dtype=np.float32)
+        self._sincronizado_hasta = None
+        # Tras la primera sincronización se vuelve a mirar un margen hacia atrás
+        self._con_margen = False
+
+    # Construcción y carga
+
+    def reconstruir(self, tamano_lote=2000):
+        """Vectoriza todo el catálogo y lo escribe en disco; devuelve el número de libros"""
+        from .models import Libro
+
+        marca = Libro.objects.aggregate(marca=Max('fecha_actualizacion'))['marca'] or timezone.now()
+        ids = np.fromiter(Libro.objects.order_by('id').values_list('id', flat=True).iterator(), dtype=np.int64)
+
+        # Archivos con nombre único: los procesos que aún tienen abierta la matriz anterior no se ven afectados
+        os.makedirs(self.directorio, exist_ok=True)
+        sufijo = f'{self.embedder.nombre}-{time.time_ns()}'
+        ruta_vectores = self.directorio / f'{sufijo}.npy'
+        ruta_ids = self.directorio / f'{sufijo}.ids.npy'
+
+        if len(ids):
+            matriz = np.lib.format.open_memmap(
+                ruta_vectores, mode='w+', dtype=np.float32, shape=(len(ids), self.embedder.dimension)
+            )
+        else:
+            # No se puede mapear un array vacío
+            matriz = np.zeros((0, self.embedder.dimension), dtype=np.float32)
+        for inicio in range(0, len(ids), tamano_lote):
+            lote = ids[inicio:inicio + tamano_lote].tolist()
+            libros = Libro.objects.only('titulo', 'autor', 'sinopsis').in_bulk(lote)
+            # Un libro borrado mientras tanto queda como vector nulo (nunca coincide)
+            textos = [
+                documento(libros[i].titulo, libros[i].autor, libros[i].sinopsis) if i in libros else ''
+                for i in lote
+            ]
+            matriz[inicio:inicio + len(lote)] = self.embedder.vectorizar(textos)
+        if len(ids):
+            matriz.flush()
+        else:
+            np.save(ruta_vectores, matriz)
+        del matriz
+        np.save(ruta_ids, ids)
+
+        anterior = self._leer_meta()
+        temporal = self.ruta_meta.with_suffix('.tmp')
+        with open(temporal, 'w') as f:
+            json.dump({
+                'vectores': ruta_vectores.name,
+                'ids': ruta_ids.name,
+                'marca': marca.isoformat(),
+                'dimension': self.embedder.dimension,
+            }, f)
+        # El reemplazo atómico hace que los demás procesos vean la matriz nueva entera o nada
+        os.replace(temporal, self.ruta_meta)
+        if anterior:
+            for nombre in (anterior['vectores'], anterior['ids']):
+                (self.directorio / nombre).unlink(missing_ok=True)
+
+        with self._lock:
+            self._cargar()
+        return len(ids)
+
+    def _leer_meta(self):
+        try:
+            with open(self.ruta_meta) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _cargar(self):
+        self._vaciar()
+        self._mtime = self.ruta_meta.stat().st_mtime_ns
+        meta = self._leer_meta()
+        self.ids = np.load(self.directorio / meta['ids'])
+        if len(self.ids):
+            self.vectores = np.load(self.directorio / meta['vectores'], mmap_mode='r')
+        self._ocultos = np.zeros(len(self.ids), dtype=bool)
+        self._sincronizado_hasta = parse_datetime(meta['marca'])
+        self._version = None
+
+    def preparar(self):
+        """
+        Deja el índice al día: recarga la matriz si otro proceso la reconstruyó
+        y vectoriza los libros modificados si cambió la versión de los textos.
+        Lanza IndiceNoConstruido si la matriz no existe.
+        """
+        with self._lock:
+            try:
+                mtime = self.ruta_meta.stat().st_mtime_ns
+            except FileNotFoundError:
+                contadores.incrementar('vectores_sin_indice')
+                raise IndiceNoConstruido(
+                    f"No existe {self.ruta_meta}: ejecute el comando reconstruir_indice_vectorial"
+                ) from None
+            if mtime != self._mtime:
+                self._cargar()
+
+        version = version_textos()
+        with self._lock:
+            if version != self._version:
+                self._sincronizar()
+                self._version = version
+
+    def _sincronizar(self):
+        from .models import Libro
+
+        cambiados = Libro.objects.all()
+        if not self._con_margen:
+            # Recién cargada: todo lo anterior a la marca ya está en la matriz
+            cambiados = cambiados.filter(fecha_actualizacion__gt=self._sincronizado_hasta)
+        else:
+            cambiados = cambiados.filter(fecha_actualizacion__gte=self._sincronizado_hasta - MARGEN_SINCRONIZACION)
+        filas = list(cambiados.values_list('id', 'titulo', 'autor', 'sinopsis', 'fecha_actualizacion'))
+        if filas:
+            vectores = self.embedder.vectorizar([documento(t, a, s) for _, t, a, s, _ in filas])
+            for (libro_id, *_), vector in zip(filas, vectores):
+                self._delta[libro_id] = vector
+            self._sincronizado_hasta = max(fila[4] for fila in filas)
+            self._con_margen = True
+            self._apilar_delta()
+            contadores.incrementar('vectores_sincronizados', len(filas))
+
+        # Los borrados solo se buscan si faltan libros (un COUNT en vez de leer todos los ids)
+        vivos = int(len(self.ids) - self._ocultos.sum()) + len(self._delta)
+        if Libro.objects.count() < vivos:
+            self._quitar_eliminados()
+            self._apilar_delta()
+
+        if len(self._delta) >= UMBRAL_DELTA:
+            self._fusionar_delta()
+
+    def _apilar_delta(self):
+        self._delta_ids = np.fromiter(self._delta, dtype=np.int64, count=len(self._delta))
+        if self._delta:
+            self._delta_matriz = np.stack(list(self._delta.values()))
+        else:
+            self._delta_matriz = np.zeros((0, self.embedder.dimension), dtype=np.float32)
+
+        # Las filas del archivo sustituidas por la versión nueva dejan de contar
+        posiciones = np.searchsorted(self.ids, self._delta_ids)
+        validas = posiciones < len(self.ids)
+        posiciones = posiciones[validas]
+        self._ocultos[posiciones[self.ids[posiciones] == self._delta_ids[validas]]] = True
+
+    def _quitar_eliminados(self):
+        from .models import Libro
+
+        existentes = np.fromiter(Libro.objects.order_by('id').values_list('id', flat=True).iterator(), dtype=np.int64)
+        self._ocultos |= ~np.isin(self.ids, existentes, assume_unique=True)
+        eliminados = set(self._delta) - set(existentes.tolist())
+        for libro_id in eliminados:
+            del self._delta[libro_id]
+        contadores.incrementar('vectores_eliminados', int(len(eliminados)))
+
+    def _fusionar_delta(self):
+        """
+        Lleva las filas en memoria a la matriz, que deja de estar mapeada: este
+        proceso usa su propia copia hasta la siguiente reconstrucción.
+        """
+        conservadas = ~self._ocultos
+        ids = np.concatenate([self.ids[conservadas], self._delta_ids])
+        orden = np.argsort(ids, kind='stable')
+        self.vectores = np.concatenate([np.asarray(self.vectores)[conservadas], self._delta_matriz])[orden]
+        self.ids = ids[orden]
+        self._ocultos = np.zeros(len(self.ids), dtype=bool)
+        self._delta = {}
+        self._delta_ids = np.zeros(0, dtype=np.int64)
+        self._delta_matriz = np.zeros((0, self.embedder.dimension), dtype=np.float32)
+        contadores.incrementar('vectores_fusiones')
+
+    # Búsqueda
+
+    def buscar_vectores(self, consultas, k=10, excluir=()):
+        """
+        Top-k por similitud coseno para una matriz de consultas (m x d).
+
+        Devuelve una lista (una por consulta) de [(libro_id, similitud)].
+        """
+        consultas = np.atleast_2d(consultas).astype(np.float32)
+        excluir = set(excluir)
+        candidatos = [[] for _ in range(len(consultas))]
+        k_bloque = k + len(excluir)
+
+        for inicio in range(0, len(self.ids), TAMANO_BLOQUE):
+            bloque = np.asarray(self.vectores[inicio:inicio + TAMANO_BLOQUE])
+            # Una fila por consulta para que el top-k recorra memoria contigua
+            puntuaciones = consultas @ bloque.T
+            puntuaciones[:, self._ocultos[inicio:inicio + len(bloque)]] = -np.inf
+            self._acumular(candidatos, puntuaciones, self.ids[inicio:inicio + len(bloque)], k_bloque)
+
+        if len(self._delta_ids):
+            self._acumular(candidatos, consultas @ self._delta_matriz.T, self._delta_ids, k_bloque)
+
+        resultados = []
+        for lista in candidatos:
+            lista.sort(key=lambda c: -c[1])
+            resultados.append([c for c in lista if c[0] not in excluir and c[1] > 0][:k])
+        return resultados
+
+    @staticmethod
+    def _acumular(candidatos, puntuaciones, ids, k):
+        mejores = _top_k(puntuaciones, k)
+        for fila, lista in enumerate(candidatos):
+            for columna in mejores[fila]:
+                puntuacion = puntuaciones[fila, columna]
+                if np.isfinite(puntuacion):
+                    lista.append((int(ids[columna]), round(float(puntuacion), 4)))
+
+    def buscar(self, texto, k=10):
+        return self.buscar_vectores(self.embedder.vectorizar([texto]), k)[0]
+
+    def vector_de(self, libro_id):
+        if libro_id in self._delta:
+            return self._delta[libro_id]
+        posicion = np.searchsorted(self.ids, libro_id)
+        if posicion < len(self.ids) and self.ids[posicion] == libro_id and not self._ocultos[posicion]:
+            return np.asarray(self.vectores[posicion])
+        return None
+
+    def matriz_de(self, libro_ids):
+        """Vectores de varios libros en el orden pedido (fila nula si el libro no está en el índice)"""
+        libro_ids = np.asarray(libro_ids, dtype=np.int64)
+        matriz = np.zeros((len(libro_ids), self.embedder.dimension), dtype=np.float32)
+        if len(self.ids):
+            posiciones = np.minimum(np.searchsorted(self.ids, libro_ids), len(self.ids) - 1)
+            en_archivo = (self.ids[posiciones] == libro_ids) & ~self._ocultos[posiciones]
+            matriz[en_archivo] = self.vectores[posiciones[en_archivo]]
+        for fila, libro_id in enumerate(libro_ids.tolist()):
+            if libro_id in self._delta:
+                matriz[fila] = self._delta[libro_id]
+        return matriz
+
+    def similares(self, libro_id, k=10):
+        vector = self.vector_de(libro_id)
+        if vector is None:
+            return []
+        return self.buscar_vectores(vector, k, excluir={libro_id})[0]
+
+
+_indices = {}
+_indices_lock = threading.Lock()
+
+
+def obtener_indice_vectorial():
+    """
+    Índice del proceso para el embedder y el directorio configurados, ya
+    sincronizado; lanza IndiceNoConstruido si todavía no se ha construido.
+    """
+    directorio = getattr(settings, 'BIBLIOTECA_VECTORES_DIR', None) or Path(settings.BASE_DIR) / 'vectores'
+    clave = (str(directorio), getattr(settings, 'BIBLIOTECA_EMBEDDER', 'hashing'))
+    with _indices_lock:
+        indice = _indices.get(clave)
+        if indice is None:
+            indice = _indices[clave] = IndiceVectorial(directorio, obtener_embedder())
+    indice.preparar()
+    return indice
+
+
+def _como_libros(coincidencias, **filtros):
+    """Convierte [(libro_id, similitud)] en libros con el atributo `puntuacion`, en el mismo orden"""
+    from .models import Libro
+
+    libros = Libro.objects.filter(**filtros).select_related('categoria').in_bulk([i for i, _ in coincidencias])
+    resultado = []
+    for libro_id, similitud in coincidencias:
+        libro = libros.get(libro_id)
+        if libro is not None:
+            libro.puntuacion = similitud
+            resultado.append(libro)
+    return resultado
+
+
+def buscar_semantico(texto, k=10, **filtros):
+    """Libros más parecidos a un texto libre"""
+    return _como_libros(obtener_indice_vectorial().buscar(texto, k), **filtros)
+
+
+def libros_similares(libro_id, k=10, **filtros):
+    """Libros más parecidos a uno del catálogo (sin incluirlo); ninguno si no hay índice"""
+    try:
+        indice = obtener_indice_vectorial()
+    except IndiceNoConstruido:
+        return []
+    return _como_libros(indice.similares(libro_id, k), **filtros)
@@ -1,14 +1,59 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import Libro, Categoria, Consulta, Reserva
+from django.http import StreamingHttpResponse
+from .models import Libro, Categoria, Consulta, Reserva, ReservaDiaria
 from .serializers import LibroSerializer, CategoriaSerializer, ConsultaSerializer, ReservaSerializer, LibroDetalleSerializer
+from .serializers import LibroListaSerializer, serializar_libros_encontrados
 from .ai_bibliotecario import BibliotecarioIA
-from django.db.models import Q
+from .busqueda import obtener_indice
+from .cache_catalogo import contadores, version_catalogo
+from .cache_http import CacheHTTPMixin, resumen_cache
+from .cliente_modelo import estado_interruptores
+from .streaming import eventos_sse
+from .reservas import ReservaNoDisponible, expirar_reservas_vencidas, reservar_libro
+from .importacion import LECTORES, MAX_TAMANO_LOTE, TAMANO_LOTE, importar_libros
+from .exportacion import FORMATOS, filas_exportacion, marca_exportacion
+from .series import INTERVALOS, MAX_DIAS_CONSULTA, obtener_series
+from .vectores import IndiceNoConstruido, buscar_semantico
+from django.db.models import Q, Max
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from datetime import timedelta
 
-class CategoriaViewSet(viewsets.ModelViewSet):
+
+def respuesta_exportacion(request, nombre):
+    """
+    Exporta en streaming (NDJSON o CSV) las filas modificadas después de `since`.
+
+    La cabecera X-Export-Watermark lleva la marca para pasar como `since` en
+    la siguiente y exportar solo lo nuevo. Queda un margen por detrás de lo
+    exportado, así que algunas filas se repiten: el consumidor debe aplicarlas
+    de forma idempotente (ver exportacion.py).
+    """
+    formato = request.query_params.get('formato', 'ndjson')
+    if formato not in FORMATOS:
+        return Response({"error": f"Formato no soportado: {formato}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    desde = request.query_params.get('since')
+    if desde:
+        desde = parse_datetime(desde.replace(' ', '+'))
+        if desde is None:
+            return Response({"error": "since debe ser una fecha ISO 8601"}, status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(desde):
+            desde = timezone.make_aware(desde)
+
+    hasta = timezone.now()
+    content_type, serializar = FORMATOS[formato]
+    response = StreamingHttpResponse(
+        serializar(filas_exportacion(nombre, desde=desde or None, hasta=hasta)),
+        content_type=content_type
+    )
+    response['Content-Disposition'] = f'attachment; filename="{nombre}.{formato}"'
+    response['X-Export-Watermark'] = marca_exportacion(hasta).isoformat()
+    return response
+
+class CategoriaViewSet(CacheHTTPMixin, viewsets.ModelViewSet):
     queryset = Categoria.objects.all()
     serializer_class = CategoriaSerializer
 
@@ -21,14 +66,21 @@ class CategoriaViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
     
-class LibroViewSet(viewsets.ModelViewSet):
+class LibroViewSet(CacheHTTPMixin, viewsets.ModelViewSet):
     queryset = Libro.objects.all()
     serializer_class = LibroSerializer
+    orden_keyset = ('fecha_creacion', 'id')
+
+    def validadores_extra(self, accion):
+        # El detalle incluye los días restantes de la reserva activa: cambia cada día aunque el catálogo no
+        return (timezone.localdate(),) if accion == 'retrieve' else ()
 
     def get_serializer_class(self):
-        """Usa serializer con más detalle para retrieve"""
+        """Usa serializer con más detalle para retrieve y uno sobre .values() para el listado"""
         if self.action == 'retrieve':
             return LibroDetalleSerializer
+        if self.action == 'list':
+            return LibroListaSerializer
         return LibroSerializer
 
     def create(self, request, *args, **kwargs):
@@ -44,6 +96,10 @@ class LibroViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """Permite búsquedas simples por título, autor, categoría, disponibilidad o fecha"""
         queryset = Libro.objects.all()
+        if self.action == 'retrieve':
+            queryset = queryset.select_related('categoria', 'reserva_activa')
+        elif self.action != 'list':
+            queryset = queryset.select_related('categoria')
         query = self.request.query_params.get('q')
         categoria = self.request.query_params.get('categoria')
         disponible = self.request.query_params.get('disponible')
@@ -51,11 +107,7 @@ class LibroViewSet(viewsets.ModelViewSet):
         fecha_hasta = self.request.query_params.get('fecha_hasta')
         
         if query:
-            queryset = queryset.filter(
-                Q(titulo__icontains=query) | 
-                Q(autor__icontains=query) |
-                Q(sinopsis__icontains=query)
-            )
+            queryset = self.filtrar_texto(queryset, query)
             
         if categoria:
             queryset = queryset.filter(categoria__nombre__icontains=categoria)
@@ -69,20 +121,90 @@ class LibroViewSet(viewsets.ModelViewSet):
             
         if fecha_hasta:
             queryset = queryset.filter(fecha_creacion__lte=fecha_hasta)
+        
+        if self.action == 'list':
+            queryset = LibroListaSerializer.queryset(queryset)
             
         return queryset
+
+    def filtrar_texto(self, queryset, query):
+        """Filtra por el índice de texto completo, ordenando por relevancia"""
+        indice = obtener_indice()
+        if indice is None:
+            return queryset.filter(
+                Q(titulo__icontains=query) | 
+                Q(autor__icontains=query) |
+                Q(sinopsis__icontains=query)
+            )
+
+        return indice.filtrar(queryset, query)
     
+    @action(detail=False, methods=['get'])
+    def semantica(self, request):
+        """
+        Búsqueda semántica local (?q=...&k=10), sin llamar al modelo. Responde
+        503 mientras no se haya construido el índice (reconstruir_indice_vectorial).
+        """
+        texto = request.query_params.get('q', '')
+        if not texto:
+            return Response({"error": "Se requiere el parámetro q"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            k = max(1, min(int(request.query_params.get('k', 10)), 100))
+        except ValueError:
+            return Response({"error": "k debe ser un número entero"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            libros = buscar_semantico(texto, k)
+        except IndiceNoConstruido:
+            return Response(
+                {"error": "El índice semántico todavía no está construido"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        return Response(serializar_libros_encontrados(libros, request))
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def exportar(self, request):
+        """Exporta el catálogo completo o incremental (?since=...&formato=ndjson|csv)"""
+        return respuesta_exportacion(request, 'libros')
+
+    @action(detail=False, methods=['post'])
+    def importar(self, request):
+        """
+        Importa libros en bloque desde NDJSON o CSV.
+
+        El cuerpo se lee como flujo (o el archivo 'archivo' si es multipart) y se
+        procesa por lotes; devuelve el informe con los errores de cada lote.
+        """
+        formato = request.query_params.get('formato')
+        if not formato:
+            formato = 'csv' if 'csv' in (request.content_type or '') else 'ndjson'
+        if formato not in LECTORES:
+            return Response(
+                {"error": f"Formato no soportado: {formato}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if (request.content_type or '').startswith('multipart/'):
+            entrada = request.FILES.get('archivo')
+        else:
+            entrada = request.stream
+        if entrada is None:
+            return Response({"error": "No se recibió contenido"}, status=status.HTTP_400_BAD_REQUEST)
+
+        lote = request.query_params.get('lote', str(TAMANO_LOTE))
+        if not lote.isdigit() or not 1 <= int(lote) <= MAX_TAMANO_LOTE:
+            return Response(
+                {"error": f"lote debe ser un entero entre 1 y {MAX_TAMANO_LOTE}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        resumen = importar_libros(LECTORES[formato](entrada), tamano_lote=int(lote))
+        return Response(resumen)
+
     @action(detail=True, methods=['post'])
     def reservar(self, request, pk=None):
         """Reserva un libro"""
         libro = self.get_object()
         
-        if not libro.puede_reservarse():
-            return Response(
-                {"error": "El libro no está disponible para reserva"}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
         usuario_nombre = request.data.get('usuario_nombre')
         usuario_email = request.data.get('usuario_email')
         dias_prestamo = int(request.data.get('dias_prestamo', 14))
@@ -95,16 +217,16 @@ class LibroViewSet(viewsets.ModelViewSet):
         
         fecha_vencimiento = timezone.now() + timedelta(days=dias_prestamo)
         
-        reserva = Reserva.objects.create(
-            libro=libro,
-            usuario_nombre=usuario_nombre,
-            usuario_email=usuario_email,
-            fecha_vencimiento=fecha_vencimiento,
-            notas=request.data.get('notas', '')
-        )
-        
-        libro.disponible = False
-        libro.save()
+        try:
+            reserva = reservar_libro(
+                libro.id,
+                usuario_nombre=usuario_nombre,
+                usuario_email=usuario_email,
+                fecha_vencimiento=fecha_vencimiento,
+                notas=request.data.get('notas', '')
+            )
+        except ReservaNoDisponible as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
         serializer = ReservaSerializer(reserva)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -114,7 +236,7 @@ class LibroViewSet(viewsets.ModelViewSet):
         """Devuelve un libro (completa la reserva activa)"""
         libro = self.get_object()
         
-        reserva = libro.reservas.filter(estado='activa').first()
+        reserva = libro.reserva_activa
         
         if not reserva:
             return Response(
@@ -131,13 +253,19 @@ class LibroViewSet(viewsets.ModelViewSet):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-class BibliotecarioViewSet(viewsets.ViewSet):
+class BibliotecarioViewSet(CacheHTTPMixin, viewsets.ViewSet):
     """ViewSet para interactuar con el asistente de IA"""
+    acciones_condicionales = ('disponibilidad',)
+    acciones_renderizadas = ()
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.bibliotecario = BibliotecarioIA()
     
+    def validadores_extra(self, accion):
+        # La respuesta incluye los días restantes de la reserva: cambia cada día aunque el catálogo no
+        return (timezone.localdate(),)
+    
     @action(detail=False, methods=['post'])
     def consulta(self, request):
         texto_consulta = request.data.get('consulta', '')
@@ -148,7 +276,8 @@ class BibliotecarioViewSet(viewsets.ViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        consulta = Consulta(texto=texto_consulta)
+        # Antes de responder: si el catálogo cambia durante la llamada, la consulta no se precarga
+        consulta = Consulta(texto=texto_consulta, version_catalogo=version_catalogo())
         
         resultado = self.bibliotecario.procesar_consulta(texto_consulta)
         
@@ -169,11 +298,7 @@ class BibliotecarioViewSet(viewsets.ViewSet):
         
         resultado = self.bibliotecario.buscar_libros(texto_consulta)
         
-        libros_serializados = LibroSerializer(
-            resultado["libros"], 
-            many=True, 
-            context={'request': request}
-        ).data
+        libros_serializados = serializar_libros_encontrados(resultado["libros"], request)
         
         return Response({
             "libros": libros_serializados,
@@ -181,9 +306,38 @@ class BibliotecarioViewSet(viewsets.ViewSet):
             "sugerencias": resultado["sugerencias"]
         })
     
+    @action(detail=False, methods=['post'])
+    def consulta_stream(self, request):
+        """Igual que consulta, pero envía la respuesta como Server-Sent Events"""
+        return self._respuesta_stream(request, buscar=False)
+    
+    @action(detail=False, methods=['post'])
+    def buscar_libros_stream(self, request):
+        """Igual que buscar_libros, pero envía la respuesta como Server-Sent Events"""
+        return self._respuesta_stream(request, buscar=True)
+    
+    def _respuesta_stream(self, request, buscar):
+        texto_consulta = request.data.get('consulta', '')
+        
+        if not texto_consulta:
+            return Response(
+                {"error": "La consulta no puede estar vacía"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        response = StreamingHttpResponse(
+            eventos_sse(self.bibliotecario, texto_consulta, request, buscar=buscar),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
     @action(detail=True, methods=['get'])
     def sugerencias(self, request, pk=None):
-        resultado = self.bibliotecario.obtener_sugerencias(pk)
+        """Libros parecidos (tabla precalculada); ?explicar=1 pide al modelo redactar la explicación"""
+        explicar = request.query_params.get('explicar') in ('1', 'true')
+        resultado = self.bibliotecario.obtener_sugerencias(pk, explicar=explicar)
         return Response(resultado)
     
     @action(detail=True, methods=['get'])
@@ -192,23 +346,72 @@ class BibliotecarioViewSet(viewsets.ViewSet):
         resultado = self.bibliotecario.consultar_disponibilidad(pk)
         return Response(resultado)
     
+    @action(detail=False, methods=['get'])
+    def estado_modelo(self, request):
+        """Estado del circuit breaker y contadores de llamadas al modelo"""
+        return Response({
+            "interruptores": estado_interruptores(),
+            "contadores": {
+                nombre: valor for nombre, valor in contadores.obtener().items() if nombre.startswith('modelo_')
+            },
+        })
+    
+    @action(detail=False, methods=['get'])
+    def estado_cache(self, request):
+        """Aciertos, fallos y tasa de aciertos de las cachés (HTTP, contexto y respuestas del modelo)"""
+        return Response(resumen_cache())
+    
     @action(detail=False, methods=['get'])
     def estadisticas(self, request):
         """Obtiene estadísticas sobre reservas y libros"""
         resultado = self.bibliotecario.obtener_estadisticas_reservas()
         return Response(resultado)
+    
+    @action(detail=False, methods=['get'], url_path='estadisticas/series')
+    def series(self, request):
+        """
+        Reservas, devoluciones, duración media y tasa de atraso por día o semana
+        y categoría (?desde=&hasta=AAAA-MM-DD, ?intervalo=dia|semana, ?categoria=id, 0 = sin categoría).
+        Se lee de los agregados que mantiene el comando actualizar_series.
+        """
+        try:
+            hasta = parse_date(request.query_params.get('hasta', '')) or timezone.localdate()
+            desde = parse_date(request.query_params.get('desde', '')) or hasta - timedelta(days=29)
+        except ValueError:
+            return Response({"error": "desde y hasta deben ser fechas AAAA-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        intervalo = request.query_params.get('intervalo', 'dia')
+        if intervalo not in INTERVALOS:
+            return Response({"error": f"Intervalo no soportado: {intervalo}"}, status=status.HTTP_400_BAD_REQUEST)
+        if desde > hasta or (hasta - desde).days > MAX_DIAS_CONSULTA:
+            return Response(
+                {"error": f"El rango debe ir de desde a hasta y abarcar como mucho {MAX_DIAS_CONSULTA} días"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        categoria = request.query_params.get('categoria')
+        if categoria is not None and not categoria.isdigit():
+            return Response({"error": "categoria debe ser un id numérico"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "desde": desde.isoformat(),
+            "hasta": hasta.isoformat(),
+            "intervalo": intervalo,
+            "actualizado": ReservaDiaria.objects.aggregate(actualizado=Max('fecha_calculo'))['actualizado'],
+            "series": obtener_series(desde, hasta, intervalo, None if categoria is None else int(categoria)),
+        })
 
 class ConsultaViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Consulta.objects.all().order_by('-fecha')
     serializer_class = ConsultaSerializer
+    orden_keyset = ('-fecha', '-id')
 
 class ReservaViewSet(viewsets.ModelViewSet):
     queryset = Reserva.objects.all()
     serializer_class = ReservaSerializer
+    orden_keyset = ('fecha_reserva', 'id')
     
     def get_queryset(self):
         """Permite filtrar reservas por estado, email, o libro"""
-        queryset = Reserva.objects.all()
+        queryset = Reserva.objects.select_related('libro')
         estado = self.request.query_params.get('estado')
         email = self.request.query_params.get('email')
         libro_id = self.request.query_params.get('libro')
@@ -238,18 +441,37 @@ class ReservaViewSet(viewsets.ModelViewSet):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    @action(detail=False, methods=['get'], url_path='export')
+    def exportar(self, request):
+        """Exporta el historial de reservas completo o incremental (?since=...&formato=ndjson|csv)"""
+        return respuesta_exportacion(request, 'reservas')
+    
+    @action(detail=False, methods=['post'])
+    def cancelar_lote(self, request):
+        """Cancela varias reservas a la vez (body: {"ids": [...]})"""
+        return self._cerrar_lote(request, 'bulk_cancelar', 'reservas_canceladas')
+    
+    @action(detail=False, methods=['post'])
+    def completar_lote(self, request):
+        """Completa varias reservas a la vez (body: {"ids": [...]})"""
+        return self._cerrar_lote(request, 'bulk_completar', 'reservas_completadas')
+    
+    def _cerrar_lote(self, request, metodo, clave):
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not ids:
+            return Response(
+                {"error": "Se requiere una lista de ids de reservas"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            ids = [int(i) for i in ids]
+        except (TypeError, ValueError):
+            return Response({"error": "Los ids deben ser números"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        cantidad = getattr(Reserva.objects.filter(id__in=ids), metodo)()
+        return Response({clave: cantidad})
+    
     @action(detail=False, methods=['post'])
     def verificar_vencidas(self, request):
         """Marca como vencidas las reservas que pasaron su fecha de vencimiento"""
-        reservas_vencidas = Reserva.objects.filter(
-            estado='activa',
-            fecha_vencimiento__lt=timezone.now()
-        )
-        
-        count = 0
-        for reserva in reservas_vencidas:
-            reserva.estado = 'vencida'
-            reserva.save()
-            count += 1
-        
-        return Response({"reservas_vencidas": count})
+        return Response(expirar_reservas_vencidas())
@@ -1,5 +1,5 @@
 import { useState, useEffect, useRef } from 'react';
-import { enviarConsulta, buscarLibros } from '../services/api';
+import { enviarConsulta, buscarLibrosStream } from '../services/api';
 
 const Librarian = ({ onSearchResults }) => {
   const [query, setQuery] = useState('');
@@ -35,41 +35,44 @@ const Librarian = ({ onSearchResults }) => {
     setQuery('');
     
     try {
-      // Buscar libros con la consulta
-      const resultados = await buscarLibros(userMessage);
-      
-      let respuesta = '';
-      
-      // Crear respuesta basada en los resultados
-      if (resultados.explicacion) {
-        respuesta = resultados.explicacion;
-      } else if (resultados.libros && resultados.libros.length > 0) {
-        respuesta = `He encontrado ${resultados.libros.length} libros que podrían interesarte.`;
-      } else {
-        respuesta = "No he encontrado libros que coincidan con tu búsqueda. Seguiré mostrando el catálogo completo para que puedas explorar.";
-      }
+      // Buscar libros con la consulta; la explicación se muestra a medida que llega
+      let textoRecibido = '';
+      const resultados = await buscarLibrosStream(userMessage, (delta) => {
+        const primerFragmento = !textoRecibido;
+        textoRecibido += delta;
+        const contenido = textoRecibido;
+        setIsTyping(false);
+        setConversationHistory(prev => primerFragmento
+          ? [...prev, { role: 'bibliotecario', content: contenido }]
+          : [...prev.slice(0, -1), { role: 'bibliotecario', content: contenido }]
+        );
+      });
       
-      // Simular el tiempo de escritura antes de mostrar la respuesta completa
-      // para que se vea más natural, especialmente con respuestas largas
-      setTimeout(() => {
-        // Actualizar la conversación con la respuesta del bibliotecario
+      // Si el modelo no envió texto, crear la respuesta a partir de los resultados
+      if (!textoRecibido) {
+        let respuesta = '';
+        if (resultados.libros && resultados.libros.length > 0) {
+          respuesta = `He encontrado ${resultados.libros.length} libros que podrían interesarte.`;
+        } else {
+          respuesta = "No he encontrado libros que coincidan con tu búsqueda. Seguiré mostrando el catálogo completo para que puedas explorar.";
+        }
         setConversationHistory(prev => [
           ...prev,
           { role: 'bibliotecario', content: respuesta }
         ]);
-        
-        // Actualizar sugerencias si existen
-        if (resultados.sugerencias && resultados.sugerencias.length > 0) {
-          setSuggestions(resultados.sugerencias);
-        }
-        
-        // Pasar los resultados al componente padre
-        onSearchResults(resultados);
-        
-        // Finalizar estados de carga y escritura
-        setIsTyping(false);
-        setIsLoading(false);
-      }, 800); // Añadimos un retraso para simular el tiempo de escritura
+      }
+      
+      // Actualizar sugerencias si existen
+      if (resultados.sugerencias && resultados.sugerencias.length > 0) {
+        setSuggestions(resultados.sugerencias);
+      }
+      
+      // Pasar los resultados al componente padre
+      onSearchResults(resultados);
+      
+      // Finalizar estados de carga y escritura
+      setIsTyping(false);
+      setIsLoading(false);
       
     } catch (error) {
       console.error('Error:', error);
@@ -10,6 +10,10 @@ export const fetchLibros = async (params = {}) => {
     if (params.disponible !== undefined) queryParams.append('disponible', params.disponible);
     if (params.fecha_desde) queryParams.append('fecha_desde', params.fecha_desde);
     if (params.fecha_hasta) queryParams.append('fecha_hasta', params.fecha_hasta);
+    // Paginación por clave: la respuesta trae `next` con el cursor de la página siguiente
+    if (params.paginacion) queryParams.append('paginacion', params.paginacion);
+    if (params.cursor) queryParams.append('cursor', params.cursor);
+    if (params.page_size) queryParams.append('page_size', params.page_size);
     
     const url = `${API_URL}/libros/?${queryParams.toString()}`;
     const response = await fetch(url);
@@ -62,6 +66,59 @@ export const buscarLibros = async (consulta) => {
   }
 };
 
+// Igual que buscarLibros, pero recibe la respuesta por Server-Sent Events.
+// onTexto(delta) se llama con cada fragmento de la explicación según llega;
+// la promesa se resuelve con el resultado final ({ libros, explicacion, sugerencias }).
+export const buscarLibrosStream = async (consulta, onTexto) => {
+  const response = await fetch(`${API_URL}/bibliotecario/buscar_libros_stream/`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'Accept': 'text/event-stream',
+    },
+    body: JSON.stringify({ consulta }),
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`Error ${response.status} buscando libros`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let resultado = null;
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Los eventos SSE se separan con una línea en blanco
+    let separador;
+    while ((separador = buffer.indexOf('\n\n')) !== -1) {
+      const bloque = buffer.slice(0, separador);
+      buffer = buffer.slice(separador + 2);
+
+      let evento = 'message';
+      let datos = '';
+      for (const linea of bloque.split('\n')) {
+        if (linea.startsWith('event: ')) evento = linea.slice(7);
+        else if (linea.startsWith('data: ')) datos += linea.slice(6);
+      }
+      const payload = JSON.parse(datos);
+
+      if (evento === 'texto') {
+        onTexto?.(payload.delta);
+      } else if (evento === 'resultado') {
+        resultado = payload;
+      } else if (evento === 'error') {
+        throw new Error(payload.respuesta);
+      }
+    }
+  }
+
+  return resultado;
+};
+
 // Funciones para reservas
 export const reservarLibro = async (libroId, usuarioNombre, usuarioEmail, diasPrestamo = 14, notas = '') => {
   try {